@@ -0,0 +1,81 @@
+"""
+Consulta de la última release en GitHub, con caché en disco.
+
+ultima_release guarda el JSON de la release y su ETag en un archivo. Dentro de
+`intervalo` devuelve lo guardado sin consultar; si no, revalida con
+If-None-Match (un 304 no cuenta para la cuota de la API). Es bloqueante:
+desde la ventana se llama en una tarea en segundo plano.
+"""
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+API_BASE = "https://api.github.com"
+TIMEOUT  = 8
+
+
+def _leer_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar_cache(path, cache):
+    """Escribe la caché de forma atómica (archivo temporal + os.replace)."""
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass   # sin caché la próxima vez simplemente se vuelve a consultar
+
+
+def ultima_release(repo, cache_path, token=None, user_agent="Co-op_Stock_Manager",
+                   api_base=API_BASE, intervalo=0, timeout=TIMEOUT, now=None):
+    """
+    JSON de la última release de `repo` (dict). Dentro del intervalo devuelve lo
+    guardado, que puede ser None si el intento anterior falló.
+    - `intervalo`: segundos durante los que se usa la caché sin consultar (0 = consultar siempre).
+    - Errores de red o HTTP (salvo 304) se propagan (urllib.error.URLError / HTTPError),
+      pero igual se anota la hora del intento para respetar el intervalo.
+    """
+    now = time.time() if now is None else now
+    url = f"{api_base.rstrip('/')}/repos/{repo}/releases/latest"
+    cache = _leer_cache(cache_path)
+    if cache.get("url") != url:
+        cache = {"url": url}
+
+    checked = cache.get("checked")
+    if intervalo and checked is not None and 0 <= now - checked < intervalo:
+        return cache.get("release")
+
+    headers = {
+        "User-Agent": user_agent,
+        "Accept":     "application/vnd.github+json",
+    }
+    if token:
+        headers["Authorization"] = f"token {token}"
+    if cache.get("etag") and cache.get("release") is not None:
+        headers["If-None-Match"] = cache["etag"]
+
+    cache["checked"] = now
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            cache["release"] = json.loads(resp.read().decode("utf-8"))
+            cache["etag"]    = resp.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            _guardar_cache(cache_path, cache)
+            raise
+        # 304: lo guardado sigue vigente
+    except Exception:
+        _guardar_cache(cache_path, cache)
+        raise
+    _guardar_cache(cache_path, cache)
+    return cache.get("release")
@@ -0,0 +1,206 @@
+"""
+Capa de acceso a datos de Co-op Stock Manager.
+
+Mantiene UNA conexión SQLite persistente para toda la aplicación (en lugar de
+abrir y cerrar una conexión en cada llamada) y la configura una sola vez:
+- journal WAL (lecturas sin bloquear escrituras),
+- E/S por mmap y caché de páginas dimensionada,
+- caché de sentencias preparadas (cached_statements de sqlite3).
+
+Uso típico desde main.py:
+    db.configure(DB_PATH)
+    rows = db.query("SELECT ... WHERE categoria = ?", (cat,))
+    with db.transaction() as conn:
+        conn.execute("UPDATE ...", params)
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Tamaños pensados para bases de ~50k-500k filas en PCs modestas
+MMAP_SIZE          = 256 * 1024 * 1024   # 256 MB de mmap (se limita al tamaño real del archivo)
+CACHE_SIZE_KB      = 32 * 1024           # 32 MB de caché de páginas
+CACHED_STATEMENTS  = 256                 # sentencias preparadas que se reutilizan
+BUSY_TIMEOUT_S     = 5.0
+BACKUP_PAGES       = 1024                # páginas por paso de backup/restore (avance y cancelación)
+
+_path = None
+_conn = None
+# RLock: una misma función puede anidar query() dentro de transaction()
+_lock = threading.RLock()
+
+
+def _apply_pragmas(conn):
+    """Configura una conexión recién abierta (WAL, mmap, caché)."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def configure(path):
+    """Fija la ruta de la base. Si había una conexión abierta a otra ruta, la cierra."""
+    global _path
+    with _lock:
+        if _conn is not None and path != _path:
+            close()
+        _path = path
+
+
+def connect():
+    """
+    Abre una conexión NUEVA ya configurada a la misma base.
+    Pensado para hilos de trabajo que necesitan su propia conexión
+    (p. ej. importaciones largas); el resto de la app usa get_conn().
+    """
+    if _path is None:
+        raise RuntimeError("db.configure() no fue llamado")
+    conn = sqlite3.connect(
+        _path,
+        timeout=BUSY_TIMEOUT_S,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    _apply_pragmas(conn)
+    return conn
+
+
+def get_conn():
+    """Devuelve la conexión compartida, abriéndola la primera vez."""
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = connect()
+        return _conn
+
+
+def close():
+    """Cierra la conexión compartida (hace checkpoint del WAL)."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            try:
+                _conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+            _conn.close()
+            _conn = None
+
+
+def query(sql, params=()):
+    """Ejecuta un SELECT y devuelve todas las filas."""
+    with _lock:
+        return get_conn().execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    """Ejecuta un SELECT y devuelve la primera fila (o None)."""
+    with _lock:
+        return get_conn().execute(sql, params).fetchone()
+
+
+def scalar(sql, params=(), default=None):
+    """Devuelve la primera columna de la primera fila, o `default` si no hay filas."""
+    row = query_one(sql, params)
+    return default if row is None else row[0]
+
+
+@contextmanager
+def transaction():
+    """
+    Bloque transaccional sobre la conexión compartida:
+    commit al salir sin errores, rollback si salta una excepción.
+    """
+    with _lock:
+        conn = get_conn()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+
+def _backup_progress(progress):
+    """Adapta `progress(restantes, total)` a la firma de Connection.backup."""
+    if progress is None:
+        return None
+    return lambda _status, remaining, total: progress(remaining, total)
+
+
+def backup_to(dst_path, progress=None):
+    """
+    Copia consistente de la base a `dst_path` usando la API de backup de SQLite.
+    (Con WAL, copiar el archivo .db a mano podría dejar fuera cambios recientes.)
+    Usa una conexión propia, no la compartida: puede correr en un hilo de trabajo
+    sin frenar a la ventana. `progress(restantes, total)` se llama cada BACKUP_PAGES
+    páginas; si lanza una excepción, la copia se aborta.
+    La copia se escribe en `dst_path`.tmp y sólo al terminar se renombra: un backup
+    cancelado o fallido no deja en su lugar un archivo vacío o a medias.
+    """
+    tmp = f"{dst_path}.tmp"
+    src = connect()
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES, progress=_backup_progress(progress))
+        dst.close()
+        os.replace(tmp, dst_path)
+    except BaseException:
+        dst.close()
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    finally:
+        src.close()
+    return dst_path
+
+
+def restore_from(src_path, progress=None):
+    """
+    Reemplaza el contenido de la base activa por el de `src_path` (sin cerrar la
+    conexión compartida, que ve los datos nuevos en su próxima consulta).
+    Escribe por una conexión propia, como backup_to.
+    """
+    if not os.path.exists(src_path):
+        raise FileNotFoundError(src_path)
+    src = sqlite3.connect(src_path)
+    dst = connect()
+    try:
+        src.backup(dst, pages=BACKUP_PAGES, progress=_backup_progress(progress))
+    finally:
+        dst.close()
+        src.close()
+
+
+def migrate(migrations):
+    """
+    Aplica las migraciones pendientes, registrando la versión en PRAGMA user_version.
+    - `migrations` es una lista de (descripcion, funcion(conn)); la versión de cada
+      migración es su posición en la lista empezando en 1.
+    - Cada migración corre en su propia transacción junto con el cambio de versión:
+      si falla, la base queda en la versión anterior.
+    Devuelve la versión final del esquema.
+    """
+    with _lock:
+        conn = get_conn()
+        if conn.in_transaction:
+            conn.commit()
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, (_desc, fn) in enumerate(migrations, start=1):
+            if version <= current:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                fn(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            current = version
+        return current
@@ -0,0 +1,222 @@
+"""
+Informes PDF de Co-op Stock Manager.
+
+TablaPDF dibuja tablas largas página por página con el canvas de reportlab, a
+partir de un iterable de filas (p. ej. un cursor de SQLite), sin armar el
+documento entero en memoria. comando_trabajo / main generan un PDF en un
+proceso aparte, que avisa por stdout cuántas filas lleva.
+"""
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from urllib.request import pathname2url
+
+from reportlab.lib import colors  #type: ignore
+from reportlab.lib.pagesizes import A4  #type: ignore
+from reportlab.lib.utils import simpleSplit  #type: ignore
+from reportlab.pdfgen import canvas as pdf_canvas  #type: ignore
+from reportlab.platypus import Table, TableStyle  #type: ignore
+
+MARGIN     = 40
+FONT       = "Helvetica"
+FONT_BOLD  = "Helvetica-Bold"
+FONT_SIZE  = 7
+LEADING    = 8.5          # alto de renglón dentro de una celda
+PADDING    = 2            # relleno superior/inferior/lateral de cada celda
+HEADER_GAP = 14           # espacio para el título sobre la tabla
+FOOTER_GAP = 14           # espacio para el número de página
+
+# Ancho relativo de cada columna (las que no figuran valen 1)
+COLUMN_WEIGHTS = {
+    "categoria":    1.3,
+    "cantidad":     0.8,
+    "codigo":       1.2,
+    "descripcion":  3.2,
+    "iva":          0.6,
+    "bnf":          0.6,
+    "precio_final": 1.1,
+    "fecha_retiro": 1.1,
+}
+# Columnas que se alinean a la derecha
+NUMERIC_COLUMNS = {"cantidad", "iva", "precio_lista", "bnf", "precio_final", "importe", "orden",
+                   "productos", "unidades", "valor_lista", "bajo_stock"}
+
+# Argumento con el que el ejecutable empaquetado arranca como proceso de informes
+WORKER_FLAG = "--informe-pdf"
+
+
+def _texto(fmt, value):
+    """Celda como texto (mismo criterio que _fmt en main.py: sin formato o no numérico, tal cual)."""
+    if value is None:
+        return ""
+    if fmt is None:
+        return str(value)
+    try:
+        return fmt.format(value)
+    except (ValueError, TypeError):
+        return str(value)
+
+
+class TablaPDF:
+    """
+    Tabla PDF que se escribe en streaming: write(filas) dibuja páginas a medida
+    que junta las filas que entran en una, y close() termina el archivo.
+    - `columns`: nombres de columna en el orden de las filas recibidas.
+    - `labels`:  encabezado de cada columna (dict nombre -> etiqueta).
+    - `formats`: formato de presentación por columna (p. ej. "{:.2f} $").
+    - `wrap`:    columna que se parte en renglones; las demás van en uno solo.
+    - `on_page`: si se indica, se llama con las filas escritas hasta el momento
+      cada vez que se completa una página.
+    """
+
+    def __init__(self, path, columns, labels, formats=None, wrap="descripcion",
+                 title=None, pagesize=A4, on_page=None):
+        self.path    = path
+        self.on_page = on_page
+        self.columns = list(columns)
+        self.formats = [(formats or {}).get(c) for c in self.columns]
+        self.title   = title
+        self.pages   = 0
+        self.rows    = 0
+        self._canvas = pdf_canvas.Canvas(path, pagesize=pagesize, pageCompression=1)
+        self._page_w, self._page_h = pagesize
+        self._stamp  = datetime.now().strftime("%d/%m/%Y %H:%M")
+
+        usable_w = self._page_w - 2 * MARGIN
+        weights  = [COLUMN_WEIGHTS.get(c, 1.0) for c in self.columns]
+        self._widths = [usable_w * w / sum(weights) for w in weights]
+        self._wrap   = self.columns.index(wrap) if wrap in self.columns else None
+        if self._wrap is not None:
+            self._wrap_w = self._widths[self._wrap] - 2 * PADDING
+        self._avail_h = self._page_h - 2 * MARGIN - HEADER_GAP - FOOTER_GAP
+        self._header  = [labels.get(c, c) for c in self.columns]
+        self._header_h = LEADING + 2 * PADDING
+        # Una descripción que no entraría ni sola en una página se corta
+        self._max_lines = max(1, int((self._avail_h - self._header_h - 2 * PADDING) // LEADING))
+
+        # El mismo TableStyle sirve para todas las páginas
+        commands = [
+            ("FONT",          (0, 0), (-1, -1), FONT, FONT_SIZE, LEADING),
+            ("FONT",          (0, 0), (-1, 0),  FONT_BOLD, FONT_SIZE, LEADING),
+            ("GRID",          (0, 0), (-1, -1), 0.5, colors.grey),
+            ("BACKGROUND",    (0, 0), (-1, 0),  colors.lightblue),
+            ("VALIGN",        (0, 0), (-1, -1), "TOP"),
+            ("TOPPADDING",    (0, 0), (-1, -1), PADDING),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), PADDING),
+            ("LEFTPADDING",   (0, 0), (-1, -1), PADDING),
+            ("RIGHTPADDING",  (0, 0), (-1, -1), PADDING),
+        ]
+        for i, c in enumerate(self.columns):
+            if c in NUMERIC_COLUMNS:
+                commands.append(("ALIGN", (i, 1), (i, -1), "RIGHT"))
+        self._style = TableStyle(commands)
+
+        self._page   = []     # filas (ya como texto) de la página en curso
+        self._used_h = self._header_h
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _celdas(self, row):
+        """Fila de la BD -> (celdas de texto, alto de la fila en puntos)."""
+        cells = [_texto(f, v) for f, v in zip(self.formats, row)]
+        lines = 1
+        if self._wrap is not None and cells[self._wrap]:
+            parts = simpleSplit(cells[self._wrap], FONT, FONT_SIZE, self._wrap_w)[:self._max_lines]
+            if len(parts) > 1:
+                lines = len(parts)
+                cells[self._wrap] = "\n".join(parts)
+        return cells, lines * LEADING + 2 * PADDING
+
+    def write(self, rows):
+        """Agrega filas (iterable de tuplas en el orden de `columns`), dibujando cada página llena."""
+        for row in rows:
+            cells, h = self._celdas(row)
+            if self._page and self._used_h + h > self._avail_h:
+                self._flush()
+            self._page.append(cells)
+            self._used_h += h
+            self.rows += 1
+
+    def _flush(self):
+        """Dibuja la página en curso y la cierra."""
+        c = self._canvas
+        top = self._page_h - MARGIN
+        if self.title:
+            c.setFont(FONT_BOLD, 10)
+            c.drawString(MARGIN, top - 10, self.title)
+        c.setFont(FONT, FONT_SIZE)
+        c.drawRightString(self._page_w - MARGIN, top - 10, self._stamp)
+
+        table = Table([self._header] + self._page, colWidths=self._widths)
+        table.setStyle(self._style)
+        _w, h = table.wrapOn(c, self._page_w - 2 * MARGIN, self._avail_h)
+        table.drawOn(c, MARGIN, top - HEADER_GAP - h)
+
+        self.pages += 1
+        c.setFont(FONT, FONT_SIZE)
+        c.drawCentredString(self._page_w / 2, MARGIN - FOOTER_GAP / 2, f"Página {self.pages}")
+        c.showPage()
+        self._page   = []
+        self._used_h = self._header_h
+        if self.on_page is not None:
+            self.on_page(self.rows)
+
+    def close(self):
+        """Dibuja lo que quedó pendiente y guarda el PDF (una página vacía si no hubo filas)."""
+        if self._canvas is None:
+            return
+        if self._page or self.pages == 0:
+            self._flush()
+        self._canvas.save()
+        self._canvas = None
+
+
+# --- Informes en procesos aparte --------------------------------------------
+
+def comando_trabajo(job):
+    """
+    Línea de comando que genera el PDF descrito por `job` en un proceso nuevo.
+    `job` es un dict serializable a JSON con: db, path, sql, params, columns,
+    labels, formats y title. En la app empaquetada (PyInstaller) el ejecutable
+    es main.py, que atiende WORKER_FLAG antes de crear la ventana.
+    """
+    arg = json.dumps(job, ensure_ascii=False)
+    if getattr(sys, "frozen", False):
+        return [sys.executable, WORKER_FLAG, arg]
+    return [sys.executable, os.path.abspath(__file__), arg]
+
+
+def _avisar(rows):
+    """Informa el avance al proceso padre (una línea por página en stdout)."""
+    try:
+        os.write(1, f"{rows}\n".encode("ascii"))
+    except OSError:
+        pass   # sin stdout (p. ej. exe sin consola): el padre sólo verá el final
+
+
+def generar(job):
+    """Genera el PDF de `job` leyendo la base en modo sólo lectura. Devuelve las filas escritas."""
+    conn = sqlite3.connect(f"file:{pathname2url(job['db'])}?mode=ro", uri=True)
+    try:
+        with TablaPDF(job["path"], job["columns"], job["labels"], job.get("formats"),
+                      title=job.get("title"), on_page=_avisar) as pdf:
+            pdf.write(conn.execute(job["sql"], job.get("params", ())))
+        return pdf.rows
+    finally:
+        conn.close()
+
+
+def main(argv):
+    """Punto de entrada de un proceso de informes: `argv` = [job en JSON]."""
+    generar(json.loads(argv[0]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -7,25 +7,60 @@ import tempfile
 import time
 import json as _json
 import sys, os
+import re
 import sqlite3
-import shutil
+import queue
+import bisect
+import threading
+import unicodedata
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import pandas as pd  #type: ignore
 from datetime import datetime
-from reportlab.lib.pagesizes import A4  #type: ignore
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph  #type: ignore
-from reportlab.lib import colors  #type: ignore
-from reportlab.lib.styles import getSampleStyleSheet  #type: ignore
+from contextlib import contextmanager
+from openpyxl import Workbook, load_workbook  #type: ignore
+from openpyxl.cell import WriteOnlyCell  #type: ignore
+import actualizaciones
+import db
+import informes
+import numeros
+import tareas
+
+# El exe empaquetado también hace de proceso de informes PDF (ver informes.comando_trabajo):
+# en ese caso genera el PDF y termina sin crear la ventana.
+if len(sys.argv) > 2 and sys.argv[1] == informes.WORKER_FLAG:
+    sys.exit(informes.main(sys.argv[2:]))
 
 # --- CONSTANTES GLOBALES ---
 DB_NAME      = "stock_co-op.db"
 TABLE_NAME   = "productos"
+FTS_TABLE    = "productos_fts"
+TOTALS_TABLE = "productos_totales"
+TOTALS_ALL   = "*"      # clave de la fila con el total general en TOTALS_TABLE
+LEGACY_TEXT_TABLE = "productos_texto_original"   # textos que la migración 3 no pudo convertir
 BACKUP_DIR   = "backup"
 CONFIG_DIR   = "config"
 MAX_UNDO     = 30
+UNDO_BUDGET_BYTES = 64 * 1024 * 1024   # memoria aproximada máxima del historial de deshacer
+UNDO_ROW_BYTES    = 200                # costo estimado de cada fila registrada (sin descripción)
+UNDO_TASK_ROWS    = 20000              # desde cuántas filas deshacer/rehacer corre en segundo plano
+LOW_STOCK    = 5        # cantidad por debajo de la cual un producto está en "bajo stock"
+ORDEN_GAP    = 1024     # separación entre valores consecutivos de 'orden' (deja lugar para mover sin renumerar)
+
+# Tabla virtual: a partir de VIRTUAL_THRESHOLD filas sólo se dibujan las visibles
+VIRTUAL_THRESHOLD   = 5000
+VIRTUAL_ANCHOR_STEP = 256   # cada cuántas filas se guarda una clave de salto (keyset)
+VIRTUAL_BUFFER      = 64    # filas extra leídas por arriba y por abajo de la vista
+
+SEARCH_DEBOUNCE_MS = 250   # espera sin teclear antes de lanzar la búsqueda
+SEARCH_POLL_MS     = 30    # cada cuánto se revisa si llegó el resultado
+
+IMPORT_CHUNK   = 5000   # filas del CSV que se leen, validan e insertan por tanda
+
+PDF_WORKERS = os.cpu_count() or 1   # procesos simultáneos al imprimir por categoría
 
 VERSION = "v0.1.0"   # incrementar esto cada vez que publique una nueva versión
+UPDATE_CHECK_HOURS = 12   # al arrancar, no se vuelve a consultar GitHub antes de esto (config: update_check_hours)
 
 def _norm_tag(s):
     """
@@ -192,51 +227,58 @@ def _ask_update_custom(parent, title, message, width=760):
     return getattr(win, "_result", "cancel")
 
 
-def check_updates():
+def _consultar_release(intervalo=0):
     """
-    Consulta la última release en GitHub (usa github_repo en config o el repo por defecto).
-    Usa github_token en config para aumentar cuota si está presente.
+    JSON de la última release (usa github_repo / github_token / github_api de config).
+    Bloqueante: llamar desde una tarea en segundo plano. La respuesta se guarda en
+    UPDATE_CACHE_FILE y se revalida con ETag; con `intervalo` (segundos) no se
+    consulta si la última vez fue hace menos que eso. Devuelve (repo, release).
     """
     cfg = load_config()
-    default_repo = "SrBenja/Co-op_Stock_Manager"
-    repo = cfg.get("github_repo", default_repo)
-    if "github_repo" not in cfg:
-        cfg["github_repo"] = repo
-        save_config(cfg)
+    repo = cfg.get("github_repo") or DEFAULT_REPO
+    release = actualizaciones.ultima_release(
+        repo, UPDATE_CACHE_FILE,
+        token=cfg.get("github_token"),
+        user_agent=f"Co-op_Stock_Manager/{VERSION} (+https://github.com/{repo})",
+        api_base=cfg.get("github_api") or actualizaciones.API_BASE,
+        intervalo=intervalo,
+    )
+    return repo, release
 
-    api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-    try:
-        headers = {"User-Agent": f"Co-op_Stock_Manager/{VERSION} (+https://github.com/{repo})"}
-        token = cfg.get("github_token")
-        if token:
-            headers["Authorization"] = f"token {token}"
-        req = urllib.request.Request(api_url, headers=headers)
-        with urllib.request.urlopen(req, timeout=8) as resp:
-            j = _json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
+
+def _error_actualizacion(e):
+    """Mensaje para un fallo al consultar la release (búsqueda manual)."""
+    if isinstance(e, urllib.error.HTTPError):
         if e.code == 404:
             messagebox.showinfo("Actualizaciones", "No se encontraron releases en el repositorio. Seguramente los haya pronto. Disculpe las molestias.")
-            return
         elif e.code == 403:
             messagebox.showerror("Actualizaciones", "Límite de peticiones alcanzado (rate limit). Considere añadir un token en config/config.json como 'github_token' para aumentar la cuota o espere una hora.\nPara más información, visite Ayuda y actualizaciones --> Cómo funciona --> Actualizaciones")
-            return
         else:
             messagebox.showerror("Actualizaciones", f"Error al consultar GitHub: {e}")
-            return
-    except Exception as e:
-        messagebox.showerror("Actualizaciones", f"No se pudo comprobar la actualización:\n{e}")
         return
+    messagebox.showerror("Actualizaciones", f"No se pudo comprobar la actualización:\n{e}")
 
-    latest_tag = j.get("tag_name") or j.get("name") or ""
+
+def _ofrecer_release(repo, j, silencioso=False):
+    """
+    Compara la release `j` con VERSION y, si es otra, ofrece descargarla (Sí),
+    abrirla en el navegador (No) o nada (Cancelar).
+    Con `silencioso` (arranque) no avisa si no hay novedades o no se pudo leer.
+    """
+    if not j:
+        return
+    latest_tag = (j.get("tag_name") or j.get("name") or "").strip()
     body = j.get("body", "") or ""
-    html_url = j.get("html_url", "")
+    html_url = j.get("html_url", "") or ""
 
     if not latest_tag:
-        messagebox.showinfo("Actualizaciones", "No se pudo leer la etiqueta de la última release.")
+        if not silencioso:
+            messagebox.showinfo("Actualizaciones", "No se pudo leer la etiqueta de la última release.")
         return
 
     if _norm_tag(latest_tag) == _norm_tag(VERSION):
-        messagebox.showinfo("Actualizaciones", f"Estás en la última versión: {VERSION}")
+        if not silencioso:
+            messagebox.showinfo("Actualizaciones", f"Estás en la última versión: {VERSION}")
         return
 
     summary = (body[:800] + "...") if len(body) > 800 else body
@@ -250,7 +292,7 @@ def check_updates():
     choice = _ask_update_custom(parent, "Actualización disponible", msg)
 
     if choice == "yes":
-        download_and_install_release_exe(repo, preferred_asset_name="Co-op_Stock_Manager.exe")
+        download_and_install_release_exe(repo, preferred_asset_name="Co-op_Stock_Manager.exe", release=j)
     elif choice == "no":
         if html_url:
             webbrowser.open(html_url)
@@ -261,6 +303,25 @@ def check_updates():
         return
 
 
+def check_updates():
+    """
+    Consulta la última release en GitHub (usa github_repo en config o el repo por defecto).
+    Usa github_token en config para aumentar cuota si está presente.
+    La consulta corre en segundo plano y siempre va a la red (sin esperar el
+    intervalo), aunque revalida con ETag: si nada cambió no gasta cuota.
+    """
+    cfg = load_config()
+    if not cfg.get("github_repo"):
+        cfg["github_repo"] = DEFAULT_REPO
+        save_config(cfg)
+    ejecutor.submit(
+        lambda tarea: _consultar_release(),
+        titulo="Buscar actualizaciones", cancelable=False,
+        on_done=lambda result: _ofrecer_release(*result),
+        on_error=_error_actualizacion,
+    )
+
+
 # RUTAS ABSOLUTAS
 if getattr(sys, "frozen", False):
     BASE_DIR   = os.path.dirname(sys.executable)
@@ -271,6 +332,8 @@ DB_PATH      = os.path.join(BASE_DIR, DB_NAME)
 BACKUP_PATH  = os.path.join(BASE_DIR, BACKUP_DIR)
 CONFIG_PATH  = os.path.join(BASE_DIR, CONFIG_DIR)
 CONFIG_FILE  = os.path.join(CONFIG_PATH, "config.json")
+# Última respuesta de la API de releases (JSON + ETag), ver actualizaciones.py
+UPDATE_CACHE_FILE = os.path.join(CONFIG_PATH, "release_cache.json")
 
 def load_config():
     try:
@@ -306,30 +369,420 @@ def ensure_dirs():
     os.makedirs(BACKUP_PATH, exist_ok=True)
     os.makedirs(CONFIG_PATH, exist_ok=True)
 
+def _renumerar_orden(conn, cat=None, order_by="orden, id", params=None):
+    """
+    Reparte 'orden' como ORDEN_GAP, 2*ORDEN_GAP, ... siguiendo `order_by`
+    (por defecto, el orden actual), en la categoría `cat` o en todas. Una sola sentencia.
+    `params`: parámetros con nombre que use `order_by` (p. ej. {"bloque": ...} para :bloque).
+    """
+    where = "WHERE categoria = :cat" if cat is not None else ""
+    conn.execute(f"""
+        UPDATE {TABLE_NAME} SET orden = r.pos * {ORDEN_GAP}
+          FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY categoria ORDER BY {order_by}) AS pos
+                  FROM {TABLE_NAME} {where}) AS r
+         WHERE {TABLE_NAME}.id = r.id AND {TABLE_NAME}.orden IS NOT r.pos * {ORDEN_GAP}
+    """, {**(params or {}), "cat": cat})
+
+
+def _siguiente_orden(conn, cat):
+    """Valor de 'orden' para agregar un producto al final de `cat`."""
+    last = conn.execute(
+        f"SELECT MAX(orden) FROM {TABLE_NAME} WHERE categoria = ?", (cat,)
+    ).fetchone()[0]
+    return (last or 0) + ORDEN_GAP
+
+
+def _orden_junto_a(conn, ids, target_pid):
+    """
+    Ubica los productos `ids` como un bloque contiguo junto a `target_pid`
+    (después si el bloque venía de arriba, antes si venía de abajo), manteniendo
+    su orden relativo. Si entre los vecinos hay hueco se escriben sólo esas filas;
+    si no, se renumera la categoría con el bloque ya ubicado en una sola sentencia.
+    Devuelve True si hubo que renumerar.
+    """
+    ids = [int(i) for i in ids]
+    target_pid = int(target_pid)
+    if not ids or target_pid in ids:
+        return False
+    dst = conn.execute(f"SELECT orden, id, categoria FROM {TABLE_NAME} WHERE id = ?", (target_pid,)).fetchone()
+    if dst is None:
+        return False
+    t_orden, t_id, cat = dst
+    block_json = _json.dumps(ids)
+    block = conn.execute(f"""
+        SELECT id, orden FROM {TABLE_NAME}
+         WHERE id IN (SELECT value FROM json_each(?)) AND categoria = ?
+         ORDER BY orden, id
+    """, (block_json, cat)).fetchall()
+    if not block:
+        return False
+    ids = [r[0] for r in block]
+    n = len(ids)
+    down = ((block[0][1] or 0), block[0][0]) < ((t_orden or 0), t_id)
+
+    if down:
+        # baja: entre el destino y el siguiente que no sea del bloque
+        nxt = conn.execute(f"""
+            SELECT orden FROM {TABLE_NAME}
+             WHERE categoria = ? AND (orden, id) > (?, ?)
+               AND id NOT IN (SELECT value FROM json_each(?))
+             ORDER BY orden, id LIMIT 1
+        """, (cat, t_orden, t_id, block_json)).fetchone()
+        lo, hi = t_orden, (nxt[0] if nxt else (t_orden or 0) + (n + 1) * ORDEN_GAP)
+    else:
+        # sube: entre el anterior que no sea del bloque y el destino
+        prv = conn.execute(f"""
+            SELECT orden FROM {TABLE_NAME}
+             WHERE categoria = ? AND (orden, id) < (?, ?)
+               AND id NOT IN (SELECT value FROM json_each(?))
+             ORDER BY orden DESC, id DESC LIMIT 1
+        """, (cat, t_orden, t_id, block_json)).fetchone()
+        lo, hi = (prv[0] if prv else (t_orden or 0) - (n + 1) * ORDEN_GAP), t_orden
+
+    if lo is not None and hi is not None and hi - lo > n:
+        # Reparto parejo dentro del hueco: n escrituras
+        conn.executemany(
+            f"UPDATE {TABLE_NAME} SET orden = ? WHERE id = ?",
+            [(lo + (hi - lo) * (k + 1) // (n + 1), pid) for k, pid in enumerate(ids)],
+        )
+        return False
+
+    # Sin hueco: el bloque toma la clave del destino y se desempata justo antes o después
+    in_block = "id IN (SELECT value FROM json_each(:bloque))"
+    _renumerar_orden(conn, cat, order_by=f"""
+        CASE WHEN {in_block} THEN :t_orden ELSE COALESCE(orden, 0) END,
+        CASE WHEN {in_block} THEN :t_id ELSE id END,
+        CASE WHEN {in_block} THEN :lado ELSE 0 END,
+        orden, id
+    """, params={"bloque": block_json, "t_orden": t_orden or 0, "t_id": t_id, "lado": 1 if down else -1})
+    return True
+
+
+def _mig_001_esquema_base(conn):
+    """Tabla de productos (con la columna "orden", agregada si la base es antigua)."""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            categoria       TEXT,
+            codigo          TEXT,
+            descripcion     TEXT,
+            cantidad        INTEGER,
+            precio_lista    REAL,
+            iva             INTEGER,
+            bnf             REAL    DEFAULT 0,
+            precio_final    REAL,
+            importe         REAL,
+            fecha_retiro    TEXT,
+            orden           INTEGER DEFAULT 0
+        )
+    """)
+    # Si la columna "orden" no existe (en bases antiguas), la agregamos
+    cols = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")]
+    if "orden" not in cols:
+        conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN orden INTEGER DEFAULT 0")
+
+
+def _mig_002_indices(conn):
+    """Índices para cargar una categoría ya ordenada y para buscar por código."""
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_cat_orden
+            ON {TABLE_NAME} (categoria, orden, id)
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_codigo ON {TABLE_NAME} (codigo)")
+
+
+_LEGACY_NUMERIC = ["cantidad", "precio_lista", "iva", "bnf", "precio_final", "importe"]
+
+
+def _mig_003_numeros_reales(conn):
+    """
+    Convierte precios, IVA e importe guardados como texto ("123.4 $", "10,5 %")
+    a números (el IVA puede tener decimales). Los símbolos se agregan sólo al
+    mostrar o exportar. Lo que no se puede leer como número (o una cantidad con
+    decimales) queda en 0 / truncado y su texto original se guarda en
+    LEGACY_TEXT_TABLE (id, columna, texto), y al abrir la base se avisa.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LEGACY_TEXT_TABLE} (
+            id      INTEGER NOT NULL,
+            columna TEXT    NOT NULL,
+            texto   TEXT,
+            PRIMARY KEY (id, columna)
+        )
+    """)
+    rows = conn.execute(f"""
+        SELECT id, {', '.join(_LEGACY_NUMERIC)}
+          FROM {TABLE_NAME}
+         WHERE {' OR '.join(f"typeof({c}) = 'text'" for c in _LEGACY_NUMERIC)}
+    """).fetchall()
+    if not rows:
+        return
+    ids = [r[0] for r in rows]
+    columns, lost = [], []
+    for j, col in enumerate(_LEGACY_NUMERIC, start=1):
+        texts = pd.Series([r[j] for r in rows], dtype=object)
+        values, bad = numeros.parse_series(texts)
+        if col == "cantidad":
+            bad |= values % 1 != 0
+            values = values.astype(int)
+        lost += [(ids[i], col, texts[i]) for i in bad[bad].index]
+        columns.append(values.tolist())
+    updates = [(*vals, pid) for pid, *vals in zip(ids, *columns)]
+    conn.executemany(f"""
+        UPDATE {TABLE_NAME}
+           SET {', '.join(f"{c} = ?" for c in _LEGACY_NUMERIC)}
+         WHERE id = ?
+    """, updates)
+    conn.executemany(f"INSERT OR REPLACE INTO {LEGACY_TEXT_TABLE} (id, columna, texto) VALUES (?, ?, ?)", lost)
+
+
+def _mig_004_fts(conn):
+    """
+    Índice de texto completo (FTS5) sobre codigo y descripcion, sincronizado por triggers.
+    El tokenizador quita acentos: "plomeria" encuentra "Plomería".
+    Si esta build de SQLite no trae FTS5, no se crea nada y buscar() usa LIKE.
+    """
+    for tokenize in ("unicode61 remove_diacritics 2", "unicode61 remove_diacritics 1"):
+        try:
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                    codigo, descripcion,
+                    content='{TABLE_NAME}', content_rowid='id',
+                    tokenize='{tokenize}'
+                )
+            """)
+            break
+        except sqlite3.OperationalError as e:
+            if "no such module" in str(e):
+                return
+    else:
+        return
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {TABLE_NAME} BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, codigo, descripcion)
+            VALUES (new.id, new.codigo, new.descripcion);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {TABLE_NAME} BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, codigo, descripcion)
+            VALUES ('delete', old.id, old.codigo, old.descripcion);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF codigo, descripcion ON {TABLE_NAME} BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, codigo, descripcion)
+            VALUES ('delete', old.id, old.codigo, old.descripcion);
+            INSERT INTO {FTS_TABLE} (rowid, codigo, descripcion)
+            VALUES (new.id, new.codigo, new.descripcion);
+        END
+    """)
+    # Indexamos lo que ya existía
+    conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _mig_005_totales(conn):
+    """
+    Tabla de totales (cantidad de productos y valor del stock) por categoría y general,
+    mantenida exacta por triggers. El valor se guarda en centavos (INTEGER) para que
+    las sumas y restas sucesivas no acumulen error de redondeo.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TOTALS_TABLE} (
+            categoria       TEXT PRIMARY KEY NOT NULL,
+            productos       INTEGER NOT NULL DEFAULT 0,
+            valor_centavos  INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    def _delta(alias, sign):
+        # Suma (sign=+1) o resta (sign=-1) la fila `alias` (new/old) a su categoría y al total
+        cents = f"CAST(ROUND(COALESCE({alias}.importe, 0) * 100) AS INTEGER)"
+        return "\n".join(f"""
+            INSERT INTO {TOTALS_TABLE} (categoria, productos, valor_centavos)
+            VALUES ({key}, {sign}, {sign} * {cents})
+            ON CONFLICT (categoria) DO UPDATE
+               SET productos      = productos + excluded.productos,
+                   valor_centavos = valor_centavos + excluded.valor_centavos;
+        """ for key in (f"COALESCE({alias}.categoria, '')", f"'{TOTALS_ALL}'"))
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {TOTALS_TABLE}_ai AFTER INSERT ON {TABLE_NAME} BEGIN
+            {_delta("new", 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {TOTALS_TABLE}_ad AFTER DELETE ON {TABLE_NAME} BEGIN
+            {_delta("old", -1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {TOTALS_TABLE}_au AFTER UPDATE OF categoria, importe ON {TABLE_NAME} BEGIN
+            {_delta("old", -1)}
+            {_delta("new", 1)}
+        END
+    """)
+
+    # Carga inicial con lo que ya existe
+    conn.execute(f"DELETE FROM {TOTALS_TABLE}")
+    cents = "CAST(ROUND(COALESCE(importe, 0) * 100) AS INTEGER)"
+    conn.execute(f"""
+        INSERT INTO {TOTALS_TABLE} (categoria, productos, valor_centavos)
+        SELECT COALESCE(categoria, ''), COUNT(*), SUM({cents}) FROM {TABLE_NAME} GROUP BY 1
+    """)
+    conn.execute(f"""
+        INSERT INTO {TOTALS_TABLE} (categoria, productos, valor_centavos)
+        SELECT '{TOTALS_ALL}', COUNT(*), COALESCE(SUM({cents}), 0) FROM {TABLE_NAME}
+    """)
+
+
+def _mig_006_indice_bajo_stock(conn):
+    """
+    Índice parcial con los productos en bajo stock, para contarlos por categoría sin recorrer la tabla.
+    (La migración 8 lo reemplaza por la columna bajo_stock de TOTALS_TABLE.)
+    """
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_bajo_stock
+            ON {TABLE_NAME} (categoria) WHERE cantidad < {LOW_STOCK}
+    """)
+
+
+def _mig_007_orden_con_huecos(conn):
+    """
+    Renumera 'orden' por categoría a múltiplos de ORDEN_GAP (sin empates ni NULL),
+    para que mover un producto sólo tenga que escribir esa fila.
+    """
+    _renumerar_orden(conn)
+
+
+def _mig_008_totales_bajo_stock(conn):
+    """
+    Agrega a TOTALS_TABLE la cantidad de productos en bajo stock, mantenida por los
+    mismos triggers (regla única: COALESCE(cantidad, 0) < LOW_STOCK, como la fila
+    resaltada en la tabla), y borra el índice parcial de la migración 6.
+    """
+    conn.execute(f"ALTER TABLE {TOTALS_TABLE} ADD COLUMN bajo_stock INTEGER NOT NULL DEFAULT 0")
+    conn.execute(f"DROP INDEX IF EXISTS idx_{TABLE_NAME}_bajo_stock")
+
+    low = f"(COALESCE({{alias}}.cantidad, 0) < {LOW_STOCK})"
+
+    def _delta(alias, sign):
+        # Suma (sign=+1) o resta (sign=-1) la fila `alias` (new/old) a su categoría y al total
+        cents = f"CAST(ROUND(COALESCE({alias}.importe, 0) * 100) AS INTEGER)"
+        return "\n".join(f"""
+            INSERT INTO {TOTALS_TABLE} (categoria, productos, valor_centavos, bajo_stock)
+            VALUES ({key}, {sign}, {sign} * {cents}, {sign} * {low.format(alias=alias)})
+            ON CONFLICT (categoria) DO UPDATE
+               SET productos      = productos + excluded.productos,
+                   valor_centavos = valor_centavos + excluded.valor_centavos,
+                   bajo_stock     = bajo_stock + excluded.bajo_stock;
+        """ for key in (f"COALESCE({alias}.categoria, '')", f"'{TOTALS_ALL}'"))
+
+    for name in ("ai", "ad", "au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {TOTALS_TABLE}_{name}")
+    conn.execute(f"""
+        CREATE TRIGGER {TOTALS_TABLE}_ai AFTER INSERT ON {TABLE_NAME} BEGIN
+            {_delta("new", 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER {TOTALS_TABLE}_ad AFTER DELETE ON {TABLE_NAME} BEGIN
+            {_delta("old", -1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER {TOTALS_TABLE}_au AFTER UPDATE OF categoria, importe, cantidad ON {TABLE_NAME} BEGIN
+            {_delta("old", -1)}
+            {_delta("new", 1)}
+        END
+    """)
+
+    # Carga inicial con lo que ya existe
+    conn.execute(f"""
+        UPDATE {TOTALS_TABLE} AS t
+           SET bajo_stock = (SELECT COUNT(*) FROM {TABLE_NAME} p
+                              WHERE t.categoria IN ('{TOTALS_ALL}', COALESCE(p.categoria, ''))
+                                AND {low.format(alias="p")})
+    """)
+
+
+# Migraciones del esquema, en orden. La versión aplicada se guarda en PRAGMA user_version.
+# NUNCA reordenar ni borrar entradas: sólo agregar nuevas al final.
+MIGRATIONS = [
+    ("Esquema base de productos",           _mig_001_esquema_base),
+    ("Índices (categoria, orden) y codigo", _mig_002_indices),
+    ("Precios, IVA e importe como números", _mig_003_numeros_reales),
+    ("Búsqueda de texto completo (FTS5)",   _mig_004_fts),
+    ("Totales por categoría con triggers",  _mig_005_totales),
+    ("Índice parcial de bajo stock",        _mig_006_indice_bajo_stock),
+    ("Orden con huecos por categoría",      _mig_007_orden_con_huecos),
+    ("Bajo stock en la tabla de totales",   _mig_008_totales_bajo_stock),
+]
+
+# True si la base tiene el índice FTS5 (se calcula en init_db)
+_fts_enabled = False
+
+_FECHA_RE = re.compile(r"(\d{1,4})[/.-](\d{1,2})[/.-](\d{1,4})")
+
+def _fecha_iso(text):
+    """
+    Fecha escrita a mano -> 'aaaa-mm-dd' (comparable como texto), o None si no es una fecha.
+    Acepta 'dd/mm/aaaa', 'd-m-aa', 'dd.mm.aaaa' y 'aaaa-mm-dd'; se ignora una hora al final.
+    Se registra en SQLite como fecha_iso() para filtrar fecha_retiro por rango.
+    """
+    m = _FECHA_RE.match(str(text or "").strip())
+    if not m:
+        return None
+    a, b, c = m.groups()
+    if len(a) == 4:
+        y, mo, d = a, b, c
+    else:
+        d, mo, y = a, b, c
+        if len(y) == 2:
+            y = "20" + y
+    try:
+        return datetime(int(y), int(mo), int(d)).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _avisar_textos_originales():
+    """Avisa qué valores de una base antigua no se pudieron convertir a número (ver _mig_003)."""
+    rows = db.query(f"SELECT id, columna, texto FROM {LEGACY_TEXT_TABLE} ORDER BY id, columna")
+    if not rows:
+        return
+    detalle = "\n".join(f"- id {pid}, {COLUMN_LABELS.get(col, col)}: {texto!r}" for pid, col, texto in rows[:20])
+    if len(rows) > 20:
+        detalle += f"\n… y {len(rows) - 20} más"
+    messagebox.showwarning(
+        "Actualización de la base",
+        f"{len(rows)} valores guardados como texto no se pudieron leer como número "
+        f"y quedaron en 0 (o sin decimales):\n{detalle}\n\n"
+        f"El texto original quedó en la tabla {LEGACY_TEXT_TABLE}."
+    )
+
+
+def _registrar_funciones(conn):
+    """Funciones SQL propias de la app (cada conexión necesita registrarlas)."""
+    conn.create_function("fecha_iso", 1, _fecha_iso, deterministic=True)
+
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        # Si es la primera vez, creamos con la nueva columna "orden"
-        conn.execute(f"""
-            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-                id              INTEGER PRIMARY KEY AUTOINCREMENT,
-                categoria       TEXT,
-                codigo          TEXT,
-                descripcion     TEXT,
-                cantidad        INTEGER,
-                precio_lista    REAL,
-                iva             INTEGER,
-                bnf             REAL    DEFAULT 0,
-                precio_final    REAL,
-                importe         REAL,
-                fecha_retiro    TEXT,
-                orden           INTEGER DEFAULT 0
-            )
-        """)
-        # Si la columna "orden" no existe (en bases antiguas), la agregamos
-        cursor = conn.execute(f"PRAGMA table_info({TABLE_NAME})")
-        cols = [row[1] for row in cursor.fetchall()]
-        if "orden" not in cols:
-            conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN orden INTEGER DEFAULT 0")
+    """Abre y migra la base. Devuelve la versión de esquema que tenía antes de migrar."""
+    global _fts_enabled
+    db.configure(DB_PATH)
+    antes = db.scalar("PRAGMA user_version", default=0)
+    db.migrate(MIGRATIONS)
+    _registrar_funciones(db.get_conn())
+    _fts_enabled = db.scalar(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name = ?", (FTS_TABLE,), default=0
+    ) > 0
+    # Estadísticas para que el planificador elija bien los índices
+    db.get_conn().execute("PRAGMA optimize")
+    # Triggers TEMP del historial de deshacer (viven en la conexión, no en el archivo)
+    undo_journal.install()
+    return antes
 
 # todas las columnas en la BD, incl. 'id'
 COLUMNS = [
@@ -351,51 +804,134 @@ COLUMN_LABELS = {
     "importe":            "Importe",
     "fecha_retiro":       "Fecha de retiro"
 }
-# 4. FUNCIONES DE NEGOCIO (CRUD, snapshots, backup, import/export, imprimir)
-undo_stack, redo_stack = [], []
-current_id = None
 
-def _parse_number_from_db(value):
-    """
-    Convierte valores provenientes de la BD a float:
-    - acepta int/float
-    - acepta cadenas como '123.45 $', '21 %', '1.234,56 $'
-    - devuelve 0.0 si no puede parsear
-    """
+# Formato de presentación (tabla, CSV, PDF). En la BD se guardan números sin símbolos.
+COLUMN_FORMATS = {
+    "precio_lista":       "{:.1f} $",
+    "iva":                "{:g} %",
+    "precio_final":       "{:.3f} $",
+    "importe":            "{:.2f} $",
+}
+
+def _fmt(col, value):
+    """Devuelve `value` listo para mostrar en la columna `col` (agrega $ o % si corresponde)."""
     if value is None:
-        return 0.0
-    if isinstance(value, (int, float)):
-        return float(value)
-    s = str(value).strip()
-    if s == "":
-        return 0.0
-    # Quitamos símbolos y espacios
-    s = s.replace("$", "").replace("%", "").strip()
-    # Normalizamos miles/decimal: '1.234,56' -> '1234.56'
-    # Si hay más de un punto y también una coma, asumimos formato europeo
-    if s.count(".") > 1 and "," in s:
-        s = s.replace(".", "")
-    s = s.replace(",", ".")
+        return ""
+    fmt = COLUMN_FORMATS.get(col)
+    if fmt is None:
+        return value
     try:
-        return float(s)
-    except Exception:
-        return 0.0
+        return fmt.format(value)
+    except (ValueError, TypeError):
+        # Valores no numéricos (p. ej. texto heredado) se muestran tal cual
+        return value
+# 4. FUNCIONES DE NEGOCIO (CRUD, deshacer, backup, import/export, imprimir)
+current_id = None
 
+# Posiciones precalculadas (evita COLUMNS.index() por cada celda)
+_VISIBLE_POS  = [(col, COLUMNS.index(col)) for col in VISIBLE_COLUMNS]
+_IDX_CANTIDAD = COLUMNS.index("cantidad")
 
-def _refresh_tree(rows):
-    tree.delete(*tree.get_children())
+def _tree_values(row):
+    """Valores de una fila de la BD (orden de COLUMNS) tal como se muestran en el Treeview."""
+    return [_fmt(col, row[i]) for col, i in _VISIBLE_POS]
 
+
+def _tree_tags(row):
+    return ("bajo_stock",) if (row[_IDX_CANTIDAD] or 0) < LOW_STOCK else ()
+
+
+# Filas tal como están dibujadas ahora en el Treeview (iid -> fila), para _refresh_tree
+_tree_rows = {}
+
+def _lis_positions(seq):
+    """Índices de una subsecuencia creciente más larga de `seq` (O(n log n))."""
+    tails, tails_idx, prev = [], [], [-1] * len(seq)
+    for i, v in enumerate(seq):
+        k = bisect.bisect_left(tails, v)
+        if k == len(tails):
+            tails.append(v)
+            tails_idx.append(i)
+        else:
+            tails[k] = v
+            tails_idx[k] = i
+        prev[i] = tails_idx[k - 1] if k else -1
+    out = set()
+    i = tails_idx[-1] if tails_idx else -1
+    while i != -1:
+        out.add(i)
+        i = prev[i]
+    return out
+
+
+def _rebuild_tree(rows):
+    """Redibujo completo (carga inicial o cambios masivos), conservando selección y scroll."""
+    y   = tree.yview()[0]
+    sel = tree.selection()
+    tree.delete(*tree.get_children())
+    _tree_rows.clear()
     for row in rows:
-        # construimos los valores en el orden de VISIBLE_COLUMNS
-        vals = [row[COLUMNS.index(col)] for col in VISIBLE_COLUMNS]
-        cantidad = row[COLUMNS.index("cantidad")]
-        tags     = ("bajo_stock",) if cantidad < 5 else ()
-        tree.insert(
-            "", tk.END,
-            iid=str(row[0]),
-            values=vals,
-            tags=tags
-        )
+        iid = str(row[0])
+        tree.insert("", tk.END, iid=iid, values=_tree_values(row), tags=_tree_tags(row))
+        _tree_rows[iid] = row
+    keep = [i for i in sel if i in _tree_rows]
+    if keep:
+        tree.selection_set(keep)
+    tree.yview_moveto(y)
+
+
+def _refresh_tree(rows):
+    """
+    Muestra `rows` en el Treeview tocando sólo lo que cambió respecto de lo dibujado:
+    borra lo que sobra, actualiza filas modificadas, inserta las nuevas y mueve
+    el mínimo de filas (las que quedan fuera de la subsecuencia creciente más larga).
+    Selección y scroll se conservan.
+    """
+    # Listas muy grandes (p. ej. resultados de búsqueda) van en modo virtual
+    if len(rows) > VIRTUAL_THRESHOLD:
+        _tree_rows.clear()
+        virtual_tree.attach(ListSource(rows))
+        update_status()
+        return
+    if virtual_tree.active:
+        virtual_tree.detach()
+        tree.delete(*tree.get_children())
+        _tree_rows.clear()
+
+    new_iids = [str(row[0]) for row in rows]
+    new_pos  = {iid: i for i, iid in enumerate(new_iids)}
+
+    # 1) Borrar lo que ya no está
+    current = tree.get_children()
+    stale = [iid for iid in current if iid not in new_pos]
+    if stale:
+        tree.delete(*stale)
+        for iid in stale:
+            _tree_rows.pop(iid, None)
+    kept = [iid for iid in current if iid in new_pos]
+    present = set(kept)
+
+    # 2) Filas que se quedan pero fuera de orden: las que no están en la LIS
+    in_order = {kept[i] for i in _lis_positions([new_pos[iid] for iid in kept])}
+    n_ops = len(rows) - len(in_order)
+    if n_ops > len(rows) // 2:
+        _rebuild_tree(rows)
+        update_status()
+        return
+
+    # 3) De atrás hacia adelante: cada fila movida/nueva va justo antes de su sucesora
+    next_iid = None
+    for row, iid in zip(reversed(rows), reversed(new_iids)):
+        if iid not in present:
+            index = tree.index(next_iid) if next_iid else tk.END
+            tree.insert("", index, iid=iid, values=_tree_values(row), tags=_tree_tags(row))
+        else:
+            if _tree_rows.get(iid) != row:
+                tree.item(iid, values=_tree_values(row), tags=_tree_tags(row))
+            if iid not in in_order:
+                tree.move(iid, "", tree.index(next_iid) if next_iid else len(new_iids))
+        _tree_rows[iid] = row
+        next_iid = iid
     update_status()
 
 class DropdownMenu:
@@ -495,230 +1031,1052 @@ class DropdownMenu:
             self._root.unbind("<Motion>", self._motion_id)
             self._motion_id = None
 
+class CategoryCache:
+    """
+    Filas de cada categoría ya cargada, en memoria y ordenadas por (orden, id).
+    - La primera vez que se pide una categoría se lee de la BD; después se sirve de memoria.
+    - Las operaciones CRUD actualizan la caché en el lugar (refresh_ids / remove)
+      o descartan lo afectado (invalidate / clear).
+    - Si OTRO proceso o conexión modifica el archivo, PRAGMA data_version cambia
+      y se descarta todo.
+    """
+
+    _IDX_ID     = COLUMNS.index("id")
+    _IDX_CAT    = COLUMNS.index("categoria")
+    _IDX_ORDEN  = COLUMNS.index("orden")
+
+    def __init__(self):
+        self._rows = {}            # categoria -> lista de filas (orden de COLUMNS)
+        self._cat_of = {}          # id -> categoria, de las filas cacheadas
+        self._data_version = None
+
+    @classmethod
+    def _key(cls, row):
+        return (row[cls._IDX_ORDEN] or 0, row[cls._IDX_ID])
+
+    def _check_external(self):
+        v = db.scalar("PRAGMA data_version")
+        if v != self._data_version:
+            self.clear()
+            self._data_version = v
+
+    def get(self, cat):
+        """Filas de `cat` (la lista cacheada: no modificarla)."""
+        self._check_external()
+        rows = self._rows.get(cat)
+        if rows is None:
+            sql = f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE categoria = ? ORDER BY orden, id"
+            rows = self._rows[cat] = db.query(sql, (cat,))
+            for r in rows:
+                self._cat_of[r[self._IDX_ID]] = cat
+        return rows
+
+    def remove(self, ids):
+        """Quita de la caché los productos con esos ids (sólo recorre sus categorías)."""
+        self._check_external()
+        ids = {int(i) for i in ids}
+        cats = {self._cat_of.pop(i) for i in ids if i in self._cat_of}
+        for cat in cats:
+            self._rows[cat] = [r for r in self._rows[cat] if r[self._IDX_ID] not in ids]
+
+    def refresh_ids(self, ids):
+        """Relee esos productos de la BD y los ubica (o quita) en su categoría cacheada."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return
+        self.remove(ids)
+        marks = ",".join("?" * len(ids))
+        fresh = db.query(f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE id IN ({marks})", ids)
+        por_cat = {}
+        for row in fresh:
+            if row[self._IDX_CAT] in self._rows:
+                por_cat.setdefault(row[self._IDX_CAT], []).append(row)
+            # categoría no cargada: se leerá entera cuando se pida
+        for cat, nuevas in por_cat.items():
+            rows = self._rows[cat]
+            keys = [self._key(r) for r in rows]   # una vez por categoría
+            for row in nuevas:
+                key = self._key(row)
+                i = bisect.bisect_left(keys, key)
+                keys.insert(i, key)
+                rows.insert(i, row)
+                self._cat_of[row[self._IDX_ID]] = cat
+
+    def count(self, cat):
+        """Cantidad de filas de `cat` si está cacheada, o None."""
+        self._check_external()
+        rows = self._rows.get(cat)
+        return None if rows is None else len(rows)
+
+    def invalidate(self, cat):
+        """Descarta la categoría `cat` (se releerá de la BD)."""
+        for r in self._rows.pop(cat, ()):
+            self._cat_of.pop(r[self._IDX_ID], None)
+
+    def clear(self):
+        self._rows.clear()
+        self._cat_of.clear()
+
+
+category_cache = CategoryCache()
+
+
+# Expresión de orden por columna para la tabla virtual (NULL se ordena como 0 / "")
+_NUMERIC_COLUMNS = {"cantidad", "iva", "precio_lista", "bnf", "precio_final", "importe"}
+
+def _sort_expr(col, alias=""):
+    """Expresión SQL para ordenar por `col` (None = orden manual); `alias` p. ej. "p."."""
+    if col is None:
+        return f"{alias}orden"
+    return f"COALESCE({alias}{col}, {0 if col in _NUMERIC_COLUMNS else repr('')})"
+
+
+def _sort_value(col, image):
+    """
+    Valor de `_sort_expr(col)` para una fila dada como dict, comparable en Python
+    como lo compara SQLite (NULL antes que los números y los números antes que el texto).
+    """
+    if col is None:
+        v = image.get("orden")
+    else:
+        v = image.get(col)
+        if v is None:
+            v = 0 if col in _NUMERIC_COLUMNS else ""
+    if v is None:
+        return (0, 0)
+    return (2, v) if isinstance(v, str) else (1, v)
+
+
+class KeysetAnchors:
+    """
+    Claves de salto de KeysetSource por (categoría, columna de orden, sentido),
+    para no recorrer la categoría entera en cada cargar_datos.
+    - Cada clave es (valor, id, posición): `posición` = filas que van antes de (valor, id).
+    - ajustar() corrige total y posiciones con el efecto de un paso chico de deshacer
+      (ver UndoJournal.cambios) sin volver a consultar la categoría.
+    - Cualquier otra escritura en la conexión compartida (total_changes) o en otra
+      conexión (PRAGMA data_version) descarta todo, igual que CategoryCache.
+    - Tras VIRTUAL_ANCHOR_STEP filas ajustadas una entrada se recalcula, para que las
+      claves no queden demasiado separadas.
+    """
+
+    def __init__(self):
+        self._entries = {}   # (cat, col, desc) -> (total, claves, filas ajustadas)
+        self._stamp   = None
+
+    @staticmethod
+    def _current_stamp():
+        return db.scalar("PRAGMA data_version"), db.get_conn().total_changes
+
+    def get(self, cat, sort_col, desc, term=""):
+        """
+        (total, claves) de la categoría en ese orden; las claves no se modifican después.
+        Con `term` sólo cuentan las filas que coinciden con la búsqueda; esas claves
+        no se guardan (cambian con cada tecla).
+        """
+        if term:
+            return self._calcular(cat, sort_col, desc, term)
+        stamp = self._current_stamp()
+        if stamp != self._stamp:
+            self._entries.clear()
+            self._stamp = stamp
+        key = (cat, sort_col, desc)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = (*self._calcular(cat, sort_col, desc), 0)
+        return entry[0], entry[1]
+
+    @staticmethod
+    def _calcular(cat, sort_col, desc, term=""):
+        expr, dir_ = _sort_expr(sort_col), ("DESC" if desc else "ASC")
+        where, params = _filtro_termino(term)
+        total = db.scalar(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE categoria = ? {where}",
+                          (cat, *params), default=0)
+        # Claves calculadas dentro de SQLite (sólo vuelven total/STEP filas)
+        anchors = [tuple(r) for r in db.query(f"""
+            SELECT k, id, rn FROM (
+                SELECT {expr} AS k, id,
+                       ROW_NUMBER() OVER (ORDER BY {expr} {dir_}, id {dir_}) - 1 AS rn
+                  FROM {TABLE_NAME}
+                 WHERE categoria = ? {where}
+            )
+             WHERE rn % {VIRTUAL_ANCHOR_STEP} = 0
+             ORDER BY rn
+        """, (cat, *params))]
+        return total, anchors
+
+    def ajustar(self, cambios, antes):
+        """
+        Aplica `cambios` ([(id, fila antes, fila después)], filas como dict o None)
+        de un paso que empezó cuando total_changes valía `antes`. Si hubo otras
+        escrituras desde la última lectura, o `cambios` es None, descarta todo.
+        """
+        if cambios is None or self._stamp is None or self._stamp[1] != antes \
+                or db.scalar("PRAGMA data_version") != self._stamp[0]:
+            self._entries.clear()
+            self._stamp = None
+            return
+        for (cat, col, desc), (total, anchors, n) in list(self._entries.items()):
+            moved = []
+            for pid, old, new in cambios:
+                o = (_sort_value(col, old), pid) if old and old["categoria"] == cat else None
+                w = (_sort_value(col, new), pid) if new and new["categoria"] == cat else None
+                if o != w:
+                    moved.append((o, w))
+            if not moved:
+                continue
+            n += len(moved)
+            if n > VIRTUAL_ANCHOR_STEP:
+                del self._entries[(cat, col, desc)]
+                continue
+
+            def _before(row_key, anchor_key):
+                return row_key is not None and (row_key > anchor_key if desc else row_key < anchor_key)
+
+            fixed = []
+            for k, aid, pos in anchors:
+                ak = ((0, 0) if k is None else (2, k) if isinstance(k, str) else (1, k), aid)
+                pos += sum(_before(w, ak) - _before(o, ak) for o, w in moved)
+                fixed.append((k, aid, pos))
+            total += sum((w is not None) - (o is not None) for o, w in moved)
+            self._entries[(cat, col, desc)] = (total, fixed, n)
+        self._stamp = self._current_stamp()
+
+    def clear(self):
+        self._entries.clear()
+        self._stamp = None
+
+
+keyset_anchors = KeysetAnchors()
+
+
+class KeysetSource:
+    """
+    Filas de una categoría leídas por páginas, sin cargar la categoría entera.
+    Paginación keyset sobre (orden, id) —o (columna, id) si se ordena por columna—:
+    usa las claves de salto de keyset_anchors (una cada ~VIRTUAL_ANCHOR_STEP filas) y
+    para leer la posición N salta a la clave anterior más cercana y avanza desde ahí.
+    Con `term` pagina sólo las filas que coinciden con la búsqueda (en el orden de
+    la vista, no por relevancia).
+    """
+
+    def __init__(self, cat, sort_col=None, desc=False, term=""):
+        self.cat      = cat
+        self.sort_col = sort_col
+        self.desc     = desc
+        self.term     = term
+        self.key      = ("cat", cat, sort_col, desc, term)
+        self._expr    = _sort_expr(sort_col)
+        self._dir     = "DESC" if desc else "ASC"
+        self._filter  = _filtro_termino(term)
+        self._chunk   = (0, [])   # (posición inicial, filas) de la última lectura
+        self.total, self._anchors = keyset_anchors.get(cat, sort_col, desc, term)
+        self._positions = [pos for _k, _id, pos in self._anchors]
+
+    def fetch(self, pos, n):
+        """Filas [pos, pos+n) en el orden de la vista."""
+        start, rows = self._chunk
+        end = min(pos + n, self.total)
+        if start <= pos and end <= start + len(rows):
+            return rows[pos - start:end - start]
+        lo = max(0, pos - VIRTUAL_BUFFER)
+        a = bisect.bisect_right(self._positions, lo) - 1
+        if a >= 0:
+            k, kid, apos = self._anchors[a]
+            op = "<=" if self.desc else ">="
+            where, params = f"AND ({self._expr}, id) {op} (?, ?)", (k, kid)
+        else:
+            # Antes de la primera clave (p. ej. filas agregadas al principio)
+            apos, where, params = 0, "", ()
+        match, match_params = self._filter
+        rows = db.query(f"""
+            SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME}
+             WHERE categoria = ? {match} {where}
+             ORDER BY {self._expr} {self._dir}, id {self._dir}
+             LIMIT ? OFFSET ?
+        """, (self.cat, *match_params, *params, (pos - lo) + n + 2 * VIRTUAL_BUFFER, lo - apos))
+        self._chunk = (lo, rows)
+        return rows[pos - lo:pos - lo + n]
+
+    def sorted(self, col, desc):
+        return KeysetSource(self.cat, col, desc, self.term)
+
+
+class ListSource:
+    """Fuente virtual sobre una lista ya en memoria (p. ej. resultados de búsqueda)."""
+
+    key = None
+
+    def __init__(self, rows, sort_col=None, desc=False):
+        self.rows     = rows
+        self.total    = len(rows)
+        self.sort_col = sort_col
+        self.desc     = desc
+
+    def fetch(self, pos, n):
+        return self.rows[pos:pos + n]
+
+    def sorted(self, col, desc):
+        i = COLUMNS.index(col)
+        numeric = col in _NUMERIC_COLUMNS
+        rows = sorted(self.rows, key=lambda r: (r[i] or 0) if numeric else str(r[i] or ""), reverse=desc)
+        return ListSource(rows, col, desc)
+
+
 def cargar_datos():
+    global _view_term
     cat = CATEGORIES[current_cat_idx]
-    sql = f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE categoria = ? ORDER BY orden, id"
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.execute(sql, (cat,)).fetchall()
-    _refresh_tree(rows)
+    _view_term = ""
+    # Cualquier búsqueda en curso o cacheada queda obsoleta
+    search_pipeline.invalidate()
+    n = category_cache.count(cat)
+    if n is None:
+        n = db.scalar(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE categoria = ?", (cat,), default=0)
+    if n > VIRTUAL_THRESHOLD:
+        # Categoría enorme: no la cargamos entera, se pagina desde SQLite
+        virtual_tree.attach_category(cat)
+        update_status()
+        return
+    sort = _view_sort.get(cat)
+    if sort:
+        # Vista ordenada por columna (sólo la vista): la ordena SQLite
+        _refresh_tree(db.query(*buscar_sql("", cat, *sort)))
+        return
+    _refresh_tree(category_cache.get(cat))
 
-def buscar(event=None):
-    term = entry_search.get().strip()
-    cat  = CATEGORIES[current_cat_idx]
+def _fts_match_expr(term):
+    """
+    Convierte lo escrito en el buscador en una expresión MATCH de FTS5:
+    cada palabra se busca como prefijo y todas deben aparecer.
+    'cano 1/2' -> '"cano"* "1"* "2"*'. Devuelve "" si no hay palabras.
+    """
+    words = re.findall(r"\w+", term)
+    return " ".join('"' + w.replace('"', '""') + '"*' for w in words)
+
+
+def _filtro_termino(term):
+    """
+    (sql, params) de la condición de buscar_sql() para `term`, sobre la tabla de
+    productos sin alias y lista para agregar tras un WHERE ("" si no hay término).
+    """
+    if not term:
+        return "", ()
+    match = _fts_match_expr(term) if _fts_enabled else ""
+    if match:
+        return f"AND id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)", (match,)
+    pat = f"%{term}%"
+    return "AND (codigo LIKE ? OR descripcion LIKE ?)", (pat, pat)
+
+
+def buscar_sql(term, cat, sort_col=None, desc=False, columns=None, ids=None):
+    """
+    Devuelve (sql, params) de la búsqueda de `term` dentro de la categoría `cat`.
+    Con FTS5 los resultados se ordenan por relevancia (bm25, el código pesa más
+    que la descripción); sin FTS5 se usa LIKE.
+    Con `sort_col` se ordena en cambio por esa columna (ORDER BY sobre el valor tipado).
+    `columns` cambia las columnas devueltas (por defecto COLUMNS) e `ids` limita
+    el resultado a esos ids, sin alterar el orden (p. ej. para exportar la selección).
+    """
+    cols = ", ".join(f"p.{c}" for c in (columns or COLUMNS))
+    match = _fts_match_expr(term) if _fts_enabled else ""
+    only = ""
+    extra = ()
+    if ids is not None:
+        only = "AND p.id IN (SELECT value FROM json_each(?))"
+        extra = (_json.dumps([int(i) for i in ids]),)
+    if sort_col is not None:
+        d = "DESC" if desc else "ASC"
+        order = f"{_sort_expr(sort_col, 'p.')} {d}, p.id {d}"
+    else:
+        order = "p.orden, p.id"
+    if match:
+        sql = f"""
+            SELECT {cols}
+              FROM {FTS_TABLE} f
+              JOIN {TABLE_NAME} p ON p.id = f.rowid
+             WHERE {FTS_TABLE} MATCH ?
+               AND p.categoria = ?
+               {only}
+             ORDER BY {order if sort_col is not None else f"bm25({FTS_TABLE}, 10.0, 1.0), {order}"}
+        """
+        return sql, (match, cat) + extra
     if term:
         sql = f"""
-            SELECT {', '.join(COLUMNS)}
-              FROM {TABLE_NAME}
-             WHERE categoria = ?
-               AND (codigo LIKE ? OR descripcion LIKE ?)
+            SELECT {cols}
+              FROM {TABLE_NAME} p
+             WHERE p.categoria = ?
+               AND (p.codigo LIKE ? OR p.descripcion LIKE ?)
+               {only}
+             ORDER BY {order}
         """
         pat = f"%{term}%"
-        params = (cat, pat, pat)
-    else:
-        sql    = f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE categoria = ?"
-        params = (cat,)
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.execute(sql, params).fetchall()
-    _refresh_tree(rows)
+        return sql, (cat, pat, pat) + extra
+    sql = f"SELECT {cols} FROM {TABLE_NAME} p WHERE p.categoria = ? {only} ORDER BY {order}"
+    return sql, (cat,) + extra
+
+
+def buscar(event=None):
+    global _view_term
+    _view_term = entry_search.get().strip()
+    _refresh_tree(db.query(*_vista_sql()))
+
+
+def _vista_sql(columns=None, ids=None):
+    """
+    (sql, params) de lo que muestra ahora la tabla: categoría actual, último término
+    de búsqueda mostrado y orden por columna de la vista. Es la misma consulta de
+    buscar_sql() que usan cargar_datos(), la búsqueda y sort_column().
+    """
+    col, desc = _vista_ordenada() or (None, False)
+    return buscar_sql(_view_term, CATEGORIES[current_cat_idx], col, desc, columns=columns, ids=ids)
+
+
+def _fold(s):
+    """Minúsculas y sin acentos (mismo criterio que el tokenizador FTS5)."""
+    s = unicodedata.normalize("NFKD", "" if s is None else str(s))
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+
+
+def _row_matches(row, term):
+    """
+    Versión en memoria de buscar_sql(): ¿la fila `row` (orden de COLUMNS) coincide con `term`?
+    Con FTS5: cada palabra debe ser prefijo de alguna palabra de codigo/descripcion.
+    Sin FTS5: `term` debe aparecer dentro de codigo o descripcion (como LIKE).
+    """
+    codigo      = row[COLUMNS.index("codigo")]
+    descripcion = row[COLUMNS.index("descripcion")]
+    if _fts_enabled:
+        tokens = re.findall(r"\w+", _fold(codigo) + " " + _fold(descripcion))
+        return all(any(t.startswith(w) for t in tokens) for w in re.findall(r"\w+", _fold(term)))
+    t = term.lower()
+    return t in str(codigo or "").lower() or t in str(descripcion or "").lower()
+
+
+class SearchPipeline:
+    """
+    Búsqueda en segundo plano para el campo "Buscar:".
+    - Debounce: sólo consulta cuando pasan SEARCH_DEBOUNCE_MS sin teclear.
+    - Cancelación: un término nuevo interrumpe la consulta en curso
+      (Connection.interrupt()) y el resultado viejo se descarta.
+    - Refinamiento: si el término nuevo extiende al anterior en la misma categoría,
+      se filtran en memoria las filas que ya teníamos sin volver a la BD.
+    La consulta corre en un hilo con su propia conexión; el resultado se entrega
+    en el hilo de Tk (vía after) llamando a on_results(term, rows). Si coinciden
+    más de VIRTUAL_THRESHOLD filas no se traen: rows es None y la vista las pagina.
+    Con `sort` = (columna, desc) los resultados vienen ordenados por esa columna.
+    """
+
+    def __init__(self, widget, on_results):
+        self.widget     = widget
+        self.on_results = on_results
+        self._after_id  = None
+        self._poll_id   = None
+        self._gen       = 0       # generación del pedido vigente
+        self._waiting   = None    # generación que espera respuesta del hilo
+        self._last      = None    # (cat, sort, term, rows) del último resultado entregado
+        self._requests  = queue.Queue()
+        self._results   = queue.Queue()
+        self._conn      = None
+
+    def submit(self, term, cat, sort=None):
+        """Programa la búsqueda de `term` (reinicia la espera si se sigue tecleando)."""
+        if self._after_id:
+            self.widget.after_cancel(self._after_id)
+        self._after_id = self.widget.after(SEARCH_DEBOUNCE_MS, self._start, term, cat, sort)
+
+    def cancel(self):
+        """Descarta la búsqueda pendiente o en curso."""
+        if self._after_id:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        self._gen += 1
+        self._waiting = None
+        if self._conn is not None:
+            self._conn.interrupt()
+
+    def invalidate(self):
+        """Los datos cambiaron: cancela y olvida el último resultado."""
+        self.cancel()
+        self._last = None
+
+    def _start(self, term, cat, sort):
+        self._after_id = None
+        self._gen += 1
+        gen = self._gen
+
+        last = self._last
+        if last and last[:2] == (cat, sort) and last[2] and last[3] is not None \
+                and term.startswith(last[2]):
+            self._waiting = None
+            self._deliver(cat, sort, term, [r for r in last[3] if _row_matches(r, term)])
+            return
+
+        if self._conn is None:
+            self._conn = db.connect()
+            threading.Thread(target=self._worker, name="buscar", daemon=True).start()
+        # Corta la consulta anterior si seguía en curso
+        self._conn.interrupt()
+        self._waiting = gen
+        self._requests.put((gen, term, cat, sort))
+        if self._poll_id is None:
+            self._poll_id = self.widget.after(SEARCH_POLL_MS, self._poll)
+
+    def _worker(self):
+        while True:
+            req = self._requests.get()
+            # Sólo nos interesa el pedido más reciente
+            while True:
+                try:
+                    req = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+            gen, term, cat, sort = req
+            ok, rows = False, None
+            if gen == self._gen:
+                sql, params = buscar_sql(term, cat, *(sort or ()))
+                try:
+                    rows = self._conn.execute(sql, params).fetchmany(VIRTUAL_THRESHOLD + 1)
+                    ok = True
+                except sqlite3.OperationalError:
+                    pass   # interrumpida por un término más nuevo
+                if ok and len(rows) > VIRTUAL_THRESHOLD:
+                    rows = None   # demasiadas para tenerlas en memoria
+            self._results.put((gen, cat, sort, term, ok, rows))
+
+    def _poll(self):
+        self._poll_id = None
+        try:
+            while True:
+                gen, cat, sort, term, ok, rows = self._results.get_nowait()
+                if gen == self._waiting and ok:
+                    self._waiting = None
+                    self._deliver(cat, sort, term, rows)
+        except queue.Empty:
+            pass
+        if self._waiting is not None:
+            self._poll_id = self.widget.after(SEARCH_POLL_MS, self._poll)
+
+    def _deliver(self, cat, sort, term, rows):
+        self._last = (cat, sort, term, rows)
+        self.on_results(term, rows)
 
 # ORDENAR COLUMNAS
 _sort_state = {col: False for col in VISIBLE_COLUMNS}
+# Orden por columna de la vista de cada categoría: {categoria: (columna, desc)};
+# las que no figuran siguen el orden manual
+_view_sort = {}
+# Término de búsqueda cuyos resultados muestra la tabla ("" = la categoría completa)
+_view_term = ""
 
 def sort_column(col):
-    # Recolectamos (valor, iid) y convertimos a numérico si podemos
-    data = [(tree.set(k, col), k) for k in tree.get_children('')]
-    try:
-        data = [(float(v), k) for v, k in data]
-    except:
-        pass
+    """
+    Ordena la vista por `col` con ORDER BY en SQLite. Sólo cambia la vista:
+    la columna 'orden' queda igual hasta usar "Guardar orden de la vista".
+    """
+    global _view_term
+    desc = _sort_state[col]
+    # Invertimos criterio para la próxima vez que hagas clic en el encabezado
+    _sort_state[col] = not desc
+
+    cat = CATEGORIES[current_cat_idx]
+    _view_sort[cat] = (col, desc)
+    # Modo virtual: la fuente paginada se reordena en SQLite
+    if virtual_tree.active:
+        virtual_tree.sort(col, desc=desc)
+        return
 
-    # Ordenamos según el estado anterior (asc/desc)
-    data.sort(reverse=_sort_state[col])
+    _view_term = entry_search.get().strip()
+    _refresh_tree(db.query(*buscar_sql(_view_term, cat, col, desc)))
 
-    # Recorremos e insertamos cada fila en la nueva posición
-    for new_pos, (_, iid) in enumerate(data):
-        tree.move(iid, '', new_pos)
 
-    # Persistimos el nuevo orden en la BD
-    with sqlite3.connect(DB_PATH) as conn:
-        for new_pos, (_, iid) in enumerate(data):
-            conn.execute(
-                f"UPDATE {TABLE_NAME} SET orden = ? WHERE id = ?",
-                (new_pos, iid)
-            )
+def _vista_ordenada():
+    """(columna, desc) por la que está ordenada la vista actual, o None si sigue el orden manual."""
+    cat = CATEGORIES[current_cat_idx]
+    if virtual_tree.sorted_by_column:
+        return virtual_tree.source.sort_col, virtual_tree.source.desc
+    if isinstance(virtual_tree.source, KeysetSource):
+        return None
+    # Tabla normal o resultados de búsqueda ya ordenados por SQLite
+    return _view_sort.get(cat)
 
-    # Invertimos criterio para la próxima vez que hagas clic en el encabezado
-    _sort_state[col] = not _sort_state[col]
 
-def update_status():
+def guardar_orden_vista():
     """
-    Calcula número total de productos y suma de importes.
-    Parsea importes que estén guardados como texto con '$' o '%' y suma correctamente.
+    Guarda como orden manual de la categoría el orden por columna que se ve,
+    con una sola sentencia UPDATE dentro de una transacción (y un paso de deshacer).
     """
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        # Total productos
-        cur.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
-        cnt = cur.fetchone()[0]
-        # Recuperamos todos los importes crudos y los parseamos
-        cur.execute(f"SELECT importe FROM {TABLE_NAME}")
-        rows = cur.fetchall()
+    sort = _vista_ordenada()
+    if sort is None:
+        messagebox.showinfo(
+            "Guardar orden",
+            "La vista no está ordenada por ninguna columna.\n"
+            "Haz clic en un encabezado para ordenarla primero."
+        )
+        return
+    col, desc = sort
+    cat = CATEGORIES[current_cat_idx]
+    sentido = "descendente" if desc else "ascendente"
+    if not messagebox.askyesno(
+        "Guardar orden",
+        f"¿Guardar el orden por {COLUMN_LABELS.get(col, col)} ({sentido}) "
+        f"como orden de toda la categoría {cat}?"
+    ):
+        return
+
+    d = "DESC" if desc else "ASC"
+    with undo_journal.step("Guardar orden") as conn:
+        _renumerar_orden(conn, cat, order_by=f"{_sort_expr(col)} {d}, id {d}")
+    category_cache.invalidate(cat)
+
+    # El orden guardado pasa a ser el orden manual: la vista deja de estar "ordenada por columna"
+    _view_sort.pop(cat, None)
+    if virtual_tree.active:
+        virtual_tree.sort(None, desc=False)
+        search_pipeline.invalidate()
+        update_status()
+    else:
+        cargar_datos()
+
+def inventory_summary():
+    """
+    Resumen por categoría: {categoria: (productos, valor, bajo_stock)}, con el total
+    general bajo la clave TOTALS_ALL. Sale entero de TOTALS_TABLE (una fila por
+    categoría, mantenida por triggers): no recorre la tabla de productos.
+    """
+    rows = db.query(f"SELECT categoria, productos, valor_centavos, bajo_stock FROM {TOTALS_TABLE}")
+    return {cat: (n, cents / 100, low) for cat, n, cents, low in rows}
 
-    total = 0.0
-    for (imp_raw,) in rows:
-        total += _parse_number_from_db(imp_raw)
+
+def update_status():
+    """Totales generales y de la categoría actual en la barra de estado (y en el panel de resumen)."""
+    summary = inventory_summary()
+    cnt, total, low = summary.get(TOTALS_ALL, (0, 0.0, 0))
+    cat = CATEGORIES[current_cat_idx]
+    c_cnt, c_total, c_low = summary.get(cat, (0, 0.0, 0))
 
     # Mostrar símbolo $ en el status
-    status_var.set(f"Total productos: {cnt}    |    Valor total del stock: {total:.2f} $")
-
-def snapshot():
-    """Guarda el estado actual de la tabla en undo_stack, limitando su tamaño."""
-    with sqlite3.connect(DB_PATH) as conn:
-        df = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME}", conn)
-    undo_stack.append(df)
-    # Si superamos el límite, descartamos el más antiguo
-    if len(undo_stack) > MAX_UNDO:
-        undo_stack.pop(0)
-    # Cada vez que das un snapshot, el redo ya no tiene sentido
-    redo_stack.clear()
-
-def _get_table_columns(table: str = TABLE_NAME):
-    """Devuelve la lista de columnas (en orden) de la tabla SQLite `table`."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.execute(f"PRAGMA table_info({table})")
-        cols = [row[1] for row in cur.fetchall()]
-    return cols
-
-
-def _reindex_df_to_table_schema(df: pd.DataFrame, table: str = TABLE_NAME) -> pd.DataFrame:
-    """
-    Reindexa `df` para que coincida exactamente con las columnas de `table`.
-    - Si faltan columnas en df, se añaden con valores NaN (luego convertidos a None).
-    - Si df tiene columnas extras, se descartan.
-    - Devuelve un DataFrame con las columnas en el mismo orden que la tabla.
-    """
-    cols = _get_table_columns(table)
-    if df is None:
-        # devolvemos un DataFrame vacío con las columnas correctas
-        return pd.DataFrame(columns=cols)
-    # Hacemos copia para no mutar el original
-    df2 = df.copy()
-    # Reindexar para que tenga exactamente las columnas de la tabla (añade NaN si faltan)
-    df2 = df2.reindex(columns=cols)
-    return df2
-
-
-def _restore_df_preserve_schema(df: pd.DataFrame, table: str = TABLE_NAME):
-    """
-    Restaura los contenidos de `df` en la tabla `table` sin reemplazar el esquema.
-    - Limpia la tabla actual y re-inserta las filas del DataFrame reindexado
-      para coincidir con las columnas de la tabla.
-    """
-    # Si df es None o vacío: borramos filas y salimos
-    if df is None or (isinstance(df, pd.DataFrame) and df.empty):
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(f"DELETE FROM {table}")
-            conn.commit()
-        return
+    status_var.set(
+        f"Total productos: {cnt}    |    Valor total del stock: {total:.2f} $    |    "
+        f"{cat}: {c_cnt} productos, {c_total:.2f} $, {c_low} con bajo stock"
+    )
+    _refresh_summary_panel(summary)
 
-    # Reindexamos el DataFrame para que coincida exactamente con el esquema de la tabla
-    df_reindexed = _reindex_df_to_table_schema(df, table)
+# Columnas de datos (todas menos 'id') que guarda el journal de deshacer
+_DATA_COLUMNS = [c for c in COLUMNS if c != "id"]
 
-    # Convertir NaN -> None para que sqlite reciba NULL
-    df_clean = df_reindexed.where(pd.notnull(df_reindexed), None)
 
-    cols = list(df_clean.columns)
-    if not cols:
-        # Si por alguna razón no hay columnas, limpiamos y salimos
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(f"DELETE FROM {table}")
-            conn.commit()
-        return
+class UndoJournal:
+    """
+    Historial de deshacer/rehacer por operación, guardando sólo las filas afectadas.
+    - Triggers TEMP sobre la tabla de productos anotan, mientras hay un paso abierto,
+      cada fila insertada (sólo el id), modificada o borrada (imagen anterior, o_*)
+      en la tabla temporal undo_log (en memoria, por conexión).
+    - Una importación se anota como UNA fila 'R' con el rango de ids insertados
+      (id..hasta), sin copiar las filas.
+    - Deshacer aplica las imágenes anteriores en orden inverso, y justo antes guarda
+      en n_* el estado que pisa (lo que rehacer tiene que volver a poner); rehacer
+      aplica n_* y las vuelve a vaciar. Así, mientras un paso está hecho, el
+      historial sólo guarda lo que ya no está en la tabla.
+    - Se conservan como mucho MAX_UNDO pasos y UNDO_BUDGET_BYTES aproximados;
+      el paso más reciente se conserva siempre aunque supere el presupuesto.
+    """
+
+    _O = ", ".join(f"o_{c}" for c in _DATA_COLUMNS)
+    _N = ", ".join(f"n_{c}" for c in _DATA_COLUMNS)
 
-    placeholders = ",".join(["?"] * len(cols))
-    insert_sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({placeholders})"
-
-    rows = []
-    for _, r in df_clean.iterrows():
-        vals = [r[c] for c in cols]
-        rows.append(tuple(vals))
-
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        # Borrar el contenido actual preservando esquema (PK, AUTOINCREMENT, índices)
-        cur.execute(f"DELETE FROM {table}")
-        # Insertar filas (si hay)
-        if rows:
-            cur.executemany(insert_sql, rows)
+    def __init__(self, on_push=None):
+        self._undo = []     # [(step, etiqueta, bytes)]
+        self._redo = []
+        self._next_step = 1
+        # on_push(step, antes): se llama tras registrar un paso abierto con step();
+        # `antes` es total_changes de la conexión compartida al abrirlo
+        self.on_push = on_push
+
+    def install(self, conn=None, inserts=True):
+        """
+        Crea la tabla y los triggers TEMP en `conn` (por defecto la compartida). Idempotente.
+        Con inserts=False no se anotan las altas (una importación las registra como rango).
+        """
+        cols = ", ".join(f"o_{c}, n_{c}" for c in _DATA_COLUMNS)
+        conn = conn or db.get_conn()
+        conn.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS undo_log (
+                seq   INTEGER PRIMARY KEY,
+                step  INTEGER NOT NULL,
+                op    TEXT    NOT NULL,   -- I / U / D; R = rango de altas id..hasta
+                id    INTEGER NOT NULL,
+                hasta INTEGER,
+                {cols}
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS temp.undo_log_step ON undo_log (step)")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS undo_state (step INTEGER)")
+        if conn.execute("SELECT COUNT(*) FROM temp.undo_state").fetchone()[0] == 0:
+            conn.execute("INSERT INTO temp.undo_state (step) VALUES (NULL)")
+
+        def _trigger(name, event, op, id_src, o_src):
+            cols = f", {self._O}" if o_src else ""
+            vals = "".join(f", {o_src}.{c}" for c in _DATA_COLUMNS) if o_src else ""
+            conn.execute(f"""
+                CREATE TEMP TRIGGER IF NOT EXISTS {name} AFTER {event} ON main.{TABLE_NAME}
+                WHEN (SELECT step FROM undo_state) IS NOT NULL
+                BEGIN
+                    INSERT INTO undo_log (step, op, id{cols})
+                    VALUES ((SELECT step FROM undo_state), '{op}', {id_src}.id{vals});
+                END
+            """)
+        if inserts:
+            _trigger("undo_ai", "INSERT", "I", "new", None)
+        _trigger("undo_ad", "DELETE", "D", "old", "old")
+        _trigger("undo_au", "UPDATE", "U", "new", "old")
         conn.commit()
 
+    @contextmanager
+    def step(self, label):
+        """
+        Abre un paso de deshacer y una transacción: todo lo que se escriba dentro
+        queda registrado como una sola operación. Devuelve la conexión.
+        """
+        step = self._next_step
+        self._next_step += 1
+        with db.transaction() as conn:
+            antes = conn.total_changes
+            self.mark(conn, step)
+            try:
+                yield conn
+            finally:
+                self.mark(conn, None)
+        if self.push(step, label) and self.on_push is not None:
+            self.on_push(step, antes)
+
+    @staticmethod
+    def mark(conn, step):
+        """Abre (step) o cierra (None) el registro de cambios en `conn`."""
+        conn.execute("UPDATE temp.undo_state SET step = ?", (step,))
+
+    def attach(self, conn):
+        """
+        Prepara OTRA conexión (p. ej. la de un hilo de importación) para registrar
+        un paso y devuelve su número. El hilo encierra sus escrituras entre
+        mark(conn, step) y mark(conn, None); en esa conexión sólo se anotan
+        modificaciones y bajas: las altas se pasan como rango a adopt().
+        Tras el commit, adopt() lleva el paso al historial y push() lo agrega.
+        """
+        self.install(conn, inserts=False)
+        step = self._next_step
+        self._next_step += 1
+        return step
 
-def deshacer(event=None):
-    if not undo_stack:
-        messagebox.showinfo(
-            title="Deshacer",
-            message="Nada para deshacer."
+    def adopt(self, conn, step, rango=None, chunk=5000):
+        """
+        Pasa a la conexión compartida lo que `conn` registró para `step` (sólo
+        modificaciones y bajas, por tandas) y anota `rango` = (desde, hasta), los
+        ids insertados, como una sola fila 'R'.
+        """
+        cols = f"step, op, id, {self._O}"
+        marks = ", ".join("?" * (3 + len(_DATA_COLUMNS)))
+        cur = conn.execute(f"SELECT {cols} FROM temp.undo_log WHERE step = ? ORDER BY seq", (step,))
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            with db.transaction() as shared:
+                shared.executemany(f"INSERT INTO temp.undo_log ({cols}) VALUES ({marks})", rows)
+        conn.execute("DELETE FROM temp.undo_log WHERE step = ?", (step,))
+        conn.commit()
+        if rango and rango[1] >= rango[0]:
+            with db.transaction() as shared:
+                shared.execute("INSERT INTO temp.undo_log (step, op, id, hasta) VALUES (?, 'R', ?, ?)",
+                               (step, *rango))
+
+    def push(self, step, label):
+        """
+        Agrega al historial el paso `step` ya registrado en la conexión compartida.
+        Devuelve False si el paso no cambió nada (no queda en el historial).
+        """
+        row = db.query_one(f"""
+            SELECT COUNT(*),
+                   COALESCE(SUM(LENGTH(o_descripcion)), 0)
+              FROM temp.undo_log WHERE step = ?
+        """, (step,))
+        if not row or row[0] == 0:
+            return False   # no cambió nada: no hay nada que deshacer
+        size = row[0] * UNDO_ROW_BYTES + row[1]
+        self._undo.append((step, label, size))
+        # Un cambio nuevo invalida lo que se podía rehacer
+        self._drop([s for s, _, _ in self._redo])
+        self._redo.clear()
+        # Respetar límites (el paso más reciente se conserva siempre)
+        while len(self._undo) > 1 and (
+            len(self._undo) > MAX_UNDO or sum(sz for _, _, sz in self._undo) > UNDO_BUDGET_BYTES
+        ):
+            old = self._undo.pop(0)
+            self._drop([old[0]])
+        return True
+
+    def cambios(self, step, limite):
+        """
+        Efecto neto del paso `step` (recién registrado) sobre cada fila:
+        [(id, fila antes, fila ahora)], filas como dict de columnas o None si no
+        existía / ya no existe. Devuelve None si el paso tocó más de `limite` filas.
+        """
+        count, ranges = db.query_one(
+            "SELECT COUNT(DISTINCT id), COUNT(hasta) FROM temp.undo_log WHERE step = ?", (step,)
+        )
+        if count > limite or ranges:
+            return None
+        n = len(_DATA_COLUMNS)
+        rows = db.query(f"""
+            SELECT l.id, l.op, {', '.join(f"l.o_{c}" for c in _DATA_COLUMNS)},
+                   p.id IS NOT NULL, {', '.join(f"p.{c}" for c in _DATA_COLUMNS)}
+              FROM temp.undo_log l LEFT JOIN main.{TABLE_NAME} p ON p.id = l.id
+             WHERE l.seq IN (SELECT MIN(seq) FROM temp.undo_log WHERE step = ? GROUP BY id)
+        """, (step,))
+        return [
+            (pid,
+             None if op == "I" else dict(zip(_DATA_COLUMNS, rest[:n])),
+             dict(zip(_DATA_COLUMNS, rest[n + 1:])) if rest[n] else None)
+            for pid, op, *rest in rows
+        ]
+
+    def _drop(self, steps):
+        if steps:
+            with db.transaction() as conn:
+                conn.executemany("DELETE FROM temp.undo_log WHERE step = ?", [(s,) for s in steps])
+
+    def clear(self):
+        """Olvida todo el historial (p. ej. tras restaurar un backup)."""
+        self._drop([s for s, _, _ in self._undo + self._redo])
+        self._undo.clear()
+        self._redo.clear()
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def filas(self, redo=False):
+        """Filas que tocaría deshacer (o rehacer, con redo=True) el próximo paso."""
+        stack = self._redo if redo else self._undo
+        if not stack:
+            return 0
+        return db.scalar(
+            "SELECT COALESCE(SUM(COALESCE(hasta - id + 1, 1)), 0) FROM temp.undo_log WHERE step = ?",
+            (stack[-1][0],), 0,
         )
-        return
 
-    # Guardamos el estado actual antes de restaurar (para poder rehacer luego)
-    with sqlite3.connect(DB_PATH) as conn:
-        estado_actual = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME}", conn)
-    redo_stack.append(estado_actual)
+    def undo(self):
+        """Deshace el último paso. Devuelve los ids afectados, o None si son muchos (releer todo)."""
+        entry = self._undo.pop()
+        try:
+            ids = self._apply(entry[0], forward=False)
+        except Exception:
+            self._undo.append(entry)
+            raise
+        self._redo.append(entry)
+        return ids
+
+    def redo(self):
+        """Rehace el último paso deshecho. Devuelve los ids afectados, o None si son muchos (releer todo)."""
+        entry = self._redo.pop()
+        try:
+            ids = self._apply(entry[0], forward=True)
+        except Exception:
+            self._redo.append(entry)
+            raise
+        self._undo.append(entry)
+        return ids
 
-    # Tomamos el estado previo y lo eliminamos de undo_stack
-    df_prev = undo_stack.pop()
+    def _apply(self, step, forward):
+        """
+        Reaplica el paso `step`: hacia adelante (imágenes n_*) o hacia atrás (o_*).
+        Las operaciones consecutivas del mismo tipo se ejecutan juntas con executemany.
+        Un rango de altas ('R') se borra y se vuelve a insertar con una sentencia por
+        conjunto; al deshacerlo sus filas quedan en el historial como filas 'r'.
+        """
+        n = len(_DATA_COLUMNS)
+        order = "ASC" if forward else "DESC"
+        cols = ", ".join(_DATA_COLUMNS)
+        insert_sql = f"INSERT INTO {TABLE_NAME} (id, {cols}) VALUES (?{', ?' * n})"
+        update_sql = f"UPDATE {TABLE_NAME} SET {', '.join(c + ' = ?' for c in _DATA_COLUMNS)} WHERE id = ?"
+        delete_sql = f"DELETE FROM {TABLE_NAME} WHERE id = ?"
+        # Al deshacer: guarda en n_* el estado actual de la fila antes de pisarlo
+        capture_sql = f"""
+            UPDATE temp.undo_log SET ({self._N}) = (SELECT {cols} FROM main.{TABLE_NAME} p WHERE p.id = undo_log.id)
+             WHERE seq = ?
+        """
 
-    # Restauramos ese estado en la base de datos SIN reemplazar el esquema
-    try:
-        _restore_df_preserve_schema(df_prev, TABLE_NAME)
-    except Exception as e:
-        messagebox.showerror("Deshacer", f"No se pudo restaurar el estado:\n{e}")
-        return
+        with db.transaction() as conn:
+            ranged = False
+            if forward:
+                # Rango de altas deshecho: vuelve entero
+                desde, hasta = conn.execute(
+                    "SELECT MIN(id), MAX(id) FROM temp.undo_log WHERE step = ? AND op = 'r'", (step,)
+                ).fetchone()
+                if desde is not None:
+                    ranged = True
+                    conn.execute(f"""
+                        INSERT INTO {TABLE_NAME} (id, {cols})
+                        SELECT id, {self._N} FROM temp.undo_log WHERE step = ? AND op = 'r' ORDER BY id
+                    """, (step,))
+                    conn.execute("DELETE FROM temp.undo_log WHERE step = ? AND op = 'r'", (step,))
+                    conn.execute("INSERT INTO temp.undo_log (step, op, id, hasta) VALUES (?, 'R', ?, ?)",
+                                 (step, desde, hasta))
+
+            log = conn.execute(f"""
+                SELECT seq, op, id, {self._O}, {self._N}
+                  FROM temp.undo_log WHERE step = ? AND op IN ('I', 'U', 'D') ORDER BY seq {order}
+            """, (step,)).fetchall()
+
+            batch_sql, batch, batch_ids, captures = None, [], set(), []
+            for seq, op, pid, *images in log:
+                old, new = images[:n], images[n:]
+                if op == "U":
+                    sql, params = update_sql, (*(new if forward else old), pid)
+                elif (op == "I") == forward:
+                    # rehacer un alta o deshacer una baja: la fila vuelve
+                    sql, params = insert_sql, (pid, *(new if forward else old))
+                else:
+                    sql, params = delete_sql, (pid,)
+                if batch and (sql is not batch_sql or pid in batch_ids):
+                    if captures:
+                        conn.executemany(capture_sql, captures)
+                    conn.executemany(batch_sql, batch)
+                    batch, batch_ids, captures = [], set(), []
+                batch_sql = sql
+                batch.append(params)
+                batch_ids.add(pid)
+                if not forward and op in ("I", "U"):
+                    captures.append((seq,))
+            if batch:
+                if captures:
+                    conn.executemany(capture_sql, captures)
+                conn.executemany(batch_sql, batch)
+
+            if forward:
+                # Lo rehecho vuelve a estar en la tabla: no hace falta guardarlo
+                conn.execute(f"UPDATE temp.undo_log SET ({self._N}) = ({', '.join(['NULL'] * n)}) WHERE step = ?",
+                             (step,))
+            else:
+                for seq, desde, hasta in conn.execute(
+                    "SELECT seq, id, hasta FROM temp.undo_log WHERE step = ? AND op = 'R'", (step,)
+                ).fetchall():
+                    ranged = True
+                    conn.execute(f"""
+                        INSERT INTO temp.undo_log (step, op, id, {self._N})
+                        SELECT ?, 'r', id, {cols} FROM main.{TABLE_NAME} WHERE id BETWEEN ? AND ? ORDER BY id
+                    """, (step, desde, hasta))
+                    conn.execute(f"DELETE FROM {TABLE_NAME} WHERE id BETWEEN ? AND ?", (desde, hasta))
+                    conn.execute("DELETE FROM temp.undo_log WHERE seq = ?", (seq,))
+        if ranged or len(log) > IMPORT_CHUNK:
+            return None   # demasiados para refrescarlos uno por uno
+        return {pid for _, _, pid, *_ in log}
+
+
+undo_journal = UndoJournal(
+    on_push=lambda step, antes: keyset_anchors.ajustar(undo_journal.cambios(step, VIRTUAL_ANCHOR_STEP), antes)
+)
 
-    # Refrescamos la vista
-    limpiar_form()
-    cargar_datos()
+
+def deshacer(event=None):
+    _aplicar_paso("Deshacer", "Deshaciendo", redo=False)
 
 
 def rehacer(event=None):
-    if not redo_stack:
+    _aplicar_paso("Rehacer", "Rehaciendo", redo=True)
+
+
+def _aplicar_paso(titulo, accion, redo):
+    """
+    Deshace o rehace el último paso. Si toca UNDO_TASK_ROWS filas o más (p. ej. una
+    importación) corre en segundo plano, con un diálogo modal y sin poder cancelarse.
+    """
+    if not (undo_journal.can_redo() if redo else undo_journal.can_undo()):
         messagebox.showinfo(
-            title="Rehacer",
-            message="Nada para rehacer."
+            title=titulo,
+            message=f"Nada para {titulo.lower()}."
         )
         return
+    aplicar = undo_journal.redo if redo else undo_journal.undo
 
-    # Guardamos el estado actual para poder deshacerlo luego
-    with sqlite3.connect(DB_PATH) as conn:
-        estado_actual = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME}", conn)
-    undo_stack.append(estado_actual)
+    def _listo(ids):
+        # Refrescamos la vista
+        if ids is None:
+            category_cache.clear()
+        else:
+            category_cache.refresh_ids(ids)
+        limpiar_form()
+        cargar_datos()
 
-    # Recuperamos el siguiente estado de redo_stack
-    df_next = redo_stack.pop()
+    def _error(e):
+        messagebox.showerror(titulo, f"No se pudo restaurar el estado:\n{e}")
 
-    # Restauramos ese estado en la base de datos sin reemplazar el esquema
-    try:
-        _restore_df_preserve_schema(df_next, TABLE_NAME)
-    except Exception as e:
-        messagebox.showerror("Rehacer", f"No se pudo restaurar el estado:\n{e}")
+    if undo_journal.filas(redo) < UNDO_TASK_ROWS:
+        try:
+            ids = aplicar()
+        except Exception as e:
+            _error(e)
+            return
+        _listo(ids)
         return
 
-    # Limpiamos el formulario y refrescamos la vista
-    limpiar_form()
-    cargar_datos()
+    # Modal: mientras se reescriben los datos no se puede editar
+    win, bar = _ventana_espera(titulo, f"{accion} la última operación…")
+    bar.configure(mode="indeterminate")
+    bar.start()
+
+    def _fin(ids):
+        win.destroy()
+        _listo(ids)
+
+    def _fallo(e):
+        win.destroy()
+        _error(e)
+
+    ejecutor.submit(
+        lambda tarea: aplicar(), titulo=titulo, cancelable=False,
+        on_done=_fin, on_error=_fallo,
+    )
 
 
-def backup_db():
-    """Copia la base con timestamp en BACKUP_PATH."""
+def backup_db(progress=None):
+    """Copia la base con timestamp en BACKUP_PATH (`progress` como en db.backup_to)."""
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     fname = f"{TABLE_NAME}_backup_{ts}.db"
     dst   = os.path.join(BACKUP_PATH, fname)
-    shutil.copyfile(DB_PATH, dst)
+    # API de backup de SQLite: copia consistente aunque haya cambios en el WAL
+    db.backup_to(dst, progress)
     return dst
 
+
+def _progreso_copia(tarea):
+    """Callback de avance de db.backup_to/restore_from que informa a `tarea` (y corta si se cancela)."""
+    def _avance(remaining, total):
+        tarea.comprobar()
+        if total:
+            tarea.progreso(1 - remaining / total, f"{total - remaining} de {total} páginas")
+    return _avance
+
+
+def _ventana_espera(title, text):
+    """Diálogo modal con barra de avance mientras corre una tarea que no admite cambios en la base."""
+    win = tk.Toplevel(root)
+    win.title(title)
+    win.resizable(False, False)
+    win.transient(root)
+    win.protocol("WM_DELETE_WINDOW", lambda: None)
+    frame = ttk.Frame(win, padding=12)
+    frame.pack(fill="both", expand=True)
+    ttk.Label(frame, text=text).pack(anchor="w")
+    bar = ttk.Progressbar(frame, length=320, maximum=100, mode="determinate")
+    bar.pack(fill="x", pady=8)
+    win.grab_set()
+    return win, bar
+
+
 def restore_backup():
-    """Restaura desde un .db en BACKUP_PATH."""
+    """Restaura desde un .db en BACKUP_PATH (la copia corre en segundo plano)."""
     path = filedialog.askopenfilename(
         initialdir=BACKUP_PATH,
         title="Seleccionar backup para restaurar",
@@ -733,158 +2091,677 @@ def restore_backup():
     ):
         return
 
-    # Reemplazamos el fichero real de datos
-    shutil.copyfile(path, DB_PATH)
-    limpiar_form()
-    cargar_datos()
-    messagebox.showinfo(
-        title="Restauración",
-        message="Restauración completada correctamente."
+    # Modal: mientras se reemplazan los datos no se puede editar
+    win, bar = _ventana_espera("Restaurar backup", f"Restaurando {os.path.basename(path)}…")
+
+    def _listo(_result):
+        win.destroy()
+        # El backup puede venir de una versión anterior del esquema
+        if init_db() < 3:
+            _avisar_textos_originales()
+        category_cache.clear()
+        # El historial apunta a filas de la base anterior
+        undo_journal.clear()
+        limpiar_form()
+        cargar_datos()
+        messagebox.showinfo(
+            title="Restauración",
+            message="Restauración completada correctamente."
+        )
+
+    def _error(e):
+        win.destroy()
+        messagebox.showerror("Restaurar backup", f"No se pudo restaurar:\n{e}")
+
+    # Reemplazamos los datos activos (vía API de backup, sin cerrar la conexión)
+    ejecutor.submit(
+        lambda tarea: db.restore_from(path, _progreso_copia(tarea)),
+        titulo="Restaurar backup", cancelable=False,
+        on_progress=lambda t: bar.configure(value=100 * (t.fraccion or 0)),
+        on_done=_listo, on_error=_error,
     )
 
 def manual_backup():
-    dst = backup_db()
-    messagebox.showinfo(
-        title="Backup manual",
-        message=f"Backup creado:\n{os.path.basename(dst)}"
+    ejecutor.submit(
+        lambda tarea: backup_db(_progreso_copia(tarea)),
+        titulo="Backup",
+        on_done=lambda dst: messagebox.showinfo(
+            title="Backup manual",
+            message=f"Backup creado:\n{os.path.basename(dst)}"
+        ),
+    )
+
+# Encabezados del CSV (como se ven en la tabla) -> columnas de la BD
+_CSV_RENAMES = {
+    "Cantidad":           "cantidad",
+    "Cod. Art.":          "codigo",
+    "Concepto":           "descripcion",
+    "Descripción":        "descripcion",
+    "% IVA":              "iva",
+    "IVA":                "iva",
+    "P. lista":           "precio_lista",
+    "BNF":                "bnf",
+    "Precio":             "precio_final",
+    "Importe":            "importe",
+    "Fecha de retiro":    "fecha_retiro"
+}
+
+_IMPORT_SQL = f"""
+    INSERT INTO {TABLE_NAME} (
+        categoria, codigo, descripcion, cantidad,
+        iva, precio_lista, bnf, precio_final,
+        importe, fecha_retiro, orden
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+
+def _celda_texto(value):
+    """Valor de una celda de Excel como texto, igual que vendría en un CSV."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _leer_lotes_xlsx(path, default_cat):
+    """
+    Lee un .xlsx en modo read_only (las filas se leen del archivo a medida que
+    se recorren) y genera lotes de IMPORT_CHUNK filas como DataFrame de strings.
+    Cada hoja es una tabla con encabezado en la primera fila; si no tiene columna
+    'categoria' y la hoja se llama como una categoría, esa es la categoría de sus filas.
+    Un lote nunca mezcla hojas: su índice es la fila dentro de la hoja.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = wb.worksheets
+        for k, ws in enumerate(sheets):
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header:
+                continue
+            header = [str(h).strip() if h is not None else "" for h in header]
+            width  = len(header)
+            cat    = ws.title if ws.title in CATEGORIES else default_cat
+            n_rows = max(1, (ws.max_row or 1) - 1)
+            chunk, index = [], []
+
+            def _frame():
+                df = pd.DataFrame(chunk, columns=header, index=index)
+                return df.loc[:, [h != "" for h in header]]
+
+            # fila 2 de la hoja = índice 0, como en el CSV
+            for i, row in enumerate(rows):
+                if all(v is None for v in row):
+                    continue
+                row = (list(row) + [None] * width)[:width]
+                chunk.append([_celda_texto(v) for v in row])
+                index.append(i)
+                if len(chunk) == IMPORT_CHUNK:
+                    yield _frame(), (k + min(1.0, (i + 1) / n_rows)) / len(sheets), cat, ws.title
+                    chunk, index = [], []
+            if chunk:
+                yield _frame(), (k + 1) / len(sheets), cat, ws.title
+    finally:
+        wb.close()
+
+
+def _leer_lotes(path, default_cat):
+    """
+    Genera (lote, fracción leída, categoría por defecto, hoja) recorriendo `path` por
+    tandas de IMPORT_CHUNK filas. `lote` es un DataFrame de strings cuyo índice 0 es
+    la línea 2 (de la hoja, en un .xlsx); `hoja` es None en un .csv.
+    """
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        yield from _leer_lotes_xlsx(path, default_cat)
+        return
+    size = max(1, os.path.getsize(path))
+    with open(path, "rb") as fh:
+        # Leemos todo como strings para preservar símbolos y celdas vacías
+        for df in pd.read_csv(fh, dtype=str, chunksize=IMPORT_CHUNK):
+            yield df, fh.tell() / size, default_cat, None
+
+
+class EncabezadoInvalido(ValueError):
+    """Al encabezado del archivo le faltan columnas obligatorias."""
+
+
+def _normalizar_lote(df, default_cat):
+    """Renombra los encabezados del CSV y completa 'categoria'. EncabezadoInvalido si faltan columnas."""
+    df = df.rename(columns=_CSV_RENAMES)
+
+    # Si no viene 'categoria', asumimos la categoría actual para todas las filas
+    if "categoria" not in df.columns:
+        df["categoria"] = default_cat
+    df["categoria"] = df["categoria"].fillna(default_cat)
+
+    # Permitimos que venga 'orden' — no será motivo de error.
+    missing = [c for c in IMPORT_COLUMNS if c not in df.columns]
+    if missing:
+        raise EncabezadoInvalido(f"Faltan columnas obligatorias en el CSV: {missing}")
+    return df
+
+
+def _linea_error(e, leidas):
+    """
+    Línea del archivo en la que falló pd.read_csv: la que cita el error, o si no
+    la siguiente a las `leidas` filas ya leídas (la 1 es el encabezado).
+    """
+    m = re.search(r"line (\d+)", str(e))
+    return int(m.group(1)) if m else leidas + 2
+
+
+def _lugar(hoja, linea):
+    """'línea N', o 'hoja X, línea N' si la fila viene de una hoja de Excel."""
+    return f"hoja {hoja}, línea {linea}" if hoja else f"línea {linea}"
+
+
+def _validar_lote(df, default_cat, seen_codes, conn, hoja=None):
+    """
+    Revisa un lote del CSV sin escribir nada y devuelve sus problemas como
+    [(hoja, línea, columna, valor, problema)], ordenados por línea. Las reglas se
+    evalúan por columna (máscaras de pandas); sólo se recorren en Python las celdas
+    con problemas. `seen_codes` ({codigo: lugar de la primera aparición}) se comparte
+    entre lotes (y hojas) para detectar códigos repetidos en el archivo; `conn` se usa
+    para buscar los que ya existen en la base.
+    """
+    df = _normalizar_lote(df, default_cat)
+    lines = df.index + 2    # índice 0 = línea 2 (la 1 es el encabezado)
+    problems = []
+
+    def _report(mask, col, problem):
+        mask = mask.to_numpy()
+        label = COLUMN_LABELS.get(col, col)
+        raw = df[col].fillna("").to_numpy()[mask]
+        texts = problem[mask] if isinstance(problem, pd.Series) else [problem] * len(raw)
+        problems.extend(zip([hoja] * len(raw), lines[mask], [label] * len(raw), raw, texts))
+
+    values = {}
+    for col in ("cantidad", "precio_lista", "iva", "bnf", "precio_final", "importe"):
+        values[col], bad = numeros.parse_series(df[col])
+        _report(bad, col, "no es un número")
+
+    cantidad, iva = values["cantidad"], values["iva"]
+    _report(cantidad % 1 != 0, "cantidad", "la cantidad no es entera")
+    _report(cantidad < 0,      "cantidad", "cantidad negativa")
+    _report((iva < 0) | (iva > 100), "iva", "IVA fuera de rango (0 a 100)")
+    _report((iva % 1 != 0) & (iva >= 0) & (iva <= 100), "iva", "el IVA no es entero (se guardaría sin decimales)")
+
+    # Códigos repetidos dentro del archivo (también entre lotes)
+    codes = df["codigo"].fillna("").astype(str).str.strip()
+    keyed = codes != ""
+    kc, kl = codes[keyed], pd.Series(lines[keyed.to_numpy()], index=codes.index[keyed])
+    prev  = kc.map(seen_codes)                        # visto en un lote (u hoja) anterior
+    first = kl.groupby(kc).transform("min")           # primera aparición dentro del lote
+    dup = pd.Series(False, index=df.index)
+    dup[kc.index] = prev.notna() | (first != kl)
+    where = prev.fillna(first.map(lambda line: _lugar(hoja, line)))
+    _report(dup, "codigo", "Cod. Art. repetido en el archivo (" + where.reindex(df.index).fillna("") + ")")
+    for code, line in zip(kc, kl):
+        if code not in seen_codes:
+            seen_codes[code] = _lugar(hoja, line)
+
+    # Códigos que ya existen en la base
+    unique_codes = kc.drop_duplicates().tolist()
+    if unique_codes:
+        existing = dict(conn.execute(f"""
+            SELECT codigo, MIN(categoria) FROM {TABLE_NAME}
+             WHERE codigo IN (SELECT value FROM json_each(?))
+             GROUP BY codigo
+        """, (_json.dumps(unique_codes),)).fetchall())
+        in_db = codes.map(existing)
+        _report(in_db.notna() & keyed, "codigo",
+                "Cod. Art. ya existe en la base (categoría " + in_db.fillna("") + ")")
+    problems.sort(key=lambda p: p[1])
+    return problems
+
+
+def _guardar_informe(problems, path):
+    """
+    Escribe el informe de validación (hoja, línea, columna, valor, problema) en un CSV.
+    La columna 'hoja' sólo se escribe si el archivo validado era un Excel.
+    """
+    import csv
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if any(p[0] for p in problems):
+            writer.writerow(["hoja", "linea", "columna", "valor", "problema"])
+            writer.writerows(problems)
+        else:
+            writer.writerow(["linea", "columna", "valor", "problema"])
+            writer.writerows(p[1:] for p in problems)
+
+
+def _preparar_lote(df, default_cat, next_orden, conn, hoja=None):
+    """
+    Valida y convierte un lote del CSV (DataFrame leído como strings) en filas
+    para _IMPORT_SQL. `next_orden` ({categoria: siguiente orden}) se comparte
+    entre lotes; `conn` es la conexión de la importación (para el primer orden libre);
+    `hoja` es la hoja de Excel del lote, para los mensajes de error.
+    Lanza ValueError si al CSV le faltan columnas o hay enteros inválidos.
+    """
+    df = _normalizar_lote(df, default_cat)
+
+    # Normalizamos textos: evitar "nan" -> dejar vacío
+    for text_col in ("codigo", "descripcion", "fecha_retiro"):
+        df[text_col] = df[text_col].fillna("").astype(str)
+
+    # Columnas numéricas: cada una se convierte entera de una vez (acepta $, % y formatos);
+    # las celdas con texto que no es un número cancelan la importación
+    bad_cells = []
+    for col in ("cantidad", "precio_lista", "iva", "bnf", "precio_final", "importe"):
+        df[col], bad = numeros.parse_series(df[col])
+        bad_cells += [(idx, col) for idx in df.index[bad]]
+    if bad_cells:
+        bad_cells.sort()
+        # índice de pandas 0 = línea 2 del archivo (la 1 es el encabezado)
+        ejemplos = ", ".join(f"{_lugar(hoja, idx + 2)} ({COLUMN_LABELS.get(col, col)})" for idx, col in bad_cells[:5])
+        extra = f" y {len(bad_cells) - 5} más" if len(bad_cells) > 5 else ""
+        raise ValueError(f"Hay valores numéricos que no se pueden leer: {ejemplos}{extra}.")
+
+    # Aseguramos tipos enteros para cantidad e iva
+    try:
+        df["cantidad"] = df["cantidad"].astype(int)
+        df["iva"] = df["iva"].astype(int)
+    except (ValueError, TypeError):
+        raise ValueError("Las columnas 'cantidad' e 'iva' deben ser valores enteros válidos.")
+
+    # Orden: si falta, va al final de su categoría
+    def _parse_orden(x):
+        try:
+            return int(float(x))
+        except (ValueError, TypeError):
+            return -1
+    ordenes = df["orden"].apply(_parse_orden).tolist() if "orden" in df.columns else [-1] * len(df)
+    cats = df["categoria"].tolist()
+    for k, (cat, orden) in enumerate(zip(cats, ordenes)):
+        if orden == -1:
+            if cat not in next_orden:
+                next_orden[cat] = _siguiente_orden(conn, cat)
+            ordenes[k] = next_orden[cat]
+            next_orden[cat] += ORDEN_GAP
+
+    return list(zip(
+        cats, df["codigo"].tolist(), df["descripcion"].tolist(), df["cantidad"].tolist(),
+        df["iva"].tolist(), df["precio_lista"].astype(float).tolist(), df["bnf"].astype(float).tolist(),
+        df["precio_final"].astype(float).tolist(), df["importe"].astype(float).tolist(),
+        df["fecha_retiro"].tolist(), ordenes,
+    ))
+
+
+# Modos de importación: (clave, texto en el diálogo)
+IMPORT_MODES = [
+    ("validar",   "Sólo validar el archivo (no importa nada) y generar un informe"),
+    ("agregar",   "Agregar todas las filas como productos nuevos"),
+    ("categoria", "Actualizar por Cod. Art. dentro de cada categoría y agregar los nuevos"),
+    ("todas",     "Actualizar por Cod. Art. en todas las categorías y agregar los nuevos"),
+]
+
+# Columnas que una importación por código actualiza (categoría y orden se conservan)
+_MERGE_COLUMNS = ["codigo", "descripcion", "cantidad", "iva", "precio_lista",
+                  "bnf", "precio_final", "importe", "fecha_retiro"]
+_IMPORT_COLS   = ["categoria", "codigo", "descripcion", "cantidad", "iva", "precio_lista",
+                  "bnf", "precio_final", "importe", "fecha_retiro", "orden"]
+
+
+def _crear_lote(conn, por_categoria):
+    """
+    Tabla TEMP donde se juntan las filas del CSV antes de fusionarlas, con índice
+    único sobre la clave: una misma clave repetida en el archivo queda una sola vez
+    (gana la última fila, vía ON CONFLICT DO UPDATE). Devuelve el INSERT de carga.
+    """
+    key = "categoria, codigo" if por_categoria else "codigo"
+    conn.execute(f"CREATE TEMP TABLE import_lote ({', '.join(_IMPORT_COLS)})")
+    conn.execute(f"CREATE UNIQUE INDEX temp.import_lote_clave ON import_lote ({key})")
+    sets = ", ".join(f"{c} = excluded.{c}" for c in _IMPORT_COLS if c not in ("categoria", "codigo"))
+    return f"""
+        INSERT INTO import_lote ({', '.join(_IMPORT_COLS)})
+        VALUES ({', '.join('?' * len(_IMPORT_COLS))})
+        ON CONFLICT ({key}) DO UPDATE SET {sets}
+    """
+
+
+def _fusionar_lote(conn, por_categoria):
+    """
+    Fusiona import_lote con la tabla de productos en tres sentencias sobre conjuntos:
+    cuenta las coincidencias, actualiza las que cambian e inserta las que no existen.
+    Devuelve (insertados, actualizados, sin_cambios), contados en filas del archivo.
+    """
+    match = "p.codigo = s.codigo" + (" AND p.categoria = s.categoria" if por_categoria else "")
+    text_cols = {"codigo", "descripcion", "fecha_retiro"}
+    changed = " OR ".join(
+        f"COALESCE(p.{c}, {repr('') if c in text_cols else 0}) IS NOT s.{c}" for c in _MERGE_COLUMNS
     )
+    matched, to_update = conn.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM(EXISTS (SELECT 1 FROM {TABLE_NAME} p WHERE {match} AND ({changed}))), 0)
+          FROM import_lote s
+         WHERE EXISTS (SELECT 1 FROM {TABLE_NAME} p WHERE {match})
+    """).fetchone()
+    conn.execute(f"""
+        UPDATE {TABLE_NAME} AS p
+           SET {', '.join(f"{c} = s.{c}" for c in _MERGE_COLUMNS)}
+          FROM import_lote AS s
+         WHERE {match} AND ({changed})
+    """)
+    inserted = conn.execute(f"""
+        INSERT INTO {TABLE_NAME} ({', '.join(_IMPORT_COLS)})
+        SELECT {', '.join(f"s.{c}" for c in _IMPORT_COLS)}
+          FROM import_lote s
+         WHERE NOT EXISTS (SELECT 1 FROM {TABLE_NAME} p WHERE {match})
+         ORDER BY s.rowid
+    """).rowcount
+    return inserted, to_update, matched - to_update
+
+
+class CsvImport:
+    """
+    Importación de un CSV como tarea del ejecutor, sin congelar la ventana.
+    - La tarea usa su propia conexión: lee el archivo por tandas de IMPORT_CHUNK filas
+      (la memoria no crece con el tamaño del archivo), valida y convierte cada tanda
+      e inserta con executemany, todo dentro de UNA transacción.
+    - El progreso (bytes leídos) se muestra en un diálogo modal vía on_progress.
+    - Cancelar interrumpe la sentencia en curso y hace rollback: no queda nada a medias.
+    - Modo "agregar": todas las filas se insertan. Modos "categoria" / "todas": las
+      filas se juntan en una tabla TEMP con clave única por Cod. Art. y al final se
+      fusionan con UPDATE ... FROM / INSERT ... SELECT (ver _fusionar_lote);
+      las filas sin código se agregan siempre.
+    - Al terminar, la importación completa queda como un solo paso de deshacer: las
+      altas como un rango de ids (sin copiar las filas) y, en los modos que actualizan,
+      la imagen anterior de cada fila modificada.
+    """
+
+    def __init__(self, path, default_cat, mode="agregar"):
+        self.path        = path
+        self.default_cat = default_cat
+        self.mode        = mode
+        self._lock       = threading.Lock()   # decide entre cancelar y confirmar
+        self._committed  = False
+        self._conn       = None
+        self._step       = None
+        self.tarea       = None
+
+    def start(self):
+        self._build_dialog()
+        self._conn = db.connect()
+        if self.mode == "validar":
+            fn = self._validate_worker
+        else:
+            self._step = undo_journal.attach(self._conn)
+            fn = self._worker
+        self.tarea = ejecutor.submit(
+            fn, titulo="Importar CSV",
+            on_progress=self._progress,
+            on_done=lambda result: self._finish(*result),
+            on_error=lambda e: self._finish("error", e),
+            on_cancel=lambda: self._finish("cancelado", None),
+        )
+
+    def cancel(self):
+        if self._committed:
+            return   # ya confirmada: sólo falta terminar de registrar el paso
+        self.tarea.cancelar()
+        self.status.set("Cancelando…")
+        self.btn_cancel.state(["disabled"])
+
+    def _interrupt(self):
+        # Hook de cancelación (tarea.al_cancelar): no corta lo que ya se confirmó
+        with self._lock:
+            if not self._committed:
+                self._conn.interrupt()
+
+    def _build_dialog(self):
+        win = self.win = tk.Toplevel(root)
+        win.title("Importar CSV")
+        win.resizable(False, False)
+        win.transient(root)
+        win.protocol("WM_DELETE_WINDOW", self.cancel)
+        frame = ttk.Frame(win, padding=12)
+        frame.pack(fill="both", expand=True)
+        ttk.Label(frame, text=os.path.basename(self.path)).pack(anchor="w")
+        self.bar = ttk.Progressbar(frame, length=320, maximum=100, mode="determinate")
+        self.bar.pack(fill="x", pady=8)
+        self.status = tk.StringVar(value="Leyendo…")
+        ttk.Label(frame, textvariable=self.status).pack(anchor="w")
+        self.btn_cancel = ttk.Button(frame, text="Cancelar", command=self.cancel)
+        self.btn_cancel.pack(anchor="e", pady=(8, 0))
+        # Modal: mientras se importa no se puede editar la base desde la ventana principal
+        win.grab_set()
+
+    def _worker(self, tarea):
+        conn, step = self._conn, self._step
+        merge = self.mode != "agregar"
+        total = 0
+        counts = {"insertados": 0, "actualizados": 0, "sin_cambios": 0, "repetidos": 0}
+        tarea.al_cancelar(self._interrupt)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            undo_journal.mark(conn, step)
+            # Las altas se registran como un rango de ids (ver UndoJournal.adopt)
+            desde = conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {TABLE_NAME}").fetchone()[0]
+            if merge:
+                upsert_sql = _crear_lote(conn, self.mode == "categoria")
+            next_orden = {}
+            for df, frac, default_cat, hoja in _leer_lotes(self.path, self.default_cat):
+                tarea.comprobar()
+                rows = _preparar_lote(df, default_cat, next_orden, conn, hoja)
+                if merge:
+                    # Sin código no hay con qué comparar: se agregan directamente
+                    keyed = [r for r in rows if r[1].strip()]
+                    plain = [r for r in rows if not r[1].strip()]
+                    conn.executemany(upsert_sql, keyed)
+                else:
+                    plain = rows
+                conn.executemany(_IMPORT_SQL, plain)
+                counts["insertados"] += len(plain)
+                total += len(rows)
+                tarea.progreso(frac, f"{total} productos leídos…")
+            if merge:
+                tarea.progreso(None, "Aplicando cambios…")
+                inserted, updated, unchanged = _fusionar_lote(conn, self.mode == "categoria")
+                counts["insertados"]  += inserted
+                counts["actualizados"] = updated
+                counts["sin_cambios"]  = unchanged
+                counts["repetidos"]    = total - sum(counts.values())
+            with self._lock:
+                tarea.comprobar()
+                self._committed = True
+            undo_journal.mark(conn, None)
+            hasta = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLE_NAME}").fetchone()[0]
+            conn.commit()
+            undo_journal.adopt(conn, step, (desde, hasta))
+        except BaseException:
+            conn.rollback()
+            raise
+        return "listo", counts
+
+    def _validate_worker(self, tarea):
+        """Modo "validar": recorre todo el archivo por tandas sin escribir en la base."""
+        total, problems, seen_codes, hoja = 0, [], {}, None
+        tarea.al_cancelar(self._interrupt)
+        try:
+            # Los lotes llegan en el orden del archivo: los problemas ya quedan ordenados
+            for df, frac, default_cat, hoja in _leer_lotes(self.path, self.default_cat):
+                tarea.comprobar()
+                problems += _validar_lote(df, default_cat, seen_codes, self._conn, hoja)
+                total += len(df)
+                tarea.progreso(frac, f"{total} productos leídos…")
+        except EncabezadoInvalido as e:
+            # Encabezado inválido: no tiene sentido seguir leyendo
+            problems.append((hoja, 1, "", "", str(e)))
+        except pd.errors.ParserError as e:
+            # Fila mal formada: pandas no puede seguir leyendo desde ahí
+            problems.append((hoja, _linea_error(e, total), "", "", f"no se pudo leer el archivo: {e}"))
+        return "validado", (total, problems)
+
+    def _progress(self, tarea):
+        self.bar["value"] = min(100, (tarea.fraccion or 0) * 100)
+        if not tarea.cancelada:
+            self.status.set(tarea.texto)
+
+    def _finish(self, kind, detail):
+        # La tarea ya terminó (o ni llegó a empezar): nadie más usa la conexión
+        self._conn.close()
+        self.win.grab_release()
+        self.win.destroy()
+        if kind == "error":
+            messagebox.showerror("Importación inválida", f"No se importó ningún producto:\n{detail}")
+            return
+        if kind == "cancelado":
+            messagebox.showinfo("Importación", "Importación cancelada: no se importó ningún producto.")
+            return
+        if kind == "validado":
+            self._report(*detail)
+            return
+        undo_journal.push(self._step, "Importar CSV")
+        # Refrescamos vista
+        category_cache.clear()
+        cargar_datos()
+        if self.mode == "agregar":
+            messagebox.showinfo("Importación", f"{detail['insertados']} productos importados correctamente.")
+            return
+        msg = (f"Productos nuevos: {detail['insertados']}\n"
+               f"Actualizados: {detail['actualizados']}\n"
+               f"Sin cambios: {detail['sin_cambios']}")
+        if detail["repetidos"]:
+            msg += f"\nFilas con Cod. Art. repetido en el archivo (se usó la última): {detail['repetidos']}"
+        messagebox.showinfo("Importación", msg)
+
+
+    def _report(self, total, problems):
+        """Resultado del modo "validar": resumen y, si hay problemas, ofrecer guardarlos en CSV."""
+        if not problems:
+            messagebox.showinfo("Validar CSV", f"Sin problemas: {total} filas listas para importar.")
+            return
+        lines = len({p[:2] for p in problems})
+        if not messagebox.askyesno(
+            "Validar CSV",
+            f"Se encontraron {len(problems)} problemas en {lines} de {total} filas.\n"
+            "No se importó nada.\n\n¿Guardar el informe como CSV?"
+        ):
+            return
+        base = os.path.splitext(os.path.basename(self.path))[0]
+        path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv")],
+            initialfile=f"{base}_informe.csv",
+            title="Guardar informe de validación"
+        )
+        if not path:
+            return
+        try:
+            _guardar_informe(problems, path)
+            messagebox.showinfo("Validar CSV", f"Informe guardado en:\n{path}")
+        except Exception as e:
+            messagebox.showerror("Validar CSV", str(e))
+
+
+def _pedir_modo_importacion():
+    """Diálogo modal para elegir uno de IMPORT_MODES. Devuelve la clave o None si se cancela."""
+    win = tk.Toplevel(root)
+    win.title("Importar CSV")
+    win.resizable(False, False)
+    win.transient(root)
+    frame = ttk.Frame(win, padding=12)
+    frame.pack(fill="both", expand=True)
+    ttk.Label(frame, text="¿Qué hacer con las filas del archivo?").pack(anchor="w", pady=(0, 6))
+    choice = tk.StringVar(value="agregar")
+    for key, text in IMPORT_MODES:
+        ttk.Radiobutton(frame, text=text, value=key, variable=choice).pack(anchor="w")
+    result = [None]
+
+    def _ok():
+        result[0] = choice.get()
+        win.destroy()
+
+    buttons = ttk.Frame(frame)
+    buttons.pack(anchor="e", pady=(10, 0))
+    ttk.Button(buttons, text="Importar", command=_ok).pack(side="left", padx=(0, 6))
+    ttk.Button(buttons, text="Cancelar", command=win.destroy).pack(side="left")
+    win.grab_set()
+    win.wait_window()
+    return result[0]
+
 
 def importar_csv():
     path = filedialog.askopenfilename(
-        title="Seleccionar CSV para importar",
-        filetypes=[("CSV", "*.csv")]
+        title="Seleccionar CSV o Excel para importar",
+        filetypes=[("CSV o Excel", "*.csv *.xlsx *.xlsm"), ("CSV", "*.csv"), ("Excel", "*.xlsx *.xlsm")]
     )
     if not path:
         return
+    mode = _pedir_modo_importacion()
+    if mode is None:
+        return
+    CsvImport(path, CATEGORIES[current_cat_idx], mode).start()
+
+
+@contextmanager
+def _conexion_tarea(tarea):
+    """
+    Conexión propia para una tarea de lectura en segundo plano: todo se lee dentro
+    de UNA transacción (vista consistente aunque la ventana siga editando) y
+    cancelar la tarea interrumpe la consulta en curso.
+    """
+    conn = db.connect()
+    _registrar_funciones(conn)
+    tarea.al_cancelar(conn.interrupt)
+    try:
+        conn.execute("BEGIN")
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _lotes(cursor, tarea, total=None):
+    """Recorre `cursor` en tandas de IMPORT_CHUNK informando el avance a `tarea`; corta si se cancela."""
+    n = 0
+    while True:
+        tarea.comprobar()
+        rows = cursor.fetchmany(IMPORT_CHUNK)
+        if not rows:
+            return
+        n += len(rows)
+        _avance_filas(tarea, n, total)
+        yield rows
 
-    # Leemos todo como strings para preservar símbolos y celdas vacías
-    df = pd.read_csv(path, dtype=str)
-
-    # Normalizamos nombres de columnas (si vienen)
-    df = df.rename(columns={
-        "Cantidad":           "cantidad",
-        "Cod. Art.":          "codigo",
-        "Concepto":           "descripcion",
-        "Descripción":        "descripcion",
-        "% IVA":              "iva",
-        "IVA":                "iva",
-        "P. lista":           "precio_lista",
-        "BNF":                "bnf",
-        "Precio":             "precio_final",
-        "Importe":            "importe",
-        "Fecha de retiro":    "fecha_retiro"
-    })
 
-    # Si no viene 'categoria', asumimos la categoría actual para todas las filas
-    if "categoria" not in df.columns:
-        df["categoria"] = CATEGORIES[current_cat_idx]
+def _avance_filas(tarea, n, total):
+    """Informa a `tarea` que van `n` filas, de `total` si se conoce."""
+    if total:
+        tarea.progreso(min(1.0, n / total), f"{n} de {total} filas")
+    else:
+        tarea.progreso(None, f"{n} filas")
 
-    # Permitimos que venga 'orden' — no será motivo de error.
-    expected = set(IMPORT_COLUMNS)
-    present = set(df.columns) - {"categoria", "orden"}
-    missing = [c for c in expected if c not in present]
-    if missing:
-        return messagebox.showerror(
-            "Importación inválida",
-            f"Faltan columnas obligatorias en el CSV: {missing}"
-        )
 
-    # Normalizamos textos: evitar "nan" -> dejar vacío
-    for text_col in ("codigo", "descripcion", "fecha_retiro"):
-        if text_col in df.columns:
-            df[text_col] = df[text_col].fillna("").astype(str)
+def _total_productos(conn):
+    """Cantidad de productos según TOTALS_TABLE (sin recorrer la tabla)."""
+    row = conn.execute(f"SELECT productos FROM {TOTALS_TABLE} WHERE categoria = ?", (TOTALS_ALL,)).fetchone()
+    return row[0] if row else None
 
-    # Parseo de columnas numéricas usando _parse_number_from_db (acepta $, % y formatos)
-    numeric_cols = ["cantidad", "precio_lista", "iva", "bnf", "precio_final", "importe"]
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = df[col].apply(lambda v: _parse_number_from_db(v) if v is not None and str(v).strip() != "" else 0.0)
 
-    # Aseguramos tipos enteros para cantidad e iva
+def _borrar_archivo(path):
+    """Borra un archivo de salida incompleto (si no existe, no pasa nada)."""
     try:
-        if "cantidad" in df.columns:
-            df["cantidad"] = df["cantidad"].astype(int)
-        if "iva" in df.columns:
-            df["iva"] = df["iva"].astype(int)
-    except Exception:
-        return messagebox.showerror("Importación inválida", "Las columnas 'cantidad' e 'iva' deben ser valores enteros válidos.")
+        os.remove(path)
+    except OSError:
+        pass
 
-    # Para precio_lista, bnf, precio_final, importe -> float
-    for col in ("precio_lista", "bnf", "precio_final", "importe"):
-        if col in df.columns:
-            df[col] = df[col].astype(float)
 
-    # Orden
-    if "orden" in df.columns:
-        def _parse_orden(x):
-            try:
-                return int(float(x))
-            except Exception:
-                return -1
-        df["orden"] = df["orden"].fillna(-1).apply(_parse_orden)
+def _abrir_archivo(path):
+    """Abre `path` con la aplicación predeterminada del sistema."""
+    if os.name == "nt":
+        os.startfile(path)
     else:
-        df["orden"] = -1
-
-    # Guardamos snapshot para deshacer
-    snapshot()
-
-    # Insertar en DB: si alguna fila tiene orden == -1, calculamos el next_orden por su categoría
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cats_with_missing = df.loc[df["orden"] == -1, "categoria"].unique().tolist()
-        next_orden_map = {}
-        for cat in cats_with_missing:
-            q = conn.execute(f"SELECT COALESCE(MAX(orden), -1) FROM {TABLE_NAME} WHERE categoria = ?", (cat,)).fetchone()[0]
-            next_orden_map[cat] = q + 1
-
-        insert_sql = f"""
-            INSERT INTO {TABLE_NAME} (
-                categoria, codigo, descripcion, cantidad,
-                iva, precio_lista, bnf, precio_final,
-                importe, fecha_retiro, orden
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
-        """
-        rows_to_insert = []
-        for _, r in df.iterrows():
-            categoria = r["categoria"]
-            codigo    = r.get("codigo", "") or ""
-            descripcion = r.get("descripcion", "") or ""
-            cantidad  = int(r.get("cantidad", 0) or 0)
-            iva_val   = int(r.get("iva", 0) or 0)
-            precio_lista_val = float(r.get("precio_lista", 0.0) or 0.0)
-            bnf_val   = float(r.get("bnf", 0.0) or 0.0)
-            precio_final_val = float(r.get("precio_final", 0.0) or 0.0)
-            importe_val = float(r.get("importe", 0.0) or 0.0)
-            retiro    = r.get("fecha_retiro", "") or ""
-
-            orden_val = int(r.get("orden", -1) or -1)
-            if orden_val == -1:
-                orden_val = next_orden_map.setdefault(categoria, next_orden_map.get(categoria, 0))
-                next_orden_map[categoria] = orden_val + 1
-
-            # --- Aquí formateamos de vuelta con símbolos ANTES de insertar ---
-            precio_lista_str = f"{precio_lista_val:.1f} $"
-            precio_final_str = f"{precio_final_val:.3f} $"
-            importe_str      = f"{importe_val:.2f} $"
-            iva_str          = f"{iva_val} %"
-
-            rows_to_insert.append((
-                categoria, codigo, descripcion, cantidad,
-                iva_str, precio_lista_str, bnf_val,
-                precio_final_str, importe_str, retiro, orden_val
-            ))
-
-        cur.executemany(insert_sql, rows_to_insert)
-        conn.commit()
-
-    # Refrescamos vista
-    cargar_datos()
-    messagebox.showinfo("Importación", f"{len(rows_to_insert)} productos importados correctamente.")
+        os.system(f'xdg-open "{path}"')
 
 
 def exportar_csv():
     """Exporta a CSV todos los productos de todas las categorías,
-    incluyendo las columnas 'categoria' y 'orden', respetando el orden actual."""
+    incluyendo las columnas 'categoria' y 'orden', respetando el orden actual.
+    La escritura corre como tarea en segundo plano (ver _exportar_csv)."""
     path = filedialog.asksaveasfilename(
         defaultextension=".csv",
         filetypes=[("CSV","*.csv")],
@@ -892,10 +2769,17 @@ def exportar_csv():
     )
     if not path:
         return
+    ejecutor.submit(
+        _exportar_csv, path, titulo="Exportar CSV",
+        on_done=lambda n: messagebox.showinfo(
+            "Exportar CSV", f"{n} productos exportados correctamente a:\n{path}"),
+    )
 
+
+def _exportar_csv(tarea, path):
     import csv
     try:
-        with sqlite3.connect(DB_PATH) as conn, open(path, "w", newline="", encoding="utf-8") as f:
+        with _conexion_tarea(tarea) as conn, open(path, "w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             # Cabecera: categoria, orden y luego las columnas visibles (en tu orden actual)
             headers = ["categoria", "orden"] + VISIBLE_COLUMNS
@@ -907,15 +2791,196 @@ def exportar_csv():
                   FROM {TABLE_NAME}
                  ORDER BY categoria, orden
             """)
-            for row in cursor:
-                writer.writerow(row)
+            # Los números se guardan sin símbolos: se formatean aquí ($ / %)
+            n = 0
+            for rows in _lotes(cursor, tarea, _total_productos(conn)):
+                writer.writerows(
+                    row[:2] + tuple(_fmt(c, v) for c, v in zip(VISIBLE_COLUMNS, row[2:]))
+                    for row in rows
+                )
+                n += len(rows)
+        return n
+    except BaseException:
+        _borrar_archivo(path)
+        raise
+
+
+# Formato numérico de Excel para las columnas con $ o % (ver COLUMN_FORMATS)
+XLSX_FORMATS = {
+    "precio_lista": '0.0 "$"',
+    "iva":          '0 "%"',
+    "precio_final": '0.000 "$"',
+    "importe":      '0.00 "$"',
+}
 
-        messagebox.showinfo("Exportar CSV", f"Todos los productos exportados correctamente a:\n{path}")
-    except Exception as e:
-        messagebox.showerror("Error al exportar CSV", str(e))
+
+def _titulo_hoja(name, used):
+    """Nombre válido y único para una hoja de Excel (máx. 31 caracteres, sin []:*?/\\)."""
+    title = re.sub(r"[\[\]:*?/\\]", "_", str(name or "Sin categoría"))[:31] or "Hoja"
+    base, n = title, 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+
+def exportar_xlsx():
+    """
+    Exporta todos los productos a un .xlsx con una hoja por categoría.
+    El libro se crea en modo write_only: cada fila se escribe al archivo a medida
+    que se lee de la BD (fetchmany), sin armar la hoja en memoria. Los números
+    quedan como celdas numéricas con formato ($ / %), no como texto.
+    Corre como tarea en segundo plano (ver _exportar_xlsx).
+    """
+    path = filedialog.asksaveasfilename(
+        defaultextension=".xlsx",
+        filetypes=[("Excel", "*.xlsx")],
+        title="Guardar todos los productos como Excel"
+    )
+    if not path:
+        return
+    ejecutor.submit(
+        _exportar_xlsx, path, titulo="Exportar Excel",
+        on_done=lambda n: messagebox.showinfo(
+            "Exportar Excel", f"{n} productos exportados correctamente a:\n{path}"),
+    )
+
+
+def _exportar_xlsx(tarea, path):
+    cols = ["orden"] + VISIBLE_COLUMNS
+    n = 0
+    try:
+        wb = Workbook(write_only=True)
+        with _conexion_tarea(tarea) as conn:
+            total = _total_productos(conn)
+            present = [r[0] for r in conn.execute(f"SELECT DISTINCT categoria FROM {TABLE_NAME}")]
+            cats = [c for c in CATEGORIES if c in present] + sorted(c for c in present if c not in CATEGORIES and c)
+            if None in present or "" in present:
+                cats.append(None)
+            used = set()
+            for cat in cats or CATEGORIES[:1]:
+                ws = wb.create_sheet(_titulo_hoja(cat, used))
+                header = ["orden"] + [COLUMN_LABELS[c] for c in VISIBLE_COLUMNS]
+                if cat is None:
+                    # Filas sin categoría: se conserva la columna para poder reimportarlas
+                    header = ["categoria"] + header
+                ws.append(header)
+
+                fmt_pos = [(i, XLSX_FORMATS[c]) for i, c in enumerate(cols) if c in XLSX_FORMATS]
+                where = "COALESCE(categoria, '') = ''" if cat is None else "categoria = ?"
+                cur = conn.execute(f"""
+                    SELECT {', '.join(cols)} FROM {TABLE_NAME}
+                     WHERE {where}
+                     ORDER BY orden, id
+                """, () if cat is None else (cat,))
+                while True:
+                    tarea.comprobar()
+                    rows = cur.fetchmany(IMPORT_CHUNK)
+                    if not rows:
+                        break
+                    for row in rows:
+                        row = _fila_xlsx(ws, row, fmt_pos)
+                        ws.append([""] + row if cat is None else row)
+                    n += len(rows)
+                    _avance_filas(tarea, n, total)
+        tarea.progreso(None, "Guardando…")
+        wb.save(path)
+        return n
+    except BaseException:
+        _borrar_archivo(path)
+        raise
+
+
+def _fila_xlsx(ws, row, fmt_pos):
+    """Fila lista para ws.append(): los números de `fmt_pos` van como celdas con formato."""
+    row = list(row)
+    for i, fmt in fmt_pos:
+        if isinstance(row[i], (int, float)):
+            cell = WriteOnlyCell(ws, value=row[i])
+            cell.number_format = fmt
+            row[i] = cell
+    return row
+
+
+def exportar_vista(solo_seleccion=False):
+    """
+    Exporta lo que muestra la tabla (categoría, búsqueda y orden actuales) o sólo
+    las filas seleccionadas, a CSV o Excel según la extensión elegida.
+    Se ejecuta la misma consulta que llenó la vista (_vista_sql) y las filas pasan
+    del cursor al archivo en lotes de fetchmany: no se arman listas ni se toca el Treeview.
+    La consulta se arma aquí y la escritura corre como tarea en segundo plano.
+    """
+    ids = None
+    if solo_seleccion:
+        ids = virtual_tree.selected_ids()
+        if not ids:
+            messagebox.showinfo("Exportar selección", "No hay filas seleccionadas.")
+            return
+    title = "Exportar selección" if solo_seleccion else "Exportar vista actual"
+    path = filedialog.asksaveasfilename(
+        defaultextension=".csv",
+        filetypes=[("CSV", "*.csv"), ("Excel", "*.xlsx")],
+        title=title
+    )
+    if not path:
+        return
+
+    cols = ["categoria", "orden"] + VISIBLE_COLUMNS
+    sql, params = _vista_sql(columns=cols, ids=ids)
+    ejecutor.submit(
+        _exportar_consulta, path, cols, sql, params, CATEGORIES[current_cat_idx],
+        titulo=title,
+        on_done=lambda n: messagebox.showinfo(title, f"{n} filas exportadas correctamente a:\n{path}"),
+    )
+
+
+def _exportar_consulta(tarea, path, cols, sql, params, sheet):
+    """Escribe el resultado de `sql` a CSV o a una hoja `sheet` de Excel, según la extensión de `path`."""
+    xlsx = path.lower().endswith(".xlsx")
+    import csv
+    n = 0
+    try:
+        with _conexion_tarea(tarea) as conn:
+            cur = conn.execute(sql, params)
+            if xlsx:
+                wb = Workbook(write_only=True)
+                ws = wb.create_sheet(_titulo_hoja(sheet, set()))
+                ws.append(["categoria", "orden"] + [COLUMN_LABELS[c] for c in VISIBLE_COLUMNS])
+                fmt_pos = [(i, XLSX_FORMATS[c]) for i, c in enumerate(cols) if c in XLSX_FORMATS]
+            else:
+                f = open(path, "w", newline="", encoding="utf-8")
+                writer = csv.writer(f)
+                writer.writerow(cols)
+            try:
+                for rows in _lotes(cur, tarea):
+                    n += len(rows)
+                    if xlsx:
+                        for row in rows:
+                            ws.append(_fila_xlsx(ws, row, fmt_pos))
+                    else:
+                        writer.writerows(
+                            row[:2] + tuple(_fmt(c, v) for c, v in zip(VISIBLE_COLUMNS, row[2:]))
+                            for row in rows
+                        )
+            finally:
+                if not xlsx:
+                    f.close()
+        if xlsx:
+            wb.save(path)
+        return n
+    except BaseException:
+        _borrar_archivo(path)
+        raise
 
 
 def imprimir_stock():
+    """
+    Genera un PDF con todos los productos (por categoría y en su orden) y lo abre.
+    Las filas pasan del cursor de SQLite a informes.TablaPDF, que dibuja página
+    por página: ni la tabla completa ni un Paragraph por celda quedan en memoria.
+    El PDF se arma como tarea en segundo plano (ver _imprimir_stock).
+    """
     # Pedir ruta de guardado
     path = filedialog.asksaveasfilename(
         defaultextension=".pdf",
@@ -925,55 +2990,376 @@ def imprimir_stock():
     if not path:
         return
 
-    # Preparamos documento y estilos
-    doc = SimpleDocTemplate(
-        path,
-        pagesize=A4,
-        leftMargin=40, rightMargin=40,
-        topMargin=40, bottomMargin=40
+    def _listo(_n):
+        # Abrimos el PDF generado
+        messagebox.showinfo("Imprimir", f"PDF generado en:\n{path}")
+        _abrir_archivo(path)
+
+    ejecutor.submit(_imprimir_stock, path, titulo="Imprimir", on_done=_listo)
+
+
+def _imprimir_stock(tarea, path):
+    cols = ["categoria"] + VISIBLE_COLUMNS
+    try:
+        with _conexion_tarea(tarea) as conn:
+            total = _total_productos(conn)
+
+            def _pagina(rows):
+                tarea.comprobar()
+                _avance_filas(tarea, rows, total)
+
+            with informes.TablaPDF(path, cols, REPORT_LABELS, COLUMN_FORMATS,
+                                   title="Stock", on_page=_pagina) as pdf:
+                pdf.write(conn.execute(f"""
+                    SELECT {', '.join(cols)} FROM {TABLE_NAME}
+                     ORDER BY categoria, orden, id
+                """))
+        return pdf.rows
+    except BaseException:
+        _borrar_archivo(path)
+        raise
+
+
+def _nombre_archivo(name):
+    """`name` sin los caracteres que Windows no admite en nombres de archivo."""
+    return re.sub(r'[<>:"/\\|?*]', "_", str(name or "Sin categoría")).strip() or "_"
+
+
+def _trabajos_por_categoria(folder):
+    """
+    Un trabajo de informes.comando_trabajo por categoría: [(trabajo, filas)].
+    Las filas por categoría salen de TOTALS_TABLE (sin recorrer los productos).
+    """
+    cols = ["categoria"] + VISIBLE_COLUMNS
+    counts = db.query(f"""
+        SELECT categoria, productos FROM {TOTALS_TABLE}
+         WHERE categoria <> ? AND productos > 0
+         ORDER BY categoria
+    """, (TOTALS_ALL,))
+    jobs, used = [], set()
+    for cat, n in counts:
+        name = _nombre_archivo(cat)
+        while name.lower() in used:
+            name += "_"
+        used.add(name.lower())
+        where = "COALESCE(categoria, '') = ''" if not cat else "categoria = ?"
+        jobs.append(({
+            "db":      DB_PATH,
+            "path":    os.path.join(folder, f"Stock - {name}.pdf"),
+            "sql":     f"SELECT {', '.join(cols)} FROM {TABLE_NAME} WHERE {where} ORDER BY orden, id",
+            "params":  [cat] if cat else [],
+            "columns": cols,
+            "labels":  REPORT_LABELS,
+            "formats": COLUMN_FORMATS,
+            "title":   f"Stock - {cat or 'Sin categoría'}",
+        }, n))
+    return jobs
+
+
+def _imprimir_por_categoria(tarea, jobs):
+    """
+    Genera un PDF por categoría usando todos los núcleos. Devuelve [(título, error)]
+    de los que fallaron.
+    - Cada trabajo corre en un proceso aparte (informes.comando_trabajo) que lee la
+      base en sólo lectura; corren hasta PDF_WORKERS a la vez y el resto espera.
+    - Un hilo por proceso lee su stdout (filas escritas por página) y lo pasa a una
+      cola; esta tarea la atiende y lanza procesos a medida que se libera lugar.
+    - Cancelar termina los procesos en curso y borra los PDF incompletos.
+    Sin una biblioteca para unir PDF, el resultado son archivos separados
+    ("Stock - <categoría>.pdf").
+    """
+    events  = queue.Queue()
+    pending = list(range(len(jobs)))   # trabajos que esperan proceso
+    running = {}                       # índice -> Popen
+    done    = {}                       # índice -> filas escritas (en curso o terminadas)
+    failed  = []
+    total   = sum(n for _job, n in jobs) or 1
+    # Cancelar sólo despierta a la tarea: los procesos se terminan abajo
+    tarea.al_cancelar(lambda: events.put(("cancelar",)))
+    try:
+        while pending or running:
+            while pending and len(running) < PDF_WORKERS:
+                i = pending.pop(0)
+                running[i] = _lanzar_pdf(i, jobs[i][0], events)
+                done[i] = 0
+            # Esperamos al menos un aviso y juntamos los que ya llegaron
+            batch = [events.get()]
+            try:
+                while True:
+                    batch.append(events.get_nowait())
+            except queue.Empty:
+                pass
+            tarea.comprobar()
+            for ev in batch:
+                if ev[0] == "progreso":
+                    done[ev[1]] = ev[2]
+                elif ev[0] == "fin":
+                    _kind, i, code, err = ev
+                    running.pop(i)
+                    job, n = jobs[i]
+                    if code == 0:
+                        done[i] = n
+                    else:
+                        _borrar_archivo(job["path"])
+                        failed.append((job["title"], err.splitlines()[-1] if err else f"código {code}"))
+            rows = sum(done.values())
+            tarea.progreso(min(1.0, rows / total), f"{rows} de {total} filas · {len(running)} procesos")
+    finally:
+        # Cancelada o con error: nada de procesos sueltos ni PDF a medias
+        for i, proc in running.items():
+            proc.terminate()
+            proc.wait()
+            _borrar_archivo(jobs[i][0]["path"])
+    return failed
+
+
+def _lanzar_pdf(i, job, events):
+    """Arranca el proceso del trabajo `i` y un hilo que pasa sus avisos a `events`."""
+    # stderr va a un archivo temporal y no a un pipe: si el proceso escribe
+    # mucho ahí (un traceback largo, avisos) no se traba esperando que se lea
+    err = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        informes.comando_trabajo(job),
+        stdout=subprocess.PIPE, stderr=err,
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+    )
+    threading.Thread(target=_leer_pdf, args=(i, proc, err, events), name="imprimir_pdf", daemon=True).start()
+    return proc
+
+
+def _leer_pdf(i, proc, err, events):
+    with err:
+        for line in proc.stdout:
+            try:
+                events.put(("progreso", i, int(line)))
+            except ValueError:
+                pass
+        code = proc.wait()
+        err.seek(0)
+        text = err.read().decode("utf-8", "replace").strip()
+    events.put(("fin", i, code, text))
+
+
+def imprimir_por_categoria():
+    folder = filedialog.askdirectory(title="Carpeta para los PDF por categoría")
+    if not folder:
+        return
+    jobs = _trabajos_por_categoria(folder)
+    if not jobs:
+        messagebox.showinfo("Imprimir por categoría", "No hay productos para imprimir.")
+        return
+
+    def _listo(failed):
+        ok = len(jobs) - len(failed)
+        msg = f"{ok} PDF generados en:\n{folder}"
+        if failed:
+            detalle = "\n".join(f"- {t}: {e}" for t, e in failed)
+            messagebox.showerror("Imprimir por categoría", f"{msg}\n\nFallaron:\n{detalle}")
+            return
+        messagebox.showinfo("Imprimir por categoría", msg)
+        _abrir_archivo(folder)
+
+    ejecutor.submit(
+        _imprimir_por_categoria, jobs, titulo="Imprimir por categoría",
+        on_done=_listo,
+        on_cancel=lambda: messagebox.showinfo("Imprimir por categoría", "Impresión cancelada."),
     )
-    styles = getSampleStyleSheet()
-    styleN = styles["BodyText"]
-    styleN.wordWrap = 'CJK'  # activa el wrap
-
-    # Encabezados y recogida de datos
-    data = []
-    cols_to_print = [c for c in COLUMNS if c != "id"]
-    header_pars = [Paragraph(COLUMN_LABELS[c], styleN) for c in cols_to_print]
-    data.append(header_pars)
-
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME}")
-        for row in cursor:
-            vals = []
-            for idx, c in enumerate(COLUMNS):
-                if c == "id":
-                    continue
-                vals.append(Paragraph(str(row[idx]), styleN))
-            data.append(vals)
-
-    # Anchos iguales
-    page_w, page_h = A4
-    usable_w = page_w - doc.leftMargin - doc.rightMargin
-    n_cols   = len(cols_to_print)
-    colWidths = [usable_w / n_cols] * n_cols
-
-    # Tabla con encabezado repetido
-    table = Table(data, colWidths=colWidths, repeatRows=1)
-    table.setStyle(TableStyle([
-        ('GRID',       (0,0), (-1,-1), 0.5, colors.grey),
-        ('BACKGROUND', (0,0), (-1,0),   colors.lightblue),
-        ('VALIGN',     (0,0), (-1,-1),  'TOP'),
-        ('WORDWRAP',   (0,0), (-1,-1),  True),
-    ]))
-
-    # Generamos el PDF y lo abrimos
-    doc.build([table])
-    messagebox.showinfo("Imprimir", f"PDF generado en:\n{path}")
-    if os.name == "nt":
-        os.startfile(path)
-    else:
-        os.system(f'xdg-open "{path}"')
+
+# Etiquetas y formatos de los informes (además de las columnas de la tabla)
+REPORT_LABELS = {
+    "categoria":   "Categoría",
+    **COLUMN_LABELS,
+    "productos":   "Productos",
+    "unidades":    "Unidades",
+    "valor_lista": "Valor lista",
+    "bajo_stock":  "Bajo stock",
+}
+REPORT_FORMATS = {
+    **COLUMN_FORMATS,
+    "productos":   "{:g}",
+    "unidades":    "{:g}",
+    "valor_lista": "{:.2f} $",
+    "bajo_stock":  "{:g}",
+}
+
+
+def _fecha_param(text):
+    """Parámetro de fecha de un informe: 'dd/mm/aaaa' -> 'aaaa-mm-dd' (ValueError si no es válida)."""
+    iso = _fecha_iso(text)
+    if iso is None:
+        raise ValueError(f"'{text}' no es una fecha (dd/mm/aaaa)")
+    return iso
+
+
+# Informes predefinidos. Cada uno es UNA consulta SQL (agregada cuando corresponde);
+# sus parámetros son (nombre, etiqueta, conversión, valor por defecto) y llegan
+# a la consulta como :nombre.
+REPORTS = {
+    "bajo_stock": {
+        "titulo":     "Bajo stock",
+        "parametros": [("umbral", "Cantidad menor que", int, str(LOW_STOCK))],
+        "columnas":   ["categoria", "codigo", "descripcion", "cantidad", "precio_final", "importe"],
+        "sql": f"""
+            SELECT categoria, codigo, descripcion, cantidad, precio_final, importe
+              FROM {TABLE_NAME}
+             WHERE cantidad < :umbral
+             ORDER BY categoria, cantidad, orden, id
+        """,
+    },
+    "valuacion": {
+        "titulo":     "Valuación por categoría",
+        "parametros": [],
+        "columnas":   ["categoria", "productos", "unidades", "valor_lista", "importe", "bajo_stock"],
+        # Subtotal por categoría y total general en la misma pasada
+        "sql": f"""
+            WITH g AS (
+                SELECT COALESCE(NULLIF(categoria, ''), 'Sin categoría') AS categoria,
+                       COUNT(*)                                  AS productos,
+                       TOTAL(cantidad)                           AS unidades,
+                       TOTAL(cantidad * precio_lista)            AS valor_lista,
+                       TOTAL(importe)                            AS importe,
+                       SUM(COALESCE(cantidad, 0) < {LOW_STOCK})  AS bajo_stock
+                  FROM {TABLE_NAME}
+                 GROUP BY 1
+            )
+            SELECT categoria, productos, unidades, valor_lista, importe, bajo_stock
+              FROM (
+                SELECT 0 AS k, * FROM g
+                UNION ALL
+                SELECT 1, 'Total', TOTAL(productos), TOTAL(unidades), TOTAL(valor_lista),
+                       TOTAL(importe), TOTAL(bajo_stock)
+                  FROM g
+              )
+             ORDER BY k, categoria
+        """,
+    },
+    "retiros": {
+        "titulo":     "Retiros por fecha",
+        "parametros": [
+            ("desde", "Desde (dd/mm/aaaa)", _fecha_param, datetime.now().replace(day=1).strftime("%d/%m/%Y")),
+            ("hasta", "Hasta (dd/mm/aaaa)", _fecha_param, datetime.now().strftime("%d/%m/%Y")),
+        ],
+        "columnas":   ["fecha_retiro", "categoria", "codigo", "descripcion", "cantidad", "importe"],
+        "sql": f"""
+            SELECT fecha_retiro, categoria, codigo, descripcion, cantidad, importe
+              FROM {TABLE_NAME}
+             WHERE fecha_iso(fecha_retiro) BETWEEN :desde AND :hasta
+             ORDER BY fecha_iso(fecha_retiro), categoria, orden, id
+        """,
+    },
+}
+
+
+def _pedir_informe():
+    """
+    Diálogo modal para elegir un informe de REPORTS, sus parámetros y el formato.
+    Devuelve (clave, {parametro: valor}, textos, "pdf" | "csv") o None si se cancela.
+    """
+    win = tk.Toplevel(root)
+    win.title("Informes")
+    win.resizable(False, False)
+    win.transient(root)
+    frame = ttk.Frame(win, padding=12)
+    frame.pack(fill="both", expand=True)
+    choice = tk.StringVar(value=next(iter(REPORTS)))
+    fields = {}
+    for key, rep in REPORTS.items():
+        ttk.Radiobutton(frame, text=rep["titulo"], value=key, variable=choice).pack(anchor="w", pady=(4, 0))
+        for name, label, _conv, default in rep["parametros"]:
+            row = ttk.Frame(frame)
+            row.pack(anchor="w", padx=(24, 0))
+            ttk.Label(row, text=label, width=20).pack(side="left")
+            var = tk.StringVar(value=default)
+            ttk.Entry(row, textvariable=var, width=12).pack(side="left")
+            fields[(key, name)] = var
+    fmt = tk.StringVar(value="pdf")
+    fmt_row = ttk.Frame(frame)
+    fmt_row.pack(anchor="w", pady=(10, 0))
+    ttk.Label(fmt_row, text="Formato:").pack(side="left", padx=(0, 6))
+    ttk.Radiobutton(fmt_row, text="PDF", value="pdf", variable=fmt).pack(side="left")
+    ttk.Radiobutton(fmt_row, text="CSV", value="csv", variable=fmt).pack(side="left")
+    result = [None]
+
+    def _ok():
+        key = choice.get()
+        params, texts = {}, []
+        try:
+            for name, label, conv, _default in REPORTS[key]["parametros"]:
+                text = fields[(key, name)].get().strip()
+                params[name] = conv(text)
+                texts.append(f"{label.split(' (')[0]} {text}")
+        except ValueError as e:
+            messagebox.showerror("Informes", f"Parámetro inválido: {e}", parent=win)
+            return
+        result[0] = (key, params, texts, fmt.get())
+        win.destroy()
+
+    buttons = ttk.Frame(frame)
+    buttons.pack(anchor="e", pady=(10, 0))
+    ttk.Button(buttons, text="Generar", command=_ok).pack(side="left", padx=(0, 6))
+    ttk.Button(buttons, text="Cancelar", command=win.destroy).pack(side="left")
+    win.grab_set()
+    win.wait_window()
+    return result[0]
+
+
+def generar_informe():
+    """
+    Genera uno de los informes de REPORTS: la consulta se ejecuta una vez y su
+    cursor va directo a informes.TablaPDF o al CSV, sin pasar por la tabla.
+    Corre como tarea en segundo plano (ver _generar_informe).
+    """
+    chosen = _pedir_informe()
+    if chosen is None:
+        return
+    key, params, texts, fmt = chosen
+    rep = REPORTS[key]
+    title = rep["titulo"] + (f" ({', '.join(texts)})" if texts else "")
+    path = filedialog.asksaveasfilename(
+        defaultextension=f".{fmt}",
+        filetypes=[("PDF", "*.pdf")] if fmt == "pdf" else [("CSV", "*.csv")],
+        initialfile=f"{_nombre_archivo(rep['titulo'])}.{fmt}",
+        title="Guardar informe como"
+    )
+    if not path:
+        return
+
+    def _listo(n):
+        messagebox.showinfo("Informes", f"{title}: {n} filas.\nGuardado en:\n{path}")
+        if fmt == "pdf":
+            _abrir_archivo(path)
+
+    ejecutor.submit(_generar_informe, path, rep, params, title, fmt, titulo="Informe", on_done=_listo)
+
+
+def _generar_informe(tarea, path, rep, params, title, fmt):
+    cols = rep["columnas"]
+    import csv
+    try:
+        with _conexion_tarea(tarea) as conn:
+            cur = conn.execute(rep["sql"], params)
+            if fmt == "pdf":
+                with informes.TablaPDF(path, cols, REPORT_LABELS, REPORT_FORMATS, title=title,
+                                       on_page=lambda rows: tarea.comprobar()) as pdf:
+                    pdf.write(cur)
+                return pdf.rows
+            formats = [REPORT_FORMATS.get(c) for c in cols]
+            n = 0
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow([REPORT_LABELS.get(c, c) for c in cols])
+                for rows in _lotes(cur, tarea):
+                    n += len(rows)
+                    writer.writerows(
+                        [fm.format(v) if fm and isinstance(v, (int, float)) else v
+                         for fm, v in zip(formats, row)]
+                        for row in rows
+                    )
+            return n
+    except BaseException:
+        _borrar_archivo(path)
+        raise
+
 
 def calcular_importe(event=None):
     # Leemos y limpiamos el contenido de P. lista
@@ -1030,9 +3416,8 @@ def limpiar_form():
     ):
         widget.delete(0, tk.END)
 
-    # Deselecciono cualquier fila
-    for sel in tree.selection():
-        tree.selection_remove(sel)
+    # Deselecciono cualquier fila (también las que no se ven en modo virtual)
+    virtual_tree.clear_selection()
 
 def guardar_producto():
     global current_id
@@ -1070,20 +3455,16 @@ def guardar_producto():
 
     # PRE-CHECK de duplicado al crear
     if current_id is None:
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.execute(
-                f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE codigo = ?",
-                (codigo,)
+        dup = db.scalar(
+            f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE codigo = ?",
+            (codigo,), default=0
+        )
+        if dup > 0:
+            messagebox.showwarning(
+                "Código duplicado",
+                f"Ya existe un producto con Cod. Art. = {codigo}.\n"
+                "Continuaremos de todas formas."
             )
-            if cur.fetchone()[0] > 0:
-                messagebox.showwarning(
-                    "Código duplicado",
-                    f"Ya existe un producto con Cod. Art. = {codigo}.\n"
-                    "Continuaremos de todas formas."
-                )
-
-    # Snapshot para deshacer
-    snapshot()
 
     # Preparar datos
     descripcion      = entry_descripcion.get().strip()
@@ -1091,16 +3472,11 @@ def guardar_producto():
     precio_final     = round(precio_lista * (1 + iva/100), 3)
     importe          = round(cantidad * precio_final, 2)
 
-    precio_lista_str = f"{precio_lista:.1f} $"
-    precio_final_str = f"{precio_final:.3f} $"
-    importe_str      = f"{importe:.2f} $"
-    iva_str          = f"{iva} %"
-
     cat = CATEGORIES[current_cat_idx]
 
     # INSERT o UPDATE con orden
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with undo_journal.step("Guardar producto") as conn:
             if current_id:
                 # Al editar, no cambiamos el campo orden
                 sql = f"""
@@ -1119,17 +3495,13 @@ def guardar_producto():
                 """
                 params = (
                     cat, codigo, descripcion, cantidad,
-                    precio_lista_str, iva_str, bnf,
-                    precio_final_str, importe_str,
+                    precio_lista, iva, bnf,
+                    precio_final, importe,
                     retiro, current_id
                 )
             else:
                 # Al insertar, calculamos next_orden para esta categoría
-                cur = conn.execute(
-                    f"SELECT COALESCE(MAX(orden), -1) FROM {TABLE_NAME} WHERE categoria = ?",
-                    (cat,)
-                )
-                next_orden = cur.fetchone()[0] + 1
+                next_orden = _siguiente_orden(conn, cat)
 
                 sql = f"""
                     INSERT INTO {TABLE_NAME} (
@@ -1141,12 +3513,13 @@ def guardar_producto():
                 """
                 params = (
                     cat, codigo, descripcion, cantidad,
-                    precio_lista_str, iva_str, bnf,
-                    precio_final_str, importe_str,
+                    precio_lista, iva, bnf,
+                    precio_final, importe,
                     retiro, next_orden
                 )
 
-            conn.execute(sql, params)
+            cur = conn.execute(sql, params)
+        category_cache.refresh_ids([current_id or cur.lastrowid])
     except Exception as e:
         messagebox.showerror("Error al guardar", str(e))
 
@@ -1191,10 +3564,10 @@ def eliminar_producto():
     if not messagebox.askyesno("Eliminar", "¿Confirmar eliminación?"):
         return
 
-    snapshot()  # guardo estado para poder deshacer
-
-    with sqlite3.connect(DB_PATH) as conn:
+    # guardo el cambio para poder deshacer
+    with undo_journal.step("Eliminar producto") as conn:
         conn.execute(f"DELETE FROM {TABLE_NAME} WHERE id=?", (pid,))
+    category_cache.remove([pid])
 
     limpiar_form()
     cargar_datos()
@@ -1202,7 +3575,7 @@ def eliminar_producto():
 # --- INICIALIZACIÓN ---
 ensure_dirs()
 ensure_default_config()
-init_db()
+_version_anterior = init_db()
 
 # Creamos la ventana
 root = tk.Tk()
@@ -1238,7 +3611,9 @@ def toggle_theme():
     else:
         apply_light()
         current_theme = "light"
-    save_config({"theme": current_theme})
+    cfg = load_config()
+    cfg["theme"] = current_theme
+    save_config(cfg)
 
 # ------------------ Ventana de Ayuda: "Cómo funciona" ------------------
 pages = [
@@ -1247,8 +3622,9 @@ pages = [
      "- Formulario superior: Cantidad | Cod. Art. (obligatorio) | Concepto | IVA | P. lista | BNF | Precio (calc.) | Importe (calc.) | Fecha.\n"
      "- Botones: Guardar, Editar, Eliminar, Limpiar.\n"
      "- Tabla (Treeview): muestra productos por categoría; las filas con bajo stock se resaltan.\n"
-     "- Búsqueda: campo dinámico; selector de categoría ◀ ▶.\n"
-     "- Barra de estado: total de productos y valor total del stock."
+     "- Búsqueda: por Cod. Art. o Concepto, por palabras o comienzos de palabra y sin importar acentos; selector de categoría ◀ ▶.\n"
+     "- Barra de estado: total de productos y valor total del stock, más productos, valor y bajo stock de la categoría actual.\n"
+     "- Opciones → Mostrar/ocultar resumen: panel con esos números para todas las categorías."
     ),
 
     ("Importar y exportar CSV: Lo esencial",
@@ -1256,6 +3632,18 @@ pages = [
      "- Los campos de precio e IVA se formatean con símbolos (por ejemplo: \"100.0 $\", \"21 %\").\n"
      "- Al importar se aceptan formatos con o sin símbolos y se normalizan (coma/punto).\n"
      "- Si faltan columnas obligatorias, la importación se aborta y se muestra un error.\n"
+     "- También se importan y exportan archivos de Excel (.xlsx): al exportar se crea una hoja por "
+     "categoría con números reales; al importar, una hoja sin columna de categoría que se llame como "
+     "una categoría va a esa categoría.\n"
+     "- \"Exportar vista actual\" guarda sólo lo que se ve (categoría, búsqueda y orden por columna); "
+     "\"Exportar selección\" guarda sólo las filas seleccionadas. Ambos aceptan .csv o .xlsx.\n"
+     "- Al importar puedes elegir agregar todo como nuevo o actualizar por Cod. Art. (en la categoría "
+     "o en todas): los productos existentes se actualizan, los nuevos se agregan y se informa cuántos "
+     "hubo de cada tipo.\n"
+     "- \"Sólo validar\" revisa todo el archivo sin importar nada (números ilegibles, cantidades "
+     "negativas o no enteras, IVA fuera de rango, códigos repetidos) y permite guardar el informe en CSV.\n"
+     "- Los archivos grandes se importan en segundo plano con una barra de progreso; "
+     "Cancelar deshace todo lo importado hasta ese momento.\n"
      "- Consejo: exporta desde la aplicación para obtener un CSV reimportable de forma fiable."
     ),
 
@@ -1267,13 +3655,17 @@ pages = [
     ),
 
     ("Orden y arrastrar/soltar",
-     "- Reordena filas arrastrando y soltando dentro de la tabla o con botones para mover arriba/abajo.\n"
+     "- Reordena filas arrastrando y soltando dentro de la tabla; si arrastras una fila seleccionada "
+     "se mueve toda la selección como un bloque.\n"
+     "- Alt+↑ / Alt+↓ mueven la selección un lugar arriba o abajo. Cada movimiento se deshace con Ctrl+Z.\n"
      "- El orden se guarda en la base de datos (columna 'orden') por categoría.\n"
+     "- Ordenar por una columna (clic en el encabezado) sólo cambia la vista; para conservarlo usa "
+     "Opciones → Guardar orden de la vista.\n"
      "- Al exportar, las filas se escriben ordenadas por categoría y orden."
     ),
 
     ("Deshacer y rehacer",
-     "- La aplicación guarda snapshots antes de operaciones importantes (importar, guardar, eliminar).\n"
+     "- Cada operación (importar, guardar, eliminar, pegar, mover) puede deshacerse; el historial guarda sólo las filas que cambiaron.\n"
      "- Ctrl+Z deshace; Ctrl+Y rehace. El historial tiene un límite configurado (MAX_UNDO).\n"
      "- Si necesitas recuperar estados muy antiguos, usa los backups en backup/."
     ),
@@ -1288,6 +3680,7 @@ pages = [
      "- Ctrl+C — copiar selección interna.\n"
      "- Ctrl+V — pegar/duplicar en la categoría actual.\n"
      "- Ctrl+Z / Ctrl+Y — deshacer / rehacer.\n"
+     "- Alt+↑ / Alt+↓ — mover la selección arriba / abajo.\n"
      "- Clic en el encabezado de una columna — ordenar por esa columna (clic repetido invierte el orden)."
     ),
 
@@ -1297,7 +3690,9 @@ pages = [
      "El registro de cambios de cada versión se publicará en la release de cada actualización.\n\n"
      "Este es un proyecto personal; sin embargo, puedes enviar solicitudes que serán evaluadas.\n\n"
      "Para comprobar si tienes la versión más reciente, ve a: Ayuda y actualizaciones → Buscar actualizaciones.\n" 
-     "O simplemente cuando inicies la aplicación, automáticamente buscará si hay una actualización disponible.\n\n"
+     "O simplemente cuando inicies la aplicación, automáticamente buscará si hay una actualización disponible.\n"
+     "Al iniciar se consulta GitHub como mucho una vez cada 12 horas (se puede cambiar con "
+     "\"update_check_hours\" en config/config.json); la búsqueda manual consulta siempre.\n\n"
      "Visita el repositorio en GitHub: https://github.com/SrBenja/Co-op_Stock_Manager\n\n"
     ),
 
@@ -1570,14 +3965,21 @@ def show_help_window():
 
 # — Definición de ítems para cada menú —
 file_items = [
-    ("Importar CSV",    importar_csv,      False),
+    ("Importar CSV / Excel", importar_csv, False),
     ("Exportar CSV",    exportar_csv,      False),
+    ("Exportar Excel",  exportar_xlsx,     False),
+    ("Exportar vista actual", lambda: exportar_vista(), False),
+    ("Exportar selección",    lambda: exportar_vista(solo_seleccion=True), False),
     ("Imprimir",        imprimir_stock,    False),
+    ("Imprimir por categoría", imprimir_por_categoria, False),
+    ("Informes...",     generar_informe,   False),
 ]
 opt_items = [
     ("Modo Oscuro/Claro", toggle_theme,     False),
     ("Restaurar backup...", restore_backup, False),
     ("Hacer backup manual", manual_backup,  False),
+    ("Mostrar/ocultar resumen", lambda: toggle_summary_panel(), False),
+    ("Guardar orden de la vista", lambda: guardar_orden_vista(), False),
 ]
 help_items = [
     ("Buscar actualizaciones", lambda: check_updates(), False),
@@ -1594,7 +3996,7 @@ def _download_file(url, dst, timeout=30):
             chunk = resp.read(8192)
 
 
-def download_and_install_release_exe(repo, preferred_asset_name=None):
+def download_and_install_release_exe(repo, preferred_asset_name=None, release=None):
     """
         Updater:
       - descarga silenciosa del asset .exe en BACKUP_PATH,
@@ -1603,15 +4005,14 @@ def download_and_install_release_exe(repo, preferred_asset_name=None):
       - no arranca la app nueva (debe abrirse manualmente),
       - todos los try/except están correctamente emparejados.
     """
-    # Consultar la última release
-    api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-    try:
-        req = urllib.request.Request(api_url, headers={"User-Agent": f"Co-op_Stock_Manager/{VERSION}"})
-        with urllib.request.urlopen(req, timeout=8) as resp:
-            j = _json.loads(resp.read().decode("utf-8"))
-    except Exception as e:
-        messagebox.showerror("Actualizaciones", f"No se pudo consultar GitHub:\n{e}")
-        return
+    # La release ya consultada (check_updates); si no la hay, se consulta (revalidando la caché)
+    j = release
+    if j is None:
+        try:
+            _repo, j = _consultar_release()
+        except Exception as e:
+            messagebox.showerror("Actualizaciones", f"No se pudo consultar GitHub:\n{e}")
+            return
 
     latest_tag = j.get("tag_name") or j.get("name") or ""
     if not latest_tag:
@@ -2251,8 +4652,28 @@ def on_search_key(event=None):
     txt = entry_search.get()
     new_w = min(MAX_SEARCH_WIDTH, max(MIN_SEARCH_WIDTH, len(txt) + 1))
     entry_search.config(width=new_w)
-    buscar()
+    cat = CATEGORIES[current_cat_idx]
+    term = txt.strip()
+    if not term:
+        # Sin término se vuelve a la categoría completa (paginada si es enorme)
+        search_pipeline.cancel()
+        if _view_term:
+            cargar_datos()
+        return
+    search_pipeline.submit(term, cat, _view_sort.get(cat))
+
+def _mostrar_busqueda(term, rows):
+    global _view_term
+    _view_term = term
+    if rows is None:
+        # Demasiadas coincidencias: se paginan desde SQLite como una categoría enorme
+        _tree_rows.clear()
+        virtual_tree.attach_category(CATEGORIES[current_cat_idx], term)
+        update_status()
+        return
+    _refresh_tree(rows)
 
+search_pipeline = SearchPipeline(entry_search, on_results=_mostrar_busqueda)
 entry_search.bind("<KeyRelease>", on_search_key)
 
 
@@ -2266,18 +4687,15 @@ _clipboard = []
 def copiar_seleccion(event=None):
     """Guarda en _clipboard las filas seleccionadas, sin mostrar mensajes."""
     global _clipboard
-    sel = tree.selection()
+    sel = virtual_tree.selected_ids()
     if not sel:
         return
     _clipboard = []
-    with sqlite3.connect(DB_PATH) as conn:
-        for iid in sel:
-            row = conn.execute(
-                f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE id = ?",
-                (iid,)
-            ).fetchone()
-            if row:
-                _clipboard.append(row)
+    sql = f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} WHERE id = ?"
+    for iid in sel:
+        row = db.query_one(sql, (iid,))
+        if row:
+            _clipboard.append(row)
 
 def pegar_seleccion(event=None):
     """Duplica en la categoría actual los productos guardados en _clipboard de forma segura."""
@@ -2285,95 +4703,62 @@ def pegar_seleccion(event=None):
         return
 
     nuevo_cat = CATEGORIES[current_cat_idx]
-    with sqlite3.connect(DB_PATH) as conn:
-        # Determinamos el siguiente orden disponible
-        cur = conn.execute(
-            f"SELECT COALESCE(MAX(orden), -1) FROM {TABLE_NAME} WHERE categoria = ?",
-            (nuevo_cat,)
-        )
-        next_orden = cur.fetchone()[0] + 1
-
-        insert_sql = f"""
-            INSERT INTO {TABLE_NAME} (
-                categoria, codigo, descripcion, cantidad,
-                precio_lista, iva, bnf,
-                precio_final, importe,
-                fecha_retiro, orden
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
-        """
-
-        rows_to_insert = []
-        for row in _clipboard:
-            # row es una tupla con columnas en el orden de COLUMNS
-            def _get(col):
-                v = row[COLUMNS.index(col)]
-                if v is None:
-                    return ""
-                return v
-
-            # valores textuales
-            codigo      = str(_get("codigo")) or ""
-            descripcion = str(_get("descripcion")) or ""
-            retiro      = str(_get("fecha_retiro")) or ""
-
-            # valores numéricos: usamos _parse_number_from_db para mayor tolerancia
-            try:
-                cantidad_val = int(_parse_number_from_db(_get("cantidad")))
-            except Exception:
-                cantidad_val = 0
-            try:
-                iva_val = int(_parse_number_from_db(_get("iva")))
-            except Exception:
-                iva_val = 0
-            try:
-                precio_lista_val = float(_parse_number_from_db(_get("precio_lista")))
-            except Exception:
-                precio_lista_val = 0.0
-            try:
-                bnf_val = float(_parse_number_from_db(_get("bnf")))
-            except Exception:
-                bnf_val = 0.0
-            try:
-                precio_final_val = float(_parse_number_from_db(_get("precio_final")))
-            except Exception:
-                precio_final_val = 0.0
-            try:
-                importe_val = float(_parse_number_from_db(_get("importe")))
-            except Exception:
-                importe_val = 0.0
-
-            # Formateos tal como los usa el resto de la app
-            precio_lista_str = f"{precio_lista_val:.1f} $"
-            precio_final_str = f"{precio_final_val:.3f} $"
-            importe_str      = f"{importe_val:.2f} $"
-            iva_str          = f"{iva_val} %"
-
-            rows_to_insert.append((
-                nuevo_cat,
-                codigo,
-                descripcion,
-                cantidad_val,
-                precio_lista_str,
-                iva_str,
-                bnf_val,
-                precio_final_str,
-                importe_str,
-                retiro,
-                next_orden
-            ))
-            next_orden += 1
-
-        # Ejecutamos la inserción
-        try:
-            conn.executemany(insert_sql, rows_to_insert)
-            conn.commit()
-        except Exception as e:
-            messagebox.showerror("Pegar selección", f"No se pudo pegar la selección:\n{e}")
-            return
+    try:
+        with undo_journal.step("Pegar selección") as conn:
+            new_ids = _pegar_en(conn, nuevo_cat)
+    except Exception as e:
+        messagebox.showerror("Pegar selección", f"No se pudo pegar la selección:\n{e}")
+        return
 
     # Refrescamos vista
+    category_cache.refresh_ids(new_ids)
     cargar_datos()
 
+
+def _pegar_en(conn, nuevo_cat):
+    """Inserta las filas de _clipboard en `nuevo_cat` dentro de la transacción `conn`; devuelve los ids nuevos."""
+    # Determinamos el siguiente orden disponible
+    next_orden = _siguiente_orden(conn, nuevo_cat)
+
+    insert_sql = f"""
+        INSERT INTO {TABLE_NAME} (
+            categoria, codigo, descripcion, cantidad,
+            precio_lista, iva, bnf,
+            precio_final, importe,
+            fecha_retiro, orden
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    """
+
+    # Filas de _clipboard (tuplas en el orden de COLUMNS) como columnas
+    df = pd.DataFrame(list(_clipboard), columns=COLUMNS)
+
+    # valores textuales
+    for col in ("codigo", "descripcion", "fecha_retiro"):
+        df[col] = df[col].fillna("").astype(str)
+
+    # valores numéricos: en la BD ya son números (NULL -> 0); texto heredado se convierte
+    for col in ("cantidad", "precio_lista", "iva", "bnf", "precio_final", "importe"):
+        df[col] = numeros.parse_series(df[col])[0]
+
+    n = len(df)
+    rows_to_insert = list(zip(
+        [nuevo_cat] * n,
+        df["codigo"].tolist(),
+        df["descripcion"].tolist(),
+        df["cantidad"].astype(int).tolist(),
+        df["precio_lista"].tolist(),
+        df["iva"].tolist(),
+        df["bnf"].tolist(),
+        df["precio_final"].tolist(),
+        df["importe"].tolist(),
+        df["fecha_retiro"].tolist(),
+        range(next_orden, next_orden + n * ORDEN_GAP, ORDEN_GAP),
+    ))
+
+    # Ejecutamos la inserción (fila a fila para conocer los ids nuevos)
+    return [conn.execute(insert_sql, r).lastrowid for r in rows_to_insert]
+
+
 # — Función de cambio de categoría —
 def switch_category(delta):
     global current_cat_idx
@@ -2397,26 +4782,53 @@ lbl_cat.pack(side="left", padx=5)
 btn_next.pack(side="left", padx=(0,10))
 
 def move_selected(delta):
-    sel = tree.selection()
-    if not sel:
-        return
-    iid    = sel[0]
-    idx    = tree.index(iid)
-    newidx = max(0, min(len(tree.get_children())-1, idx+delta))
-    if newidx == idx:
-        return
-    tree.move(iid, '', newidx)
-    # Persistimos el nuevo orden en BD:
-    with sqlite3.connect(DB_PATH) as conn:
-        for pos, iid2 in enumerate(tree.get_children('')):
-            conn.execute(f"UPDATE {TABLE_NAME} SET orden = ? WHERE id = ?", (pos, iid2))
-    # Opcional: mantén la selección
-    tree.selection_set(iid)
+    """
+    Alt+↑ / Alt+↓: desplaza los productos seleccionados, como un bloque, un lugar
+    arriba (delta < 0) o abajo (delta > 0) en el orden manual de la categoría.
+    """
+    ids = virtual_tree.selected_ids()
+    if not ids or _vista_ordenada() is not None:
+        return "break"
+    cat = CATEGORIES[current_cat_idx]
+    block_json = _json.dumps(ids)
+    # Vecino fuera del bloque: el anterior al primero o el siguiente al último
+    if delta < 0:
+        target = db.scalar(f"""
+            SELECT p.id FROM {TABLE_NAME} p,
+                   (SELECT MIN(orden) AS o FROM {TABLE_NAME} WHERE id IN (SELECT value FROM json_each(?))) b
+             WHERE p.categoria = ? AND p.orden < b.o
+               AND p.id NOT IN (SELECT value FROM json_each(?))
+             ORDER BY p.orden DESC, p.id DESC LIMIT 1
+        """, (block_json, cat, block_json))
+    else:
+        target = db.scalar(f"""
+            SELECT p.id FROM {TABLE_NAME} p,
+                   (SELECT MAX(orden) AS o FROM {TABLE_NAME} WHERE id IN (SELECT value FROM json_each(?))) b
+             WHERE p.categoria = ? AND p.orden > b.o
+               AND p.id NOT IN (SELECT value FROM json_each(?))
+             ORDER BY p.orden, p.id LIMIT 1
+        """, (block_json, cat, block_json))
+    if target is not None:
+        _mover_producto(ids, target)
+    return "break"
 
 # Función única de cierre con backup
 def on_closing():
-    # Antes de salir, hacemos un backup automático
-    backup_db()
+    # Antes de salir, hacemos un backup automático (en segundo plano, con la ventana ya oculta)
+    ejecutor.cancelar_todas()
+    root.withdraw()
+    ejecutor.submit(
+        lambda tarea: backup_db(), titulo="Backup", cancelable=False,
+        on_done=lambda _dst: _cerrar(), on_error=_error_backup_al_cerrar,
+    )
+
+def _error_backup_al_cerrar(e):
+    messagebox.showerror("Backup", f"No se pudo hacer el backup antes de salir:\n{e}")
+    _cerrar()
+
+def _cerrar():
+    ejecutor.shutdown()
+    db.close()
     root.destroy()
 # Asignamos esa función al evento de cierre
 root.protocol("WM_DELETE_WINDOW", on_closing)
@@ -2452,7 +4864,7 @@ entry_retiro       = entries["fecha_retiro"]
 
 # — Deseleccionar la fila al hacer clic en cualquier campo, sin interferir con el foco —
 def _deselect_tree(e):
-    tree.selection_remove(tree.selection())
+    virtual_tree.clear_selection()
 
 for ent in entries.values():
     ent.bind("<Button-1>", _deselect_tree, add="+")
@@ -2511,53 +4923,276 @@ for col in VISIBLE_COLUMNS:
     tree.heading(col, text=COLUMN_LABELS[col], command=lambda c=col: sort_column(c))
     tree.column(col, width=100, anchor="center", stretch=True)
 
+class VirtualTree:
+    """
+    Modo virtual del Treeview para listas muy grandes.
+    Sólo existen como ítems de Tk las filas visibles; la posición, la barra de
+    desplazamiento y la selección se llevan aquí, y las filas se piden a una
+    fuente paginada (KeysetSource para una categoría, ListSource para una lista).
+    Fuera de modo virtual (source is None) el Treeview funciona como siempre.
+    """
+
+    def __init__(self, tree, scrollbar):
+        self.tree     = tree
+        self.sb       = scrollbar
+        self.source   = None
+        self.pos      = 0          # índice de la primera fila visible
+        self.selected = set()      # ids seleccionados (incluye los que no se ven)
+        self.press_selection = []  # selección que había al presionar el botón
+        self._row_h   = 20
+        self._head_h  = 25
+        self._visible_ids = []
+        tree.bind("<Configure>",         lambda e: self.render(),          add="+")
+        tree.bind("<MouseWheel>",        self._on_wheel,                   add="+")
+        tree.bind("<Button-4>",          lambda e: self._scroll_units(-3), add="+")
+        tree.bind("<Button-5>",          lambda e: self._scroll_units(3),  add="+")
+        tree.bind("<<TreeviewSelect>>",  self._on_select,                  add="+")
+        tree.bind("<ButtonPress-1>",     self._on_click,                   add="+")
+        tree.bind("<Up>",                lambda e: self._on_arrow(-1),     add="+")
+        tree.bind("<Down>",              lambda e: self._on_arrow(1),      add="+")
+        tree.bind("<Prior>",             lambda e: self._scroll_pages(-1), add="+")
+        tree.bind("<Next>",              lambda e: self._scroll_pages(1),  add="+")
+        self.detach()
+
+    @property
+    def active(self):
+        return self.source is not None
+
+    # --- fuentes ---------------------------------------------------------
+    def attach(self, source):
+        """Pasa a modo virtual mostrando `source`. Conserva la posición si es la misma vista."""
+        same = self.source is not None and source.key is not None and source.key == self.source.key
+        if not same:
+            self.pos = 0
+            self.selected.clear()
+        self.source = source
+        self.sb.configure(command=self._on_scrollbar)
+        self.tree.configure(yscrollcommand="")
+        self.render()
+
+    def attach_category(self, cat, term=""):
+        """Modo virtual sobre una categoría (o lo que coincide con `term`), con el orden por columna de su vista."""
+        self.attach(KeysetSource(cat, *_view_sort.get(cat, (None, False)), term=term))
+
+    def detach(self):
+        """Vuelve al Treeview normal (todas las filas como ítems)."""
+        self.source = None
+        self.selected.clear()
+        self._visible_ids = []
+        self.sb.configure(command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.sb.set)
+
+    def sort(self, col, desc):
+        """Ordena la vista por `col` (sólo la vista: no toca la columna 'orden')."""
+        self.pos = 0
+        self.source = self.source.sorted(col, desc)
+        self.render()
+
+    @property
+    def sorted_by_column(self):
+        return self.active and self.source.sort_col is not None
+
+    # --- dibujo ----------------------------------------------------------
+    def visible_count(self):
+        h = self.tree.winfo_height()
+        return max(1, (h - self._head_h) // self._row_h)
+
+    def render(self):
+        if not self.active:
+            return
+        total = self.source.total
+        n = self.visible_count()
+        self.pos = max(0, min(self.pos, total - n))
+        rows = self.source.fetch(self.pos, n)
+
+        self.tree.delete(*self.tree.get_children())
+        for row in rows:
+            self.tree.insert("", tk.END, iid=str(row[0]), values=_tree_values(row), tags=_tree_tags(row))
+        self._visible_ids = [str(row[0]) for row in rows]
+        keep = [iid for iid in self._visible_ids if int(iid) in self.selected]
+        if keep:
+            self.tree.selection_set(keep)
+
+        # Medidas reales de fila y encabezado (para calcular cuántas filas entran)
+        if self._visible_ids:
+            bbox = self.tree.bbox(self._visible_ids[0])
+            if bbox:
+                self._head_h, self._row_h = bbox[1], max(1, bbox[3])
+
+        if total:
+            self.sb.set(self.pos / total, min(1.0, (self.pos + n) / total))
+        else:
+            self.sb.set(0.0, 1.0)
+
+    def scroll_to(self, pos):
+        if not self.active:
+            return
+        pos = max(0, min(int(pos), self.source.total - self.visible_count()))
+        if pos != self.pos:
+            self.pos = pos
+            self.render()
+
+    # --- eventos -----------------------------------------------------------
+    def _scroll_units(self, n):
+        if not self.active:
+            return None
+        self.scroll_to(self.pos + n)
+        return "break"
+
+    def _scroll_pages(self, n):
+        if not self.active:
+            return None
+        return self._scroll_units(n * self.visible_count())
+
+    def _on_wheel(self, event):
+        return self._scroll_units(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self.source.total)
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                self._scroll_pages(step)
+            else:
+                self._scroll_units(step)
+
+    def _on_arrow(self, delta):
+        """Flechas en el borde de la vista: desplazamos una fila y movemos el foco."""
+        if not self.active or not self._visible_ids:
+            return None
+        focus = self.tree.focus()
+        edge = self._visible_ids[-1] if delta > 0 else self._visible_ids[0]
+        if focus != edge:
+            return None
+        old = self.pos
+        self.scroll_to(self.pos + delta)
+        if self.pos == old:
+            return "break"
+        new = self._visible_ids[-1] if delta > 0 else self._visible_ids[0]
+        self.selected = {int(new)}
+        self.tree.selection_set(new)
+        self.tree.focus(new)
+        return "break"
+
+    def _on_click(self, event):
+        # Selección previa al clic (para arrastrar un bloque ya seleccionado)
+        self.press_selection = self.selected_ids()
+        # Clic sin Shift/Ctrl: la selección nueva reemplaza también a la que no se ve
+        if self.active and not (event.state & 0x0005):
+            self.selected.clear()
+
+    def _on_select(self, event=None):
+        if not self.active:
+            return
+        visible = {int(i) for i in self._visible_ids}
+        self.selected = (self.selected - visible) | {int(i) for i in self.tree.selection()}
+
+    def selected_ids(self):
+        """Ids seleccionados en el orden de la vista."""
+        if not self.active:
+            return [int(i) for i in self.tree.selection()]
+        visible = [int(i) for i in self._visible_ids if int(i) in self.selected]
+        return visible + sorted(self.selected - set(visible))
+
+    def clear_selection(self):
+        self.selected.clear()
+        self.tree.selection_remove(self.tree.selection())
+
+    def select_ids(self, ids):
+        """Selecciona esos ids (en modo virtual, también los que no se ven)."""
+        ids = [int(i) for i in ids]
+        if self.active:
+            self.selected = set(ids)
+        shown = [str(i) for i in ids if self.tree.exists(str(i))]
+        if shown:
+            self.tree.selection_set(shown)
+
+
+tree_scroll = ttk.Scrollbar(content, orient="vertical")
+tree_scroll.grid(row=2, column=1, sticky="ns")
+virtual_tree = VirtualTree(tree, tree_scroll)
+
+
+def _mover_producto(ids, target_pid):
+    """
+    Mueve los productos `ids` (uno o varios) junto a `target_pid` dentro de su
+    categoría, en una transacción y un solo paso de deshacer. Normalmente sólo
+    se escriben las filas movidas (ver _orden_junto_a). Refresca la vista y
+    conserva la selección.
+    """
+    label = "Mover producto" if len(ids) == 1 else f"Mover {len(ids)} productos"
+    with undo_journal.step(label) as conn:
+        renumbered = _orden_junto_a(conn, ids, target_pid)
+    if renumbered:
+        category_cache.invalidate(CATEGORIES[current_cat_idx])
+    else:
+        category_cache.refresh_ids(ids)
+    cargar_datos()
+    virtual_tree.select_ids(ids)
+
+
 # — Drag & Drop con feedback sólo en movimiento — 
 _dragged_item     = None
+_dragged_ids      = []      # bloque arrastrado (la selección si se tomó una fila seleccionada)
 _dragging_active  = False
 _prev_cursor      = None
+_drag_prev_tags   = {}
 
 # tag para destacar la fila al arrastrar
 tree.tag_configure("dragging", background="#cce6ff")
 
 def on_drag_start(event):
-    global _dragged_item, _dragging_active
+    global _dragged_item, _dragged_ids, _dragging_active
     # ignoramos clicks en encabezado
     if tree.identify_region(event.x, event.y) == "heading":
         return
+    # Vista ordenada por columna: el orden manual no aplica
+    if _vista_ordenada() is not None:
+        return
     iid = tree.identify_row(event.y)
     _dragged_item = iid if iid else None
+    # Si se toma una fila ya seleccionada se arrastra toda la selección
+    # (la selección previa al clic la guarda VirtualTree._on_click)
+    prev = virtual_tree.press_selection
+    _dragged_ids = prev if iid and int(iid) in prev else ([int(iid)] if iid else [])
     _dragging_active = False  # todavía no hemos movido
 
 def on_drag_motion(event):
-    global _dragging_active, _prev_cursor
+    global _dragging_active, _prev_cursor, _drag_prev_tags
     if not _dragged_item:
         return
     # primer movimiento: activamos el feedback
     if not _dragging_active:
         _prev_cursor = tree["cursor"]
         tree.configure(cursor="hand2")
-        tree.item(_dragged_item, tags=("dragging",))
+        _drag_prev_tags = {}
+        for pid in _dragged_ids:
+            if tree.exists(str(pid)):
+                _drag_prev_tags[str(pid)] = tree.item(str(pid), "tags")
+                tree.item(str(pid), tags=("dragging",))
         _dragging_active = True
-    # tree.yview_scroll(int((event.y - tree.winfo_height()/2)/20), "units")
+    # En modo virtual, arrastrar contra el borde desplaza la vista
+    if virtual_tree.active:
+        if event.y < virtual_tree._head_h:
+            virtual_tree.scroll_to(virtual_tree.pos - 1)
+        elif event.y > tree.winfo_height() - virtual_tree._row_h // 2:
+            virtual_tree.scroll_to(virtual_tree.pos + 1)
 
 def on_drag_drop(event):
     global _dragged_item, _dragging_active
     if _dragging_active and _dragged_item:
         target = tree.identify_row(event.y)
-        if target and target != _dragged_item:
-            new_index = tree.index(target)
-            tree.move(_dragged_item, "", new_index)
-            # persistimos el nuevo orden
-            with sqlite3.connect(DB_PATH) as conn:
-                for pos, iid in enumerate(tree.get_children("")):
-                    conn.execute(
-                        f"UPDATE {TABLE_NAME} SET orden = ? WHERE id = ?",
-                        (pos, iid)
-                    )
+        # restauramos las etiquetas antes de redibujar
+        for iid, tags in _drag_prev_tags.items():
+            if tree.exists(iid):
+                tree.item(iid, tags=tags)
+        if target and int(target) not in _dragged_ids:
+            # persistimos el nuevo orden (todo el bloque, una transacción)
+            _mover_producto(_dragged_ids, target)
     # restauramos estado
     if _dragging_active:
         tree.configure(cursor=_prev_cursor or "")
-        tree.item(_dragged_item, tags=())
     _dragged_item    = None
     _dragging_active = False
 
@@ -2565,6 +5200,9 @@ def on_drag_drop(event):
 tree.bind("<ButtonPress-1>",   on_drag_start, add="+")
 tree.bind("<B1-Motion>",       on_drag_motion, add="+")
 tree.bind("<ButtonRelease-1>", on_drag_drop,  add="+")
+# Mover la selección con el teclado
+tree.bind("<Alt-Up>",   lambda e: move_selected(-1))
+tree.bind("<Alt-Down>", lambda e: move_selected(+1))
 
 tree.tag_configure("bajo_stock", background="#ffdddd")
 tree.grid(row=2, column=0, sticky="nsew")
@@ -2578,7 +5216,7 @@ def clear_all_selection(event):
         region = tree.identify('region', event.x, event.y)
         # solo si NO es sobre filas, encabezado, bordes, etc.
         if region == 'nothing':
-            tree.selection_remove(tree.selection())
+            virtual_tree.clear_selection()
             root.focus_set()
         return
 
@@ -2587,96 +5225,128 @@ def clear_all_selection(event):
         return
 
     # Cualquier otro clic (en cualquier parte fuera del Treeview):
-    tree.selection_remove(tree.selection())
+    virtual_tree.clear_selection()
     root.focus_set()
 
 # — Barra de estado debajo del Treeview —
 status_bar = ttk.Label(content, textvariable=status_var, anchor="w")
 status_bar.grid(row=3, column=0, sticky="ew", pady=(5,0))
 
-# Inicializamos su valor
-update_status()
+# — Tareas en segundo plano: avance y cancelar, a la derecha de la barra de estado —
+tasks_frame  = ttk.Frame(content)
+tasks_label  = ttk.Label(tasks_frame, anchor="e")
+tasks_label.pack(side="left", padx=(0, 6))
+tasks_bar    = ttk.Progressbar(tasks_frame, length=120, maximum=100, mode="determinate")
+tasks_bar.pack(side="left", padx=(0, 6))
+tasks_cancel = ttk.Button(tasks_frame, text="Cancelar")
+tasks_cancel.pack(side="left")
+
+def _mostrar_tareas(activas):
+    """Muestra la primera tarea activa (y cuántas más hay); se oculta si no hay ninguna."""
+    if not activas:
+        tasks_bar.stop()
+        tasks_frame.grid_remove()
+        return
+    t = activas[0]
+    extra = f" (+{len(activas) - 1})" if len(activas) > 1 else ""
+    tasks_label.config(text=f"{t.titulo}… {t.texto}{extra}")
+    if t.fraccion is None:
+        if str(tasks_bar["mode"]) != "indeterminate":
+            tasks_bar.configure(mode="indeterminate")
+            tasks_bar.start(15)
+    else:
+        tasks_bar.stop()
+        tasks_bar.configure(mode="determinate", value=100 * t.fraccion)
+    tasks_cancel.configure(command=lambda: (t.cancelar(), _mostrar_tareas(ejecutor.activas)))
+    tasks_cancel.state(["!disabled"] if t.cancelable and not t.cancelada else ["disabled"])
+    tasks_frame.grid(row=3, column=0, sticky="e", pady=(5,0))
 
-def _fetch_latest_release(repo, token=None, timeout=8):
-    """
-    Helper pequeño que consulta la API de GitHub y devuelve el JSON de la última release
-    o None si hay cualquier error (silencioso).
-    """
-    api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-    headers = {"User-Agent": f"Co-op_Stock_Manager/{VERSION} (+https://github.com/{repo})"}
-    if token:
-        headers["Authorization"] = f"token {token}"
-    try:
-        req = urllib.request.Request(api_url, headers=headers)
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            return _json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        # Silencioso en el inicio: sólo registramos
-        # if e.code == 403: print("GitHub rate limit or forbidden")
-        # if e.code == 404: print("Repo/releases not found")
-        return None
-    except Exception:
-        return None
+def _error_tarea(tarea, e):
+    messagebox.showerror(f"Error: {tarea.titulo}", str(e))
+
+ejecutor = tareas.Ejecutor(root, on_error=_error_tarea, on_change=_mostrar_tareas)
+
+# — Panel de resumen por categoría (Opciones → Mostrar/ocultar resumen) —
+summary_panel = ttk.Treeview(
+    content,
+    columns=("categoria", "productos", "valor", "bajo_stock"),
+    show="headings",
+    height=len(CATEGORIES) + 1
+)
+for col, label, anchor in (("categoria", "Categoría", "w"), ("productos", "Productos", "center"),
+                           ("valor", "Valor del stock", "e"), ("bajo_stock", "Bajo stock", "center")):
+    summary_panel.heading(col, text=label)
+    summary_panel.column(col, width=120, anchor=anchor, stretch=True)
+summary_panel.tag_configure("total", font=("TkDefaultFont", 9, "bold"))
+
+def _refresh_summary_panel(summary):
+    """Vuelca el resumen (ver inventory_summary) en el panel, si está visible."""
+    if not _summary_visible:
+        return
+    summary_panel.delete(*summary_panel.get_children())
+    others = sorted(c for c in summary if c != TOTALS_ALL and c not in CATEGORIES)
+    for cat in CATEGORIES + others + [TOTALS_ALL]:
+        n, value, low = summary.get(cat, (0, 0.0, 0))
+        if cat in others and n == 0:
+            continue
+        label = "Total" if cat == TOTALS_ALL else (cat or "(sin categoría)")
+        summary_panel.insert("", tk.END, values=(label, n, f"{value:.2f} $", low),
+                             tags=("total",) if cat == TOTALS_ALL else ())
+
+def toggle_summary_panel():
+    cfg = load_config()
+    cfg["show_summary"] = not _summary_visible
+    save_config(cfg)
+    _apply_summary_visibility(cfg["show_summary"])
+    update_status()
+
+def _apply_summary_visibility(show):
+    global _summary_visible
+    _summary_visible = bool(show)
+    if show:
+        summary_panel.grid(row=4, column=0, columnspan=2, sticky="ew", pady=(5,0))
+    else:
+        summary_panel.grid_remove()
+
+_summary_visible = False
+_apply_summary_visibility(load_config().get("show_summary", False))
 
+# Inicializamos su valor
+update_status()
 
-def check_updates_on_startup(delay_ms=1500):
+def check_updates_on_startup():
     """
     Comprobación silenciosa que se ejecuta 1 vez al iniciar (llamar con root.after).
+    - La consulta corre en segundo plano: sin red, la ventana no espera el timeout.
+    - Respeta update_check_hours (config, por defecto UPDATE_CHECK_HOURS): dentro de
+      ese intervalo usa la respuesta guardada sin consultar GitHub.
     - No muestra mensajes si no hay actualizaciones o si ocurre un error.
     - Si encuentra una release con tag distinto a VERSION, muestra el diálogo modal personalizado
       (Sí / No / Cancelar) para que el usuario elija qué hacer.
     """
     try:
-        cfg = load_config()
-        default_repo = "SrBenja/Co-op_Stock_Manager"
-        repo = cfg.get("github_repo", default_repo)
-        token = cfg.get("github_token")
+        hours = float(load_config().get("update_check_hours", UPDATE_CHECK_HOURS))
+    except (TypeError, ValueError):
+        hours = UPDATE_CHECK_HOURS
 
-        j = _fetch_latest_release(repo, token=token)
-        if not j:
-            return  # silencioso si no hay datos
-
-        latest_tag = (j.get("tag_name") or j.get("name") or "").strip()
-        if not latest_tag:
-            return
+    def _ofrecer(result):
+        try:
+            _ofrecer_release(*result, silencioso=True)
+        except Exception:
+            # Silencioso en startup: no queremos romper el arranque por un fallo en la comprobación
+            pass
 
-        if _norm_tag(latest_tag) == _norm_tag(VERSION):
-            return  # estás en la misma versión -> silencio
-
-        # hay una versión distinta: preparamos el mensaje resumido
-        body = j.get("body", "") or ""
-        html_url = j.get("html_url", "") or ""
-        summary = (body[:800] + "...") if len(body) > 800 else body
-
-        msg = (f"Versión instalada: {VERSION}\n"
-               f"Versión disponible: {latest_tag}\n\n"
-               f"{summary}\n\n"
-               "¿Descargar e instalar automáticamente (Sí), abrir la release en el navegador (No) o cancelar?")
-
-        # parent: intentamos usar root para que el diálogo sea modal sobre la app
-        parent = globals().get("root", None)
-        choice = _ask_update_custom(parent, "Actualización disponible", msg)
-
-        if choice == "yes":
-            # lanzar la descarga/instalador existente
-            download_and_install_release_exe(repo, preferred_asset_name="Co-op_Stock_Manager.exe")
-        elif choice == "no":
-            if html_url:
-                webbrowser.open(html_url)
-            else:
-                # si no hay url, mantenemos silencio mínimo
-                try:
-                    messagebox.showinfo("Actualizaciones", "No hay URL de la release para abrir.")
-                except Exception:
-                    pass
-        else:
-            # "cancel" (o cierre con X) -> no hacemos nada
-            return
+    ejecutor.submit(
+        lambda tarea: _consultar_release(intervalo=hours * 3600),
+        titulo="Buscar actualizaciones", cancelable=False,
+        on_done=_ofrecer,
+        on_error=lambda e: None,
+    )
 
-    except Exception:
-        # Silencioso en startup: no queremos romper el arranque por un fallo en la comprobación
-        return
 
+# Base antigua recién migrada: avisar lo que no se pudo convertir a número
+if _version_anterior < 3:
+    root.after(0, _avisar_textos_originales)
 
 # --- Llamada: poner esto justo después de cargar_datos() y antes de root.mainloop() ---
 # programamos la comprobación una sola vez (no bloqueante)
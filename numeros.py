@@ -0,0 +1,80 @@
+"""
+Conversión de importes y porcentajes escritos como texto ('1.234,56 $', '21 %') a números.
+
+- parse_number(valor): un valor suelto (0.0 si no se puede leer).
+- parse_series(serie): una columna de pandas entera, con la máscara de celdas ilegibles.
+"""
+import math
+
+import numpy as np  #type: ignore
+import pandas as pd  #type: ignore
+
+_NAN = float("nan")
+
+
+def _parse_or_nan(value):
+    """Como parse_number, pero devuelve NaN (en lugar de 0.0) si el texto no es un número."""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return _NAN if math.isinf(value) else float(value)
+    s = str(value).strip()
+    if s == "":
+        return 0.0
+    # Quitamos símbolos y espacios
+    s = s.replace("$", "").replace("%", "").strip()
+    if s == "":
+        return 0.0
+    # Normalizamos miles/decimal: '1.234,56' -> '1234.56'
+    # Si hay punto y coma, el que va último es el decimal: '1.234,56' o '1,234.56'
+    if "." in s and "," in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "")
+        else:
+            s = s.replace(",", "")
+    s = s.replace(",", ".")
+    try:
+        v = float(s)
+    except ValueError:
+        return _NAN
+    # float() acepta 'inf' y 'nan': no son importes
+    return v if math.isfinite(v) else _NAN
+
+
+def parse_number(value):
+    """
+    Convierte un valor suelto a float:
+    - acepta int/float
+    - acepta cadenas como '123.45 $', '21 %', '1.234,56 $'
+    - devuelve 0.0 si no puede parsear
+    """
+    v = _parse_or_nan(value)
+    return 0.0 if v != v else v
+
+
+def parse_series(series):
+    """
+    Versión vectorizada de parse_number para una pandas.Series (de strings,
+    números o mezclada). Devuelve (valores, malos):
+    - valores: Series float64 con el mismo índice; vacías y no leídas quedan en 0.0,
+    - malos:   Series bool, True en las celdas con texto que no es un número
+               (tampoco cuentan 'inf' ni 'nan' escritos como texto, ni infinitos).
+    Las celdas vacías (NaN, None, "") valen 0.0 y no cuentan como malas.
+
+    En una lista de proveedor los mismos textos se repiten mucho ("21 %", "0",
+    precios comunes): se agrupan los valores distintos (pd.factorize, en C),
+    se interpreta cada uno UNA vez y el resultado se reparte con numpy.
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.astype("float64")
+        bad = np.isinf(values.to_numpy())
+        values[bad] = 0.0
+        return values.fillna(0.0), pd.Series(bad, index=series.index)
+
+    codes, uniques = pd.factorize(series)      # NaN/None -> código -1
+    parsed = np.fromiter((_parse_or_nan(u) for u in uniques), dtype=np.float64, count=len(uniques))
+    parsed = np.append(parsed, 0.0)            # posición -1: celdas vacías
+    values = parsed[codes]
+    bad = np.isnan(values)
+    values[bad] = 0.0
+    return pd.Series(values, index=series.index), pd.Series(bad, index=series.index)
@@ -0,0 +1,175 @@
+"""
+Tareas en segundo plano de Co-op Stock Manager.
+
+Ejecutor corre funciones `fn(tarea, *args)` en un pool de hilos para que la
+ventana no quede "No responde". Avance, resultado, error y cancelación pasan
+por una cola que se revisa desde Tk con widget.after, así los callbacks pueden
+tocar widgets. La tarea informa con tarea.progreso(), mira tarea.comprobar()
+entre tandas y registra con tarea.al_cancelar() cómo cortar lo que está en curso.
+"""
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = 2      # tareas simultáneas (el resto espera en la cola del pool)
+POLL_MS = 100    # cada cuánto se entregan los avisos en el hilo de Tk
+
+
+class Cancelada(Exception):
+    """La tarea se canceló (la lanza Tarea.comprobar)."""
+
+
+class Tarea:
+    """Una tarea enviada al Ejecutor: avance, cancelación y estado."""
+
+    def __init__(self, ejecutor, titulo, cancelable):
+        self.id         = next(ejecutor._ids)
+        self.titulo     = titulo
+        self.cancelable = cancelable
+        self.fraccion   = None   # 0..1, o None si el avance no se conoce
+        self.texto      = ""
+        self._ejecutor  = ejecutor
+        self._cancel    = threading.Event()
+        self._hooks     = []
+        self._lock      = threading.Lock()
+
+    @property
+    def cancelada(self):
+        return self._cancel.is_set()
+
+    def comprobar(self):
+        """Lanza Cancelada si se pidió cancelar (para usar entre tandas)."""
+        if self._cancel.is_set():
+            raise Cancelada()
+
+    def progreso(self, fraccion=None, texto=None):
+        """Informa el avance desde el hilo de trabajo (se muestra en el próximo poll)."""
+        self._ejecutor._eventos.put(("progreso", self, fraccion, texto))
+
+    def al_cancelar(self, fn):
+        """Registra `fn()` para llamarla al cancelar (p. ej. conn.interrupt). Devuelve `fn`."""
+        with self._lock:
+            if not self._cancel.is_set():
+                self._hooks.append(fn)
+                return fn
+        fn()
+        return fn
+
+    def cancelar(self):
+        """Pide cancelar la tarea (sin efecto si no es cancelable o ya se pidió)."""
+        if not self.cancelable:
+            return
+        with self._lock:
+            if self._cancel.is_set():
+                return
+            self._cancel.set()
+            hooks, self._hooks = self._hooks, []
+        for fn in hooks:
+            try:
+                fn()
+            except Exception:
+                pass
+
+
+class Ejecutor:
+    """
+    Pool de hilos con cola de resultados revisada desde Tk.
+    - submit(...) devuelve la Tarea; los callbacks on_done(resultado),
+      on_error(excepcion), on_progress(tarea) y on_cancel() corren en el hilo de Tk.
+    - Sin on_error propio se usa el `on_error(tarea, excepcion)` del ejecutor
+      (p. ej. un messagebox con el título de la tarea).
+    - `on_change(tareas)` se llama con las tareas activas cada vez que cambian
+      (para mostrar avance y un botón de cancelar en la ventana principal).
+    """
+
+    def __init__(self, widget, workers=WORKERS, on_error=None, on_change=None):
+        self.widget    = widget
+        self.on_error  = on_error
+        self.on_change = on_change
+        self.activas   = []
+        self._pool     = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tarea")
+        self._eventos  = queue.Queue()
+        self._ids      = itertools.count(1)
+        self._poll_id  = None
+        self._callbacks = {}
+
+    def submit(self, fn, *args, titulo="", cancelable=True,
+               on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """Encola `fn(tarea, *args)` en el pool y devuelve la Tarea."""
+        tarea = Tarea(self, titulo, cancelable)
+        self._callbacks[tarea.id] = (on_done, on_error, on_progress, on_cancel)
+        self.activas.append(tarea)
+        self._pool.submit(self._run, tarea, fn, args)
+        self._changed()
+        if self._poll_id is None:
+            self._poll_id = self.widget.after(POLL_MS, self._poll)
+        return tarea
+
+    def cancelar_todas(self):
+        for tarea in list(self.activas):
+            tarea.cancelar()
+
+    def shutdown(self, wait=False):
+        """Cancela lo pendiente y cierra el pool (al salir de la aplicación)."""
+        self.cancelar_todas()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, tarea, fn, args):
+        # Corre en un hilo del pool: todo vuelve a Tk por la cola
+        if tarea.cancelada:
+            self._eventos.put(("cancelada", tarea, None, None))
+            return
+        try:
+            result = fn(tarea, *args)
+        except Cancelada:
+            self._eventos.put(("cancelada", tarea, None, None))
+        except BaseException as e:
+            kind = "cancelada" if tarea.cancelada else "error"
+            self._eventos.put((kind, tarea, e, None))
+        else:
+            self._eventos.put(("lista", tarea, result, None))
+
+    def _poll(self):
+        self._poll_id = None
+        changed = False
+        try:
+            while True:
+                kind, tarea, a, b = self._eventos.get_nowait()
+                on_done, on_error, on_progress, on_cancel = self._callbacks.get(tarea.id, (None,) * 4)
+                if kind == "progreso":
+                    if a is not None:
+                        tarea.fraccion = a
+                    if b is not None:
+                        tarea.texto = b
+                    changed = True
+                    if on_progress:
+                        on_progress(tarea)
+                    continue
+                # Terminó: se saca de las activas antes de avisar
+                self._callbacks.pop(tarea.id, None)
+                if tarea in self.activas:
+                    self.activas.remove(tarea)
+                changed = True
+                if kind == "lista":
+                    if on_done:
+                        on_done(a)
+                elif kind == "error":
+                    if on_error:
+                        on_error(a)
+                    elif self.on_error:
+                        self.on_error(tarea, a)
+                elif on_cancel:
+                    on_cancel()
+        except queue.Empty:
+            pass
+        finally:
+            # Aunque un callback falle, el resto de los avisos se sigue entregando
+            if changed:
+                self._changed()
+            if self.activas or not self._eventos.empty():
+                self._poll_id = self.widget.after(POLL_MS, self._poll)
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(list(self.activas))
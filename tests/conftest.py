@@ -0,0 +1,71 @@
+import os
+import sys
+import types
+
+import pytest
+
+# Los módulos de la aplicación están en la raíz del repositorio
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    Las definiciones de main.py (todo lo anterior a "# --- INICIALIZACIÓN ---",
+    sin crear la ventana) con la base en tmp_path, todavía sin abrir: la prueba
+    puede preparar una base antigua antes de llamar a app.init_db().
+    """
+    with open(os.path.join(RAIZ, "main.py"), encoding="utf-8") as f:
+        src = f.read()
+    src = src[:src.index("# --- INICIALIZACIÓN ---")]
+    mod = types.ModuleType("main")
+    mod.__file__ = str(tmp_path / "main.py")
+    exec(compile(src, os.path.join(RAIZ, "main.py"), "exec"), mod.__dict__)
+    db.configure(mod.DB_PATH)
+    yield mod
+    db.close()
+
+
+class _Tarea:
+    """Lo mínimo de tareas.Tarea que usan las funciones de trabajo (sin cancelar nunca)."""
+
+    cancelada = False
+
+    def comprobar(self):
+        pass
+
+    def progreso(self, fraccion=None, texto=None):
+        pass
+
+    def al_cancelar(self, fn):
+        return fn
+
+
+@pytest.fixture
+def tarea():
+    return _Tarea()
+
+
+@pytest.fixture
+def importar(app):
+    """
+    importar(path, modo) corre la importación de CsvImport en el hilo de la prueba
+    y devuelve su resultado: ("listo", cuentas) con el paso ya en el historial, o
+    ("validado", (total, problemas)) en modo "validar".
+    """
+    def _importar(path, modo="agregar", categoria="Gas"):
+        imp = app.CsvImport(str(path), categoria, modo)
+        imp._conn = db.connect()
+        try:
+            if modo == "validar":
+                return imp._validate_worker(_Tarea())
+            imp._step = app.undo_journal.attach(imp._conn)
+            result = imp._worker(_Tarea())
+        finally:
+            imp._conn.close()
+        app.undo_journal.push(imp._step, "Importar CSV")
+        return result
+    return _importar
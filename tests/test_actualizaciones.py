@@ -0,0 +1,119 @@
+import json
+import socket
+import threading
+import urllib.error
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import actualizaciones
+
+REPO    = "coop/stock"
+ETAG    = '"v1"'
+RELEASE = {"tag_name": "v1.2.0", "html_url": "https://example.invalid/v1.2.0", "body": "Notas"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Imita GET /repos/<repo>/releases/latest de la API de GitHub."""
+
+    def do_GET(self):
+        srv = self.server
+        etag = self.headers.get("If-None-Match")
+        srv.peticiones.append((self.path, etag))
+        if srv.status != 200:
+            self.send_response(srv.status)
+            self.end_headers()
+        elif etag == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+        else:
+            body = json.dumps(RELEASE).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    srv = HTTPServer(("127.0.0.1", 0), _Handler)
+    srv.peticiones = []
+    srv.status = 200
+    srv.api_base = f"http://127.0.0.1:{srv.server_address[1]}"
+    hilo = threading.Thread(target=srv.serve_forever, daemon=True)
+    hilo.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    hilo.join()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return str(tmp_path / "release_cache.json")
+
+
+def _leer(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_primera_consulta_guarda_release_y_etag(servidor, cache):
+    release = actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base, now=1000)
+
+    assert release == RELEASE
+    assert servidor.peticiones == [(f"/repos/{REPO}/releases/latest", None)]
+    guardado = _leer(cache)
+    assert guardado["release"] == RELEASE
+    assert guardado["etag"] == ETAG
+    assert guardado["checked"] == 1000
+
+
+def test_dentro_del_intervalo_no_consulta(servidor, cache):
+    actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base, intervalo=3600, now=1000)
+    release = actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base, intervalo=3600, now=4000)
+
+    assert release == RELEASE
+    assert len(servidor.peticiones) == 1
+
+
+def test_304_reutiliza_lo_guardado(servidor, cache):
+    actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base, now=1000)
+    release = actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base, now=2000)
+
+    assert release == RELEASE
+    assert servidor.peticiones[-1][1] == ETAG
+    assert _leer(cache)["checked"] == 2000
+
+
+def test_404_propaga_el_error_y_anota_el_intento(servidor, cache):
+    servidor.status = 404
+
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base, intervalo=3600, now=1000)
+
+    assert exc.value.code == 404
+    assert _leer(cache)["checked"] == 1000
+    # Dentro del intervalo no se vuelve a intentar
+    assert actualizaciones.ultima_release(REPO, cache, api_base=servidor.api_base,
+                                          intervalo=3600, now=2000) is None
+    assert len(servidor.peticiones) == 1
+
+
+def test_conexion_rechazada_anota_el_intento(cache):
+    # Un puerto libre en el que nadie escucha
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        api_base = f"http://127.0.0.1:{s.getsockname()[1]}"
+
+    with pytest.raises(urllib.error.URLError):
+        actualizaciones.ultima_release(REPO, cache, api_base=api_base, intervalo=3600, now=1000)
+
+    assert _leer(cache)["checked"] == 1000
+    assert actualizaciones.ultima_release(REPO, cache, api_base=api_base, intervalo=3600, now=2000) is None
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+
+import pytest
+
+import db
+
+
+class _Cancelada(Exception):
+    """Lo que lanza tarea.comprobar() cuando se cancela un backup."""
+
+
+@pytest.fixture
+def base(tmp_path):
+    path = str(tmp_path / "stock.db")
+    db.configure(path)
+    with db.transaction() as conn:
+        conn.execute("CREATE TABLE productos (id INTEGER PRIMARY KEY, descripcion TEXT)")
+        conn.executemany("INSERT INTO productos (descripcion) VALUES (?)",
+                         [("x" * 500,) for _ in range(2000)])
+    yield path
+    db.close()
+
+
+def test_backup_to_copia_completa(base, tmp_path):
+    dst = str(tmp_path / "backup.db")
+
+    assert db.backup_to(dst) == dst
+
+    with sqlite3.connect(dst) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM productos").fetchone()[0] == 2000
+    assert not os.path.exists(f"{dst}.tmp")
+
+
+def test_backup_to_cancelado_no_deja_archivo(base, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "BACKUP_PAGES", 1)
+    dst = str(tmp_path / "backup.db")
+    llamadas = []
+
+    def _progreso(restantes, total):
+        llamadas.append(restantes)
+        if len(llamadas) == 3:
+            raise _Cancelada()
+
+    with pytest.raises(_Cancelada):
+        db.backup_to(dst, _progreso)
+
+    assert [f for f in os.listdir(tmp_path) if f.startswith("backup")] == []
@@ -0,0 +1,117 @@
+import csv
+import random
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def base(app):
+    app.init_db()
+    return app
+
+
+def _foto(app):
+    cols = ", ".join(app.COLUMNS)
+    return db.query(f"SELECT {cols} FROM {app.TABLE_NAME} ORDER BY id")
+
+
+def _log(app):
+    """Filas del historial por operación, y cuántas guardan imagen n_* (sólo tras deshacer)."""
+    return dict((op, (n, n_img)) for op, n, n_img in db.query(
+        "SELECT op, COUNT(*), COUNT(n_categoria) FROM temp.undo_log GROUP BY op"))
+
+
+def _csv(path, n, inicio=0, precio="100 $"):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["Cantidad", "Cod. Art.", "Concepto", "IVA", "P. lista", "BNF", "Precio", "Importe", "Fecha de retiro"])
+        for i in range(inicio, inicio + n):
+            w.writerow([i % 7, f"C{i}", f"Producto {i}", "21 %", precio, "0", "121 $", "", ""])
+    return path
+
+
+def _paso_al_azar(app, rnd):
+    T = app.TABLE_NAME
+    ids = [r[0] for r in db.query(f"SELECT id FROM {T}")]
+    with app.undo_journal.step("azar") as conn:
+        op = rnd.choice(["alta", "cambio", "baja"] if ids else ["alta"])
+        if op == "alta":
+            for _ in range(rnd.randint(1, 5)):
+                conn.execute(f"INSERT INTO {T} (categoria, descripcion, cantidad, orden) VALUES (?, ?, ?, ?)",
+                             (rnd.choice("AB"), f"d{rnd.random()}", rnd.randint(0, 9), rnd.randint(0, 99)))
+        elif op == "cambio":
+            for pid in rnd.sample(ids, min(len(ids), rnd.randint(1, 5))):
+                conn.execute(f"UPDATE {T} SET cantidad = ?, categoria = ? WHERE id = ?",
+                             (rnd.randint(0, 9), rnd.choice("AB"), pid))
+        else:
+            for pid in rnd.sample(ids, min(len(ids), rnd.randint(1, 3))):
+                conn.execute(f"DELETE FROM {T} WHERE id = ?", (pid,))
+
+
+def test_deshacer_y_rehacer_pasos_al_azar(base, monkeypatch):
+    monkeypatch.setattr(base, "MAX_UNDO", 100)
+    uj = base.undo_journal
+    rnd = random.Random(7)
+    fotos = [_foto(base)]
+    for _ in range(60):
+        _paso_al_azar(base, rnd)
+        fotos.append(_foto(base))
+        # Mientras un paso está hecho el historial no guarda la imagen nueva
+        assert _log(base).get("U", (0, 0))[1] == 0
+
+    for esperado in reversed(fotos[:-1]):
+        uj.undo()
+        assert _foto(base) == esperado
+    assert not uj.can_undo()
+    for esperado in fotos[1:]:
+        uj.redo()
+        assert _foto(base) == esperado
+    assert all(n_img == 0 for _n, n_img in _log(base).values())
+
+
+def test_un_paso_nuevo_descarta_lo_que_se_podia_rehacer(base):
+    uj = base.undo_journal
+    with uj.step("alta") as conn:
+        conn.execute(f"INSERT INTO {base.TABLE_NAME} (categoria, cantidad) VALUES ('A', 1)")
+    uj.undo()
+    assert uj.can_redo()
+
+    with uj.step("otra") as conn:
+        conn.execute(f"INSERT INTO {base.TABLE_NAME} (categoria, cantidad) VALUES ('A', 2)")
+
+    assert not uj.can_redo()
+    assert db.scalar("SELECT COUNT(DISTINCT step) FROM temp.undo_log") == 1
+
+
+def test_importacion_se_guarda_como_un_rango(base, importar, tmp_path):
+    uj = base.undo_journal
+    inicial = _foto(base)
+    assert importar(_csv(tmp_path / "a.csv", 3000), "agregar")[0] == "listo"
+    importada = _foto(base)
+
+    # Las altas no se copian al historial: una sola fila 'R' con el rango de ids
+    assert _log(base) == {"R": (1, 0)}
+    assert uj.filas() == 3000
+
+    uj.undo()
+    assert _foto(base) == inicial
+    uj.redo()
+    assert _foto(base) == importada
+    assert _log(base) == {"R": (1, 0)}
+
+
+def test_fusion_se_deshace_y_rehace(base, importar, tmp_path):
+    uj = base.undo_journal
+    importar(_csv(tmp_path / "a.csv", 2000), "agregar")
+    antes = _foto(base)
+    # La mitad coincide por código (con otro precio: se actualiza), la otra mitad es nueva
+    _, cuentas = importar(_csv(tmp_path / "b.csv", 2000, inicio=1000, precio="150 $"), "todas")
+    despues = _foto(base)
+    assert (cuentas["insertados"], cuentas["actualizados"]) == (1000, 1000)
+
+    uj.undo()
+    assert _foto(base) == antes
+    uj.redo()
+    assert _foto(base) == despues
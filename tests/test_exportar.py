@@ -0,0 +1,86 @@
+import csv
+
+import openpyxl
+import pytest
+
+import db
+import tareas
+
+ENCABEZADO = ["Cantidad", "Cod. Art.", "Concepto", "IVA", "P. lista", "BNF", "Precio", "Importe", "Fecha de retiro"]
+COLS = ["categoria", "orden", "cantidad", "codigo", "descripcion"]
+
+
+@pytest.fixture
+def base(app, importar, tmp_path):
+    """Gas con A1..A5 (descripciones "tornillo"/"tuerca" alternadas) y Agua con B1."""
+    app.init_db()
+    for cat, filas in (
+        ("Gas", [[str(i), f"A{i}", "tornillo" if i % 2 else "tuerca", "21", "10", "0", "1", "1", ""]
+                 for i in range(1, 6)]),
+        ("Agua", [["1", "B1", "tornillo", "21", "10", "0", "1", "1", ""]]),
+    ):
+        path = tmp_path / f"{cat}.csv"
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(ENCABEZADO)
+            w.writerows(filas)
+        importar(path, "agregar", cat)
+    return app
+
+
+def _ids(codigos):
+    return [db.query("SELECT id FROM productos WHERE codigo = ?", (c,))[0][0] for c in codigos]
+
+
+def _leer_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_buscar_sql_respeta_termino_orden_e_ids(base):
+    sql, params = base.buscar_sql("tornillo", "Gas", "cantidad", True, columns=["codigo"])
+    assert [r[0] for r in db.query(sql, params)] == ["A5", "A3", "A1"]
+
+    sql, params = base.buscar_sql("", "Gas", "cantidad", True, columns=["codigo"], ids=_ids(["A1", "A4", "B1"]))
+    assert [r[0] for r in db.query(sql, params)] == ["A4", "A1"]
+
+
+def test_exportar_consulta_csv(base, tarea, tmp_path):
+    sql, params = base.buscar_sql("", "Gas", columns=COLS, ids=_ids(["A2", "A3"]))
+    path = str(tmp_path / "vista.csv")
+
+    assert base._exportar_consulta(tarea, path, COLS, sql, params, "Gas") == 2
+    filas = _leer_csv(path)
+    assert filas[0] == COLS
+    assert [f[3] for f in filas[1:]] == ["A2", "A3"]
+
+
+def test_exportar_consulta_xlsx_en_varias_tandas(base, tarea, tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "IMPORT_CHUNK", 2)
+    cols = ["categoria", "orden"] + base.VISIBLE_COLUMNS
+    sql, params = base.buscar_sql("", "Gas", columns=cols)
+    path = str(tmp_path / "vista.xlsx")
+
+    assert base._exportar_consulta(tarea, path, cols, sql, params, "Gas") == 5
+    ws = openpyxl.load_workbook(path).active
+    assert ws.title == "Gas"
+    assert [r[cols.index("codigo")] for r in ws.iter_rows(min_row=2, values_only=True)] == \
+        ["A1", "A2", "A3", "A4", "A5"]
+
+
+def test_exportar_consulta_cancelada_no_deja_archivo(base, tarea, tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "IMPORT_CHUNK", 2)
+    llamadas = []
+
+    def comprobar():
+        llamadas.append(None)
+        if len(llamadas) > 1:
+            raise tareas.Cancelada()
+
+    tarea.comprobar = comprobar
+    sql, params = base.buscar_sql("", "Gas", columns=COLS)
+    path = tmp_path / "vista.csv"
+
+    with pytest.raises(tareas.Cancelada):
+        base._exportar_consulta(tarea, str(path), COLS, sql, params, "Gas")
+    assert not path.exists()
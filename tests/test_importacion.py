@@ -0,0 +1,112 @@
+import csv
+
+import pytest
+
+import db
+
+ENCABEZADO = ["Cantidad", "Cod. Art.", "Concepto", "IVA", "P. lista", "BNF", "Precio", "Importe", "Fecha de retiro"]
+
+
+@pytest.fixture
+def base(app):
+    app.init_db()
+    return app
+
+
+def _csv(path, filas, encabezado=ENCABEZADO):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(encabezado)
+        w.writerows(filas)
+    return str(path)
+
+
+def test_validar_encabezado_incompleto_se_informa_en_la_linea_1(base, importar, tmp_path):
+    path = _csv(tmp_path / "a.csv", [["1", "X"]], encabezado=["Cantidad", "Cod. Art."])
+
+    total, problems = importar(path, "validar")[1]
+
+    assert total == 0
+    assert len(problems) == 1
+    assert problems[0][1] == 1
+    assert "Faltan columnas obligatorias" in problems[0][4]
+
+
+def test_validar_fila_mal_formada_informa_su_linea(base, importar, tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "IMPORT_CHUNK", 10)
+    filas = [["1", f"C{i}", "x", "21", "1", "0", "1", "1", ""] for i in range(25)]
+    filas[22].append("de más")   # línea 24 del archivo
+    path = _csv(tmp_path / "a.csv", filas)
+
+    total, problems = importar(path, "validar")[1]
+
+    assert total == 20   # los dos lotes completos anteriores
+    assert [(p[1], p[2]) for p in problems] == [(24, "")]
+    assert "no se pudo leer el archivo" in problems[0][4]
+
+
+ENCABEZADO_CAT = ["categoria"] + ENCABEZADO
+
+
+def _fila(cat, codigo, precio, descripcion="x"):
+    return [cat, "1", codigo, descripcion, "21 %", precio, "0", "1", "1", ""]
+
+
+def _productos(app):
+    return db.query(f"SELECT categoria, codigo, descripcion, precio_lista FROM {app.TABLE_NAME} ORDER BY id")
+
+
+def test_fusion_por_categoria_cuenta_filas_del_archivo(base, importar, tmp_path):
+    importar(_csv(tmp_path / "a.csv", [
+        _fila("Gas", "G1", "10"), _fila("Gas", "G2", "20"), _fila("Agua", "G1", "30"),
+    ], ENCABEZADO_CAT), "agregar")
+
+    estado, cuentas = importar(_csv(tmp_path / "b.csv", [
+        _fila("Gas", "G1", "11"),                       # cambia
+        _fila("Gas", "G2", "20"),                       # igual
+        _fila("Gas", "G3", "40", "primera"),            # nuevo, repetido más abajo
+        _fila("Gas", "", "50", "sin código"),           # sin código: siempre se agrega
+        _fila("Gas", "G3", "41", "última"),             # gana la última
+    ], ENCABEZADO_CAT), "categoria")
+
+    assert estado == "listo"
+    assert cuentas == {"insertados": 2, "actualizados": 1, "sin_cambios": 1, "repetidos": 1}
+    assert _productos(base) == [
+        ("Gas", "G1", "x", 11.0), ("Gas", "G2", "x", 20.0), ("Agua", "G1", "x", 30.0),
+        ("Gas", "", "sin código", 50.0), ("Gas", "G3", "última", 41.0),
+    ]
+
+
+def test_fusion_en_todas_las_categorias(base, importar, tmp_path):
+    importar(_csv(tmp_path / "a.csv", [_fila("Agua", "G1", "30")], ENCABEZADO_CAT), "agregar")
+
+    _, cuentas = importar(_csv(tmp_path / "b.csv", [_fila("Gas", "G1", "31")], ENCABEZADO_CAT), "todas")
+
+    # Coincide por código aunque la fila venga con otra categoría; la categoría no cambia
+    assert (cuentas["insertados"], cuentas["actualizados"]) == (0, 1)
+    assert _productos(base) == [("Agua", "G1", "x", 31.0)]
+
+
+def test_validar_lote_informa_cada_problema(base, importar, tmp_path):
+    importar(_csv(tmp_path / "a.csv", [_fila("Agua", "E1", "1")], ENCABEZADO_CAT), "agregar")
+    path = _csv(tmp_path / "b.csv", [
+        ["Gas", "-1", "A1", "x", "21", "1", "0", "1", "1", ""],
+        ["Gas", "2.5", "A2", "x", "150", "abc", "0", "1", "1", ""],
+        ["Gas", "1", "A1", "x", "10.5", "1", "0", "1", "1", ""],
+        ["Gas", "1", "E1", "x", "21", "1", "0", "1", "1", ""],
+    ], ENCABEZADO_CAT)
+
+    total, problems = importar(path, "validar")[1]
+
+    assert total == 4
+    assert sorted((linea, columna, problema) for _h, linea, columna, _v, problema in problems) == [
+        (2, "Cantidad", "cantidad negativa"),
+        (3, "Cantidad", "la cantidad no es entera"),
+        (3, "IVA", "IVA fuera de rango (0 a 100)"),
+        (3, "P. lista", "no es un número"),
+        (4, "Cod. Art.", "Cod. Art. repetido en el archivo (línea 2)"),
+        (4, "IVA", "el IVA no es entero (se guardaría sin decimales)"),
+        (5, "Cod. Art.", "Cod. Art. ya existe en la base (categoría Agua)"),
+    ]
+    # Validar no escribe nada
+    assert len(_productos(base)) == 1
@@ -0,0 +1,66 @@
+import sqlite3
+
+import db
+
+
+def _base_antigua(path, filas):
+    """Base como la de versiones anteriores: sin user_version y con números guardados como texto."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE productos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, categoria TEXT, codigo TEXT,
+            descripcion TEXT, cantidad INTEGER, precio_lista REAL, iva INTEGER,
+            bnf REAL DEFAULT 0, precio_final REAL, importe REAL, fecha_retiro TEXT
+        )
+    """)
+    conn.executemany("""
+        INSERT INTO productos (categoria, codigo, descripcion, cantidad, precio_lista,
+                               iva, bnf, precio_final, importe, fecha_retiro)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, filas)
+    conn.commit()
+    conn.close()
+
+
+def test_base_nueva_queda_en_la_ultima_version(app):
+    assert app.init_db() == 0
+    assert db.scalar("PRAGMA user_version") == len(app.MIGRATIONS)
+    assert db.query(f"SELECT * FROM {app.LEGACY_TEXT_TABLE}") == []
+
+
+def test_migra_textos_a_numeros(app):
+    _base_antigua(app.DB_PATH, [
+        ("Gas", "G1", "Llave", "3", "1.234,5 $", "10.5 %", "0", "1364,12 $", "4092.36 $", "01/10/2026"),
+        ("Gas", "G2", "Caño", 2, 100.0, 21, 0, 121.0, 242.0, ""),
+    ])
+
+    assert app.init_db() == 0
+
+    rows = db.query("""
+        SELECT codigo, cantidad, precio_lista, iva, precio_final, importe, typeof(iva)
+          FROM productos ORDER BY id
+    """)
+    assert rows == [
+        ("G1", 3, 1234.5, 10.5, 1364.12, 4092.36, "real"),
+        ("G2", 2, 100.0, 21, 121.0, 242.0, "integer"),
+    ]
+    # Los totales y el orden con huecos se calculan sobre los valores ya convertidos
+    assert db.query(f"SELECT productos FROM {app.TOTALS_TABLE} WHERE categoria = ?", (app.TOTALS_ALL,)) == [(2,)]
+    assert [r[0] for r in db.query("SELECT orden FROM productos ORDER BY id")] == [app.ORDEN_GAP, 2 * app.ORDEN_GAP]
+
+
+def test_textos_ilegibles_quedan_guardados(app):
+    _base_antigua(app.DB_PATH, [
+        ("Gas", "G1", "Llave", "abc", "consultar", "21 %", "0", "10 $", "n/d", ""),
+        ("Gas", "G2", "Caño", "2,5", "10 $", "21 %", "0", "12,1 $", "24,2 $", ""),
+    ])
+
+    app.init_db()
+
+    assert db.query("SELECT cantidad, precio_lista, importe FROM productos ORDER BY id") == [
+        (0, 0.0, 0.0), (2, 10.0, 24.2),
+    ]
+    assert db.query(f"SELECT id, columna, texto FROM {app.LEGACY_TEXT_TABLE} ORDER BY id, columna") == [
+        (1, "cantidad", "abc"), (1, "importe", "n/d"), (1, "precio_lista", "consultar"),
+        (2, "cantidad", "2,5"),
+    ]
@@ -0,0 +1,36 @@
+import math
+
+import pandas as pd
+
+import numeros
+
+
+def test_parse_number():
+    assert numeros.parse_number("1.234,56 $") == 1234.56
+    assert numeros.parse_number("1,234.56") == 1234.56
+    assert numeros.parse_number("21 %") == 21.0
+    assert numeros.parse_number("") == 0.0
+    assert numeros.parse_number(None) == 0.0
+    assert numeros.parse_number("abc") == 0.0
+
+
+def test_parse_number_no_acepta_inf_ni_nan():
+    for texto in ("inf", "-Infinity", "nan", "NaN $", float("inf")):
+        assert numeros.parse_number(texto) == 0.0
+
+
+def test_parse_series_marca_las_celdas_ilegibles():
+    serie = pd.Series(["10,5 $", "abc", None, "", "inf", "nan", "3"], dtype=object)
+
+    values, bad = numeros.parse_series(serie)
+
+    assert values.tolist() == [10.5, 0.0, 0.0, 0.0, 0.0, 0.0, 3.0]
+    assert bad.tolist() == [False, True, False, False, True, True, False]
+    assert all(math.isfinite(v) for v in values)
+
+
+def test_parse_series_numerica():
+    values, bad = numeros.parse_series(pd.Series([1.5, float("nan"), float("inf")]))
+
+    assert values.tolist() == [1.5, 0.0, 0.0]
+    assert bad.tolist() == [False, False, True]
@@ -0,0 +1,82 @@
+import random
+
+import db
+
+
+def _agregar(app, cat, n):
+    with db.transaction() as conn:
+        for i in range(n):
+            conn.execute(f"INSERT INTO {app.TABLE_NAME} (categoria, descripcion, orden) VALUES (?, ?, ?)",
+                         (cat, f"p{i}", app._siguiente_orden(conn, cat)))
+
+
+def _orden(app, cat):
+    return db.query(f"SELECT id, orden FROM {app.TABLE_NAME} WHERE categoria = ? ORDER BY orden, id", (cat,))
+
+
+def _mover(app, modelo, ids, target):
+    """Lo que debería pasar: el bloque queda junto al destino (después si bajaba, antes si subía)."""
+    bloque = [i for i in modelo if i in ids]
+    baja = modelo.index(bloque[0]) < modelo.index(target)
+    resto = [i for i in modelo if i not in ids]
+    pos = resto.index(target) + (1 if baja else 0)
+    return resto[:pos] + bloque + resto[pos:]
+
+
+def test_siguiente_orden_deja_huecos(app):
+    app.init_db()
+    _agregar(app, "Gas", 3)
+
+    assert [o for _id, o in _orden(app, "Gas")] == [app.ORDEN_GAP, 2 * app.ORDEN_GAP, 3 * app.ORDEN_GAP]
+
+
+def test_mover_un_producto_escribe_una_fila(app):
+    app.init_db()
+    _agregar(app, "Gas", 5)
+    with db.transaction() as conn:
+        antes = conn.total_changes
+        renumerada = app._orden_junto_a(conn, [5], 2)
+        cambios = conn.total_changes - antes
+
+    assert not renumerada
+    assert cambios == 1
+    assert [i for i, _o in _orden(app, "Gas")] == [1, 5, 2, 3, 4]
+
+
+def test_movimientos_al_azar_mantienen_orden_unico(app):
+    app.init_db()
+    _agregar(app, "Gas", 40)
+    _agregar(app, "Agua", 5)
+    rnd = random.Random(12)
+    modelo = [i for i, _o in _orden(app, "Gas")]
+    renumeradas = 0
+    for _ in range(300):
+        if rnd.random() < 0.5:
+            # Siempre entre los dos primeros: agota el hueco y obliga a renumerar
+            ids, target = rnd.sample(modelo[2:], rnd.randint(1, 4)), modelo[1]
+        else:
+            ids = rnd.sample(modelo, rnd.randint(1, 4))
+            target = rnd.choice([i for i in modelo if i not in ids])
+        with db.transaction() as conn:
+            renumeradas += app._orden_junto_a(conn, ids, target)
+        modelo = _mover(app, modelo, ids, target)
+
+        filas = _orden(app, "Gas")
+        assert [i for i, _o in filas] == modelo
+        assert len({o for _i, o in filas}) == len(filas)
+    assert renumeradas > 0
+    # La otra categoría no se toca
+    assert [o for _id, o in _orden(app, "Agua")] == [app.ORDEN_GAP * k for k in range(1, 6)]
+
+
+def test_mover_y_deshacer(app):
+    app.init_db()
+    _agregar(app, "Gas", 6)
+    inicial = _orden(app, "Gas")
+    with app.undo_journal.step("Mover") as conn:
+        app._orden_junto_a(conn, [1, 2], 6)
+    assert [i for i, _o in _orden(app, "Gas")] == [3, 4, 5, 6, 1, 2]
+
+    app.undo_journal.undo()
+
+    assert _orden(app, "Gas") == inicial